@@ -2,14 +2,18 @@
 A script to help with AB hypothesis testing.
 """
 
-import random
 import numpy as np
-import pandas as pd
 import math
 import matplotlib.pyplot as plt
 from scipy.stats import norm
-import math as mt
 import logging
+from bernoulliSeries import (bernoulli_series, count_successes, series_length,
+                             series_tail)
+from groupSequential import (check_design, group_sequential_test,
+                             hourly_aggregates)
+from sequential_test_script import hourly_counts
+from sprtKernel import (conditional_sprt, critical_limits, scan_statistics,
+                        sprt_statistics, truncate)
 
 
 class abTestHelper():
@@ -121,7 +125,7 @@ class abTestHelper():
         """
         try:
             self.logger.info('calculating standard deviation')
-            std = mt.sqrt(p * (1-p) / (total))
+            std = math.sqrt(p * (1-p) / (total))
         except Exception as e:
             self.logger.error(e)
             print(e)
@@ -145,7 +149,7 @@ class abTestHelper():
         """
         try:
             self.logger.info('calculating pooled standard deviation')
-            pooled_std = mt.sqrt(p_pooled * (1-p_pooled) *
+            pooled_std = math.sqrt(p_pooled * (1-p_pooled) *
                                  (1/control_total+1/exposed_total))
         except Exception as e:
             self.logger.error(e)
@@ -155,11 +159,11 @@ class abTestHelper():
                              'returned')
             return pooled_std
 
-    def transform_data(self, df):
+    def transform_data(self, df, seed=None, packed=False):
         '''
         segment data into exposed and control groups
         consider that SmartAd runs the experiment hourly, group data into hours. 
-            Hint: create new column to hold date+hour and use df.column.map(lambda x:  pd.Timestamp(x,tz=None).strftime('%Y-%m-%d:%H'))
+            the hour key is the int64 number of hours since the epoch of the date and hour columns (see dataLoader.epoch_hours)
         create two data frame with bernoulli series 1 for positive(yes) and 0 for negative(no)
             Hint: Given engagement(sum of yes and no until current observation as an array) and success (yes count as an array), the method generates random binomial distribution
                 #Example
@@ -168,57 +172,46 @@ class abTestHelper():
                 Output is "[1] 1 0 1 0 0 0 0 0 1 1 1", showing a binary array of 5+3+3 values
                 of which 2 of the first 5 are ones, 0 of the next 3 are ones, and all 3 of
                 the last 3 are ones where position the ones is randomly distributed within each group.
+        the ones are placed by a numpy Generator seeded with `seed`, and the
+        series are int8 arrays, or (packed, length) pairs of their
+        bit-packed form (see bernoulliSeries) if `packed` is True, which
+        conditionalSPRT and ConditionalSPRT accept as they are
         '''
 
-        def get_bernoulli_series(engagement_list, success_list):
-            bernoulli_series = []
+        # the per-hour (engagement, success) counts of both groups, empty
+        # for a group without engaged users
+        counts = hourly_counts(df)
 
-            self.logger.info('preparing bernoulli series')
-            for engagement, success in zip(engagement_list, success_list):
-                no_list = (engagement - success) * [0]
-                yes_list = (success) * [1]
-                series_item = yes_list + no_list
-                random.shuffle(series_item)
-                bernoulli_series += series_item
-            self.logger.info('returning bernoulli series')
-            return np.array(bernoulli_series)
-
-        clean_df = df.query("not (yes == 0 & no == 0)")
-
-        exposed = clean_df[clean_df['experiment'] == 'exposed']
-        control = clean_df[clean_df['experiment'] == 'control']
-
-        # group data into hours.
-        control['hour'] = control['hour'].astype('str')
-        control['date_hour'] = pd.to_datetime(control['date'] + " " + control['hour'] + ":00:00")
-        control['date_hour'] = control['date_hour'].map(lambda x:  pd.Timestamp(x, tz=None).strftime('%Y-%m-%d:%H'))
-
-        exposed['hour'] = exposed['hour'].astype('str')
-        exposed['date_hour'] = pd.to_datetime( exposed['date'] + " " + exposed['hour'] + ":00:00")
-        exposed['date_hour'] = exposed['date_hour'].map( lambda x:  pd.Timestamp(x, tz=None).strftime('%Y-%m-%d:%H'))
+        # independent streams for the two groups
+        control_seed, exposed_seed = np.random.SeedSequence(seed).spawn(2)
 
         # create two data frame with bernoulli series 1 for positive(yes) and 0 for negative(no)
         self.logger.info('preparing control group bernoulli series')
-        cont = exposed.groupby('date_hour').agg({'yes': 'sum', 'no': 'count'})
-        cont = cont.rename(columns={'no': 'total'})
-        control_bernoulli = get_bernoulli_series(
-            cont['total'].to_list(), cont['yes'].to_list())
+        control_bernoulli = bernoulli_series(*counts['control'],
+                                             control_seed, packed)
 
         self.logger.info('preparing exposed group bernoulli series')
-        exp = exposed.groupby('date_hour').agg({'yes': 'sum', 'no': 'count'})
-        exp = exp.rename(columns={'no': 'total'})
-        exposed_bernoulli = get_bernoulli_series(
-            exp['total'].to_list(), exp['yes'].to_list())
+        exposed_bernoulli = bernoulli_series(*counts['exposed'],
+                                             exposed_seed, packed)
+
+        if packed:
+            control_bernoulli = (control_bernoulli,
+                                 int(counts['control'][0].sum()))
+            exposed_bernoulli = (exposed_bernoulli,
+                                 int(counts['exposed'][0].sum()))
 
         self.logger.info('returning control and exposed group bernoulli series')
         return control_bernoulli, exposed_bernoulli
 
-    def conditionalSPRT(self, x,y,t1,alpha=0.05,beta=0.10,stop=None):
+    def conditionalSPRT(self, x,y,t1,alpha=0.05,beta=0.10,stop=None,table=None,early_exit=False):
         """
         #
         # Meeker's SPRT for matched `x` (treatment) and `y` (control), 
         # both indicator responses, likelihood ratio t1, error rates alpha and beta,
-        # and (optionally) truncation after trial stop.
+        # and (optionally) truncation after trial stop. The limits are looked up
+        # in `table`, a boundaryTable.BoundaryTable of the same t1, if given.
+        # With early_exit=True the statistic is evaluated in blocks and the
+        # arrays of the result stop at the first crossing `k`.
         #
         # The return variable contains these elements:
         #(outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits)
@@ -243,170 +236,53 @@ class abTestHelper():
                         +" You should have good reason to use large alpha & beta values")
             # self.logger.warn("Unrealistic values of alpha or beta were passed."
                         # +" You should have good reason to use large alpha & beta values")
-        if stop!=None:
-            stop=math.floor(n0)
-
-        def comb(n, k):
-            return math.factorial(n) // math.factorial(k) // math.factorial(n - k)
-
-        def l_choose(b, j):
-            a=[]
-            if (type(j) is list) | (isinstance(j,np.ndarray)==True):
-                if len(j)<2:
-                    j=j[0]
-            if (type(j) is list) | (isinstance(j,np.ndarray)==True):
-                for k in j:
-                    n=b
-                    if (0 <= k) & (k<= n):
-                        a.append(math.log(comb(n,k)))
-                    else:
-                        a.append(0)
-            else:
-                n=b
-                k=j
-                if (0 <= k) & (k<= n):
-                    a.append(math.log(comb(n,k)))
-                else:
-                    a.append(0)
-
-            return np.array(a)
-
-        def g(x,r,n,t1,t0=1):
-            """
-            #
-            # Meeker's (1981) function `g`, the log probability ratio.
-            # 
-            """
-            return -math.log(h(x,r,n,t1))+math.log(h(x,r,n,t0))
-
-        def h(x,r,n,t=1):
-            """
-            #
-            # Reciprocal of Meeker's (1981) function `h`: the conditional probability of 
-            # `x` given `r` and `n`, when the odds ratio is `t`.
-            #
-            # `x` is his "x1", the number of positives in `n` control trials.
-            # `r` is the total number of positives.
-            # `n` is the number of (control, treatment) pairs.
-            # `t` is the odds ratio.
-            #
-            """
-            return f(r,n,t,offset=ftermlog(x,r,n,t))
-
-        def f(r,n,t,offset=0):
-            """#
-            # Meeker's (1981) function exp(F(r,n,t)), proportional to the probability of 
-            #  `r` (=x1+x2) in `n` paired trials with an odds ratio of `t`.
-            #
-            # This function does *not* vectorized over its arguments.
-            #"""
-            upper=max(0,r-n)
-            lower=min(n,r)
-            rng=list(range(upper,lower+1))
-            return np.sum(fterm(rng,r,n,t,offset))
-
-        def fterm(j,r,n,t,offset=0):
-            ft_log=ftermlog(j,r,n,t,offset)
-            return np.array([math.exp(ex) for ex in ft_log])
-
-        def ftermlog(j,r,n,t,offset=0):
-            """
-            #
-            # Up to an additive constant, the log probability that (x1, x1+x2) = (j, r) 
-            # in `n` paired trials with odds ratio of `t`.
-            #
-            # `offset` is used to adjust the result to avoid under/overflow.
-            #
-            """
-            xx=r-j
-            lch=l_choose(n,j)
-            lchdiff=l_choose(n,xx)
-            lg=np.array(j)*math.log(t)
-            lgsum=lch+lchdiff
-            lgsum2=lgsum+lg
-            lgdiff=lgsum2-offset
-
-            return lgdiff
-
-        def logf(r,n,t,offset=0):
-            """
-            #
-            # A protected version of log(f), Meeker's function `F`.
-            #
-            """
-            z=f(r,n,t,offset)
-            if z>0:
-                return math.log(z)
-            else:
-                return np.nan
-
-        def clowerUpper(r,n,t1c,t0=1,alpha=0.05,beta=0.10):
-            """
-            #
-            # Meeker's (1981) functions c_L(r,n) and c_U(r,n), the  critical values for x1.
-            # 0 <= r <= 2n; t1 >= t0 > 0.
-            #
-            """
-            offset=ftermlog(math.ceil(r/2),r,n,t1c)
-            z=logf(r,n,t1c,logf(r,n,t0,offset)+offset)
-            a=-math.log(alpha/(1-beta))
-            b=math.log(beta/(1-alpha))
-            lower=b
-            upper=1+a
-            return (np.array([lower,upper])+z)/math.log(t1c/t0)
-
-        l=math.log(beta/(1-alpha))
-        u=-math.log(alpha/(1-beta))
-        sample_size=min(len(x),len(y))
-        n=np.array(range(1,sample_size+1))
-
-        if stop!=None:
-            n=np.array([z for z in n if z<=stop])
-        x1=np.cumsum(x[n-1])
-        r=x1+np.cumsum(y[n-1])
-        stats=np.array(list(map(g,x1, r, n, [t1]*len(x1)))) #recursively calls g
-            #
-            # Perform the test by finding the first index, if any, at which `stats`
-            # falls outside the open interval (l, u).
-            #
-        clu=list(map(clowerUpper,r,n,[t1]*len(r),[1]*len(r),[alpha]*len(r), [beta]*len(r)))
-        limits=[]
-        for v in clu:
-            inArray=[]
-            for vin in v:
-                inArray.append(math.floor(vin))
-            limits.append(np.array(inArray))
-        limits=np.array(limits)
-
-        k=np.where((stats>=u) | (stats<=l))
-        c_values=stats[k]
-        if c_values.shape[0]<1:
-            k= np.nan
-            outcome='Unable to conclude.Needs more sample.'
-        else:
-            k=np.min(k)
-            if stats[k]>=u:
-                outcome=f'Exposed group produced a statistically significant increase.'
-            else:
-                outcome='Their is no statistically significant difference between two test groups'
-        if (stop!=None) & (k==np.nan):
-            #
-            # Truncate at trial stop, using Meeker's H0-conservative formula (2.2).
-            # Leave k=NA to indicate the decision was made due to truncation.
-            #
-            c1=clowerUpper(r,stop,t1,alpha,beta)
-            c1=math.floor(np.mean(c1)-0.5)
-            if x1[n0]<=c1:
-                truncate_decision='h0'
-                outcome='Maximum Limit Decision. The approximate decision point shows their is no statistically significant difference between two test groups'
-            else:
-                truncate_decision='h1'
-                outcome=f'Maximum Limit Decision. The approximate decision point shows exposed group produced a statistically significant increase.'
-            truncated=stop
-        else:
-            truncate_decision='Non'
-            truncated=np.nan
-        return (outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits)
+        return conditional_sprt(x, y, t1, alpha, beta, stop, table, early_exit)
+
+    def groupSequentialTest(self, df, max_sample, alpha=0.05,
+                            kind='obrien-fleming', sides=1):
+        """
+        A function to run the alpha-spending group-sequential test on the
+        hourly yes / no counts, one interim analysis per hour
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The experiment with date, hour, experiment, yes and no columns
+        max_sample: integer
+            The planned number of users of both groups, fixed before the
+            first look so the bounds of earlier hours never change
+        alpha: float
+            The overall type I error rate
+        kind: string
+            The spending function, 'obrien-fleming' or 'pocock'
+        sides: integer
+            1 to only detect an increase of the exposed group, 2 for both ways
+
+        Returns
+        =-----=
+        hours: pandas data frame
+            The hourly counts, with the information fraction, statistic and
+            critical value of every hour
+        (outcome, k, fractions, stats, bounds): tuple
+            The result of groupSequential.group_sequential_test
+        """
+        # an invalid design is the caller's error, not a failed computation
+        check_design(max_sample, alpha, kind, sides)
+        hours = res = None
+        try:
+            self.logger.info('aggregating hourly counts')
+            hours = hourly_aggregates(df)
+            res = group_sequential_test(
+                hours['exposed_engagement'], hours['exposed_success'],
+                hours['control_engagement'], hours['control_success'],
+                max_sample, alpha, kind, sides)
+            hours['fraction'], hours['stat'], hours['bound'] = res[2:]
+        except Exception as e:
+            self.logger.error(e)
+            print(e)
+        finally:
+            self.logger.info('group sequential test done')
+            return hours, res
 
 
 class ConditionalSPRT():
@@ -415,28 +291,203 @@ class ConditionalSPRT():
     # William Q. Meeker, Jr
     # Journal of the Royal Statistical Society. Series C (Applied Statistics)
     # Vol. 30, No. 2 (1981), pp. 109-115
-    def __init__(self, exposed, control, odd_ratio, alpha=0.05, beta=0.10, stop=None):
+    def __init__(self, exposed, control, odd_ratio, alpha=0.05, beta=0.10, stop=None, table=None,
+                 early_exit=False):
         self.exposed = exposed
         self.control = control
         self.odd_ratio = odd_ratio
         self.alpha = alpha
         self.beta = beta
         self.stop = stop
+        # optional precomputed boundaryTable.BoundaryTable of the odd ratio
+        self.table = table
+        # stop evaluating the statistic at the first boundary crossing
+        self.early_exit = early_exit
+
+        # running state of the test, advanced by run() and update()
+        self.n = 0
+        self.x1 = 0
+        self.r = 0
+        self.stat = np.nan
+        self.k = np.nan
+        self.outcome = 'Unable to conclude.Needs more sample.'
+        self.truncated = np.nan
+        self.truncate_decision = 'Non'
+        # observations still waiting for a partner from the other group
+        self.pending_exposed = np.zeros(0, dtype=np.int8)
+        self.pending_control = np.zeros(0, dtype=np.int8)
 
     def run(self):
-        res = abTestHelper.conditionalSPRT( self.exposed,
+        res = conditional_sprt(self.exposed,
                                self.control,
                                self.odd_ratio,
                                self.alpha,
                                self.beta,
-                               self.stop)
+                               self.stop,
+                               self.table,
+                               self.early_exit)
+        outcome, n, k, l, u, truncated, truncate_decision, x1, r, stats, limits = res
+        if len(n) > 0:
+            self.stat = float(stats[-1])
+        # the trace of an early exit run may end before the paired data does
+        self.n = min(series_length(self.exposed), series_length(self.control))
+        if self.stop is not None:
+            self.n = min(self.n, math.floor(self.stop))
+        self.x1 = count_successes(self.exposed, self.n)
+        self.r = self.x1 + count_successes(self.control, self.n)
+        self.k = k
+        self.outcome = outcome
+        self.truncated = truncated
+        self.truncate_decision = truncate_decision
+        if (self.stop is not None) and (self.n >= math.floor(self.stop)):
+            # a truncated test never reads past its truncation point
+            self.pending_exposed = np.zeros(0, dtype=np.int8)
+            self.pending_control = np.zeros(0, dtype=np.int8)
+        else:
+            self.pending_exposed = series_tail(self.exposed, self.n)
+            self.pending_control = series_tail(self.control, self.n)
         return res
 
+    def update(self, exposed_batch, control_batch):
+        """
+        A function to feed a new batch of observations to the running test
+
+        Only the new tail of the cumulative series is computed; observations
+        without a partner from the other group are kept for the next batch.
+        Once a truncated test reaches `stop` pairs it makes Meeker's
+        H0-conservative decision and ignores any further observation.
+
+        Parameters
+        =--------=
+        exposed_batch: array like or tuple
+            The new 0/1 responses of the exposed group, or a
+            (packed, length) pair of them
+        control_batch: array like or tuple
+            The new 0/1 responses of the control group, or a
+            (packed, length) pair of them
+
+        Returns
+        =-----=
+        res: tuple
+            The (outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,
+            limits) tuple of the new tail, with `n` and `k` counted from the
+            start of the experiment; with early_exit only the trace up to
+            the first crossing is computed and returned
+        """
+        x = np.concatenate([self.pending_exposed, series_tail(exposed_batch)])
+        y = np.concatenate([self.pending_control, series_tail(control_batch)])
+        size = min(len(x), len(y))
+        closed = False
+        if self.stop is not None:
+            size = min(size, max(math.floor(self.stop) - self.n, 0))
+            closed = self.n + size >= math.floor(self.stop)
+        if closed:
+            x, y = x[:size], y[:size]
+        self.pending_exposed = x[size:]
+        self.pending_control = y[size:]
+
+        l = math.log(self.beta / (1 - self.alpha))
+        u = -math.log(self.alpha / (1 - self.beta))
+        n = np.arange(self.n + 1, self.n + size + 1)
+        x1 = self.x1 + np.cumsum(x[:size], dtype=np.int64)
+        r = x1 + self.r - self.x1 + np.cumsum(y[:size], dtype=np.int64)
+        if not self.early_exit:
+            stats, z = sprt_statistics(x1, r, n, self.odd_ratio, self.table)
+        elif np.isnan(self.k):
+            stats, z = scan_statistics(x1, r, n, self.odd_ratio, l, u,
+                                       self.table)
+        else:
+            # decided already: only the running counts move on
+            stats, z = np.zeros(0), np.zeros(0)
+        limits = critical_limits(z, self.odd_ratio, self.alpha, self.beta)
+
+        # only the first crossing of the whole experiment is the decision
+        crossed = np.flatnonzero((stats >= u) | (stats <= l))
+        if np.isnan(self.k) and crossed.shape[0] > 0:
+            self.k = self.n + crossed[0]
+            if stats[crossed[0]] >= u:
+                self.outcome = 'Exposed group produced a statistically significant increase.'
+            else:
+                self.outcome = 'Their is no statistically significant difference between two test groups'
+
+        if size > 0:
+            self.n = int(n[-1])
+            self.x1 = int(x1[-1])
+            self.r = int(r[-1])
+        if len(stats) > 0:
+            self.stat = float(stats[-1])
+        if closed and (size > 0) and (len(stats) == size) and np.isnan(self.k):
+            # Meeker's H0-conservative decision at the truncation point
+            self.truncated = self.n
+            self.truncate_decision, self.outcome = truncate(
+                self.x1, z[-1], self.odd_ratio, self.alpha, self.beta)
+        trace = len(stats)
+        return (self.outcome, n[:trace], self.k, l, u, self.truncated,
+                self.truncate_decision, x1[:trace], r[:trace], stats, limits)
+
+    def save(self, path):
+        """
+        A function to save the running state of the test to a small file
+
+        Parameters
+        =--------=
+        path: string
+            The .npz file to write the state to
+        """
+        np.savez(path,
+                 design=np.array([self.odd_ratio, self.alpha, self.beta,
+                                  np.nan if self.stop is None else self.stop,
+                                  self.early_exit]),
+                 counts=np.array([self.n, self.x1, self.r], dtype=np.int64),
+                 stat=np.array([self.stat, self.k, self.truncated]),
+                 outcome=np.array([self.outcome, self.truncate_decision]),
+                 pending=np.array([len(self.pending_exposed),
+                                   len(self.pending_control)]),
+                 pending_exposed=np.packbits(self.pending_exposed),
+                 pending_control=np.packbits(self.pending_control))
+
+    @classmethod
+    def load(cls, path, table=None):
+        """
+        A function to resume a test from a state saved with save()
+
+        Parameters
+        =--------=
+        path: string
+            The .npz file holding the state
+        table: BoundaryTable
+            An optional precomputed boundary table of the same odd ratio
+
+        Returns
+        =-----=
+        sprt: ConditionalSPRT
+            The test, ready to receive the next batch through update()
+        """
+        with np.load(path) as state:
+            odd_ratio, alpha, beta, stop, early_exit = state['design'].tolist()
+            sprt = cls(np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8),
+                       odd_ratio, alpha, beta,
+                       None if np.isnan(stop) else int(stop), table,
+                       bool(early_exit))
+            sprt.n, sprt.x1, sprt.r = state['counts'].tolist()
+            sprt.stat, sprt.k, sprt.truncated = state['stat'].tolist()
+            if not np.isnan(sprt.k):
+                sprt.k = int(sprt.k)
+            if not np.isnan(sprt.truncated):
+                sprt.truncated = int(sprt.truncated)
+            sprt.outcome, sprt.truncate_decision = state['outcome'].tolist()
+            exposed_size, control_size = state['pending'].tolist()
+            sprt.pending_exposed = np.unpackbits(
+                state['pending_exposed'], count=exposed_size).astype(np.int8)
+            sprt.pending_control = np.unpackbits(
+                state['pending_control'], count=control_size).astype(np.int8)
+        return sprt
+
     def jsonResult(self, res):
         outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits = res
         res = {
             "decisionMade": outcome,
-            "numberOfObservation": len(n),
+            "numberOfObservation": int(n[-1]) if len(n) > 0 else 0,
             "truncated": truncated,
             "truncateDecision": truncate_decision
         }
@@ -0,0 +1,208 @@
+"""
+A batch trainer of the classifiers of the data splits.
+
+Every job trains one TrainingClassifier classifier (decision_tree,
+logistic_regression, random_forest or xgboost) on one split of the data,
+e.g. data1/browser.csv or data1/platform_os.csv: the split is read through
+the columnar cache, its categorical features are encoded with a vocabulary
+encoder, the classifier is cross validated on the training rows and scored
+on the held out rows. The jobs run on a process pool sized to the CPUs and
+to the memory the splits are expected to take, every worker reads its own
+split and writes its model, and the metrics of a job are written as soon as
+it completes.
+"""
+
+# imports
+import os
+import json
+import yaml
+import joblib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn import metrics
+from sklearn.model_selection import train_test_split
+from dataCache import cached_read
+from train_classifiers import TrainingClassifier
+from vocabularyEncoder import VocabularyEncoder
+
+
+# the memory a job takes, as a multiple of the size of its csv file
+_MEMORY_FACTOR = 20
+
+
+def job_name(dataset: str, classifier: str) -> str:
+    """
+    The name of the files of a job, e.g. browser_random_forest
+    """
+    return f'{os.path.splitext(os.path.basename(dataset))[0]}_{classifier}'
+
+
+def dataset_size(path: str) -> int:
+    """
+    The size in bytes of a data file, read from its .dvc file when the data
+    is not checked out, None if unknown
+    """
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    try:
+        with open(path + '.dvc') as dvc_file:
+            return int(yaml.safe_load(dvc_file)['outs'][0]['size'])
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def available_memory() -> int:
+    """
+    The memory in bytes available to new processes, None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def pool_size(jobs: list, workers: int = None,
+              memory_per_job: int = None) -> int:
+    """
+    A function to size the worker pool of a batch of jobs
+
+    Parameters
+    =--------=
+    jobs: list
+        The (dataset, classifier) jobs
+    workers: integer
+        The most workers to use, one per CPU if None
+    memory_per_job: integer
+        The bytes a job takes; estimated from the size of the largest
+        dataset if None
+
+    Returns
+    =-----=
+    workers: integer
+        The number of jobs that fit at once in the CPUs and the available
+        memory, at least 1
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if memory_per_job is None:
+        sizes = [dataset_size(dataset) for dataset, _ in jobs]
+        sizes = [size for size in sizes if size is not None]
+        if sizes:
+            memory_per_job = max(sizes) * _MEMORY_FACTOR
+    memory = available_memory()
+    if memory_per_job and memory is not None:
+        workers = min(workers, memory // memory_per_job)
+    return max(1, int(workers))
+
+
+def _train_job(job: tuple) -> dict:
+    """
+    Train one classifier on one split, write the model and its vocabulary,
+    and return its metrics
+    """
+    dataset, classifier, target, test_size, folds, seed, models_dir = job
+    name = job_name(dataset, classifier)
+
+    df = cached_read(dataset)
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed')])
+    df = df[df[target].notna()]
+    for column in df.select_dtypes('datetime').columns:
+        df[column] = df[column].dt.strftime('%Y-%m-%d')
+    X = df.drop(columns=[target])
+    y = df[target].astype(int)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=seed)
+
+    encoder = VocabularyEncoder(list(X.select_dtypes(
+        ['object', 'string', 'category']).columns)).fit(X_train)
+    trainer = TrainingClassifier(X_train, X_test, y_train, y_test,
+                                 classifier, encoder)
+    if 'random_state' in trainer.clf.get_params():
+        trainer.clf.set_params(random_state=seed)
+    _, accuracies, losses = trainer.train(folds)
+    # the model of the job is fitted on all the training rows
+    model = trainer.clf.fit(trainer.X_train, trainer.y_train)
+    pred = model.predict(trainer.X_test)
+
+    model_path = os.path.join(models_dir, f'{name}.pkl')
+    # write then rename, so a reader never sees a partial model
+    joblib.dump(model, model_path + '.partial')
+    os.replace(model_path + '.partial', model_path)
+    encoder.save(os.path.join(models_dir, f'{name}_vocabulary.json'))
+
+    return {'name': name, 'dataset': dataset, 'classifier': classifier,
+            'rows': len(df), 'features': list(X.columns),
+            'validation_accuracy': float(np.mean(accuracies)),
+            'validation_loss': float(np.mean(losses)),
+            'test_accuracy': float(metrics.accuracy_score(y_test, pred)),
+            'test_loss': float(np.sqrt(metrics.mean_squared_error(y_test,
+                                                                  pred))),
+            'model': model_path}
+
+
+def train_batch(jobs: list, models_dir: str = 'models',
+                target: str = 'awareness', test_size: float = 0.1,
+                folds: int = 5, workers: int = None,
+                memory_per_job: int = None, seed: int = 42) -> pd.DataFrame:
+    """
+    A function to train the classifiers of several splits concurrently
+
+    Parameters
+    =--------=
+    jobs: list
+        The (dataset, classifier) pairs, e.g. ('data1/browser.csv',
+        'random_forest')
+    models_dir: string
+        The folder of the models, their vocabularies and metrics
+    target: string
+        The label column of the datasets
+    test_size: float
+        The share of the rows held out for the test metrics
+    folds: integer
+        The number of cross validation folds on the training rows
+    workers: integer
+        The most worker processes, one per CPU if None, 1 to train in this
+        process; fewer are used if the jobs would not fit in memory
+    memory_per_job: integer
+        The bytes a job takes, estimated from the dataset sizes if None
+    seed: integer
+        The seed of the train test splits and of the classifiers
+
+    Returns
+    =-----=
+    metrics: pandas data frame
+        The metrics of every job, in the order the jobs completed; every
+        job also writes models_dir/<dataset>_<classifier>.pkl,
+        _vocabulary.json and _metrics.json
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    tasks = [(dataset, classifier, target, test_size, folds, seed,
+              models_dir) for dataset, classifier in jobs]
+    workers = pool_size(jobs, workers, memory_per_job)
+
+    results = []
+
+    def done(result):
+        with open(os.path.join(models_dir, f"{result['name']}_metrics.json"),
+                  'w') as metrics_file:
+            json.dump(result, metrics_file, indent=2)
+        results.append(result)
+
+    if workers == 1:
+        for task in tasks:
+            done(_train_job(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in as_completed([pool.submit(_train_job, task)
+                                        for task in tasks]):
+                done(future.result())
+    return pd.DataFrame(results)
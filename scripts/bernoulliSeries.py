@@ -0,0 +1,210 @@
+"""
+Compact, reproducible Bernoulli series for the sequential tests.
+
+The hourly aggregates of an experiment give, for every hour, the number of
+users that engaged and how many of them answered yes. The tests need one 0/1
+observation per user, with the yes answers randomly placed inside their own
+hour. The series is laid out with np.repeat and shuffled hour by hour with
+an explicitly seeded numpy Generator, so the same seed always gives the same
+series. It is stored as int8 (one byte per user) or bit-packed with
+np.packbits (one bit per user). The tests take a packed series as a
+(packed, length) pair and compute its cumulative sums chunk by chunk
+straight from the packed bytes.
+"""
+
+# imports
+import numpy as np
+
+
+# the number of observations unpacked at once by cumulative_successes
+_CHUNK = 1 << 22
+
+# the number of ones of every byte
+_BYTE_ONES = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                           axis=1).sum(axis=1)
+
+
+def bernoulli_series(engagement, success, seed=None,
+                     packed: bool = False) -> np.ndarray:
+    """
+    A function to build the 0/1 series of hourly engagement and success
+    counts
+
+    Example: engagement [5, 3, 3] and success [2, 0, 3] give 11 values, 2 of
+    the first 5 are ones, none of the next 3 and all of the last 3, e.g.
+    1 0 1 0 0 0 0 0 1 1 1
+
+    Parameters
+    =--------=
+    engagement: array like
+        The number of users (yes or no) of every hour
+    success: array like
+        The number of yes answers of every hour
+    seed: integer, SeedSequence or Generator
+        The seed of the numpy Generator that places the ones
+    packed: boolean
+        Whether to return the series bit-packed, 8 observations per byte
+
+    Returns
+    =-----=
+    series: numpy array
+        The int8 series, or its np.packbits uint8 form if packed is True
+    """
+    engagement = np.asarray(engagement, dtype=np.int64)
+    success = np.asarray(success, dtype=np.int64)
+    if np.any(success > engagement) or np.any(success < 0):
+        raise ValueError('success counts must be between 0 and engagement')
+    rng = np.random.default_rng(seed)
+
+    # the ones first in every hour, repeated straight into int8 so no
+    # array of the length of the series is wider than a byte
+    pattern = np.tile(np.array([1, 0], dtype=np.int8), len(success))
+    series = np.repeat(pattern, np.column_stack(
+        [success, engagement - success]).ravel())
+    starts = np.cumsum(engagement) - engagement
+
+    # shuffle every hour in place; hours with only ones or zeros are skipped
+    mixed = np.flatnonzero((success > 0) & (success < engagement))
+    for start, size in zip(starts[mixed], engagement[mixed]):
+        hour = series[start:start + size]
+        rng.permuted(hour, out=hour)
+
+    if packed:
+        return np.packbits(series)
+    return series
+
+
+def unpack_series(packed: np.ndarray, size: int) -> np.ndarray:
+    """
+    A function to restore the int8 series of a bit-packed one
+
+    Parameters
+    =--------=
+    packed: numpy array
+        The uint8 bytes returned by bernoulli_series(..., packed=True)
+    size: integer
+        The number of observations of the series
+
+    Returns
+    =-----=
+    series: numpy array
+        The int8 0/1 series
+    """
+    return np.unpackbits(packed, count=size).view(np.int8)
+
+
+def series_length(series) -> int:
+    """
+    A function to return the number of observations of an int8 series or
+    of a (packed, length) pair
+
+    Parameters
+    =--------=
+    series: numpy array or tuple
+        An int8 series, or a bit-packed one with its number of observations
+
+    Returns
+    =-----=
+    length: integer
+        The number of observations
+    """
+    if isinstance(series, tuple):
+        return int(series[1])
+    return len(series)
+
+
+def count_successes(series, size: int = None) -> int:
+    """
+    A function to count the ones of the first observations of a series,
+    reading the bytes of a packed series without unpacking them
+
+    Parameters
+    =--------=
+    series: numpy array or tuple
+        An int8 series, or a (packed, length) pair
+    size: integer
+        The number of leading observations counted, all of them if None
+
+    Returns
+    =-----=
+    count: integer
+        The number of ones
+    """
+    if not isinstance(series, tuple):
+        return int(np.sum(np.asarray(series)[:size], dtype=np.int64))
+    packed, length = series
+    size = length if size is None else min(size, length)
+    count = int(_BYTE_ONES[packed[:size // 8]].sum())
+    if size % 8:
+        count += int(np.unpackbits(packed[size // 8:size // 8 + 1],
+                                   count=size % 8).sum())
+    return count
+
+
+def series_tail(series, start: int = 0) -> np.ndarray:
+    """
+    A function to return the observations of a series from `start` on
+
+    Parameters
+    =--------=
+    series: numpy array or tuple
+        An int8 series, or a (packed, length) pair
+    start: integer
+        The first observation returned
+
+    Returns
+    =-----=
+    tail: numpy array
+        The int8 observations from `start` on; only the bytes of the tail of
+        a packed series are unpacked
+    """
+    if not isinstance(series, tuple):
+        return np.asarray(series[start:], dtype=np.int8)
+    packed, length = series
+    start = min(start, length)
+    first = start // 8
+    bits = np.unpackbits(packed[first:], count=length - 8 * first)
+    return bits[start - 8 * first:].view(np.int8)
+
+
+def cumulative_successes(series, size: int = None,
+                         chunk: int = _CHUNK) -> np.ndarray:
+    """
+    A function to compute the running number of ones of a series without
+    expanding all of it at once
+
+    Parameters
+    =--------=
+    series: numpy array or tuple
+        An int8 series, a bit-packed one if size is given, or a
+        (packed, length) pair
+    size: integer
+        The number of observations of a bit-packed series, or the number of
+        leading observations of a (packed, length) pair (all of them if
+        None); None for an int8 series
+    chunk: integer
+        The number of observations unpacked at once, a multiple of 8
+
+    Returns
+    =-----=
+    x1: numpy array
+        The int64 cumulative sums, as np.cumsum of the int8 series
+    """
+    if chunk <= 0 or chunk % 8:
+        raise ValueError('chunk must be a positive multiple of 8')
+    if isinstance(series, tuple):
+        series, length = series
+        size = length if size is None else min(size, length)
+    elif size is None:
+        return np.cumsum(series, dtype=np.int64)
+
+    x1 = np.empty(size, dtype=np.int64)
+    total = 0
+    for start in range(0, size, chunk):
+        stop = min(start + chunk, size)
+        bits = np.unpackbits(series[start // 8:(stop + 7) // 8],
+                             count=stop - start)
+        np.cumsum(bits, dtype=np.int64, out=x1[start:stop])
+        x1[start:stop] += total
+        total = x1[stop - 1]
+    return x1
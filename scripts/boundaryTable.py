@@ -0,0 +1,242 @@
+"""
+A persistent, memory-mapped table of the conditional SPRT log normalizers.
+
+Meeker's critical limits c_L(r, n) and c_U(r, n), as well as the log
+probability ratio, are all simple functions of the log normalizer z(r, n) of
+`sprtKernel.log_odds_normalizer`, which only depends on the odds ratio t1.
+The table stores z for n <= n_max and the band of r whose share of
+positives r / 2n lies within the expected rates of the design, so one file
+serves every experiment (and every alpha / beta) that uses the same odds
+ratio; the observations outside the band are computed by the kernel.
+
+The rows are built with the recurrence of the coefficients of
+(1 + (1 + t1) x + t1 x^2)^n, which only has positive terms and is therefore
+numerically stable:
+
+    S(n + 1, r) = S(n, r) + (1 + t1) S(n, r - 1) + t1 S(n, r - 2)
+
+Since z(n + 1, r) only depends on z(n, r - 2), ..., z(n, r), the rows are
+only built up to the top of the band of the last row. The bands of the rows
+are laid out one after the other in a flat float64 .npy file, next to which
+a small .json file records the odds ratio, the largest n and the rates. The
+full table of rates (0, 1) takes 8 (n_max + 1)^2 bytes, 80 GB at n_max =
+100000, and a band of width w about w times that; a table larger than
+max_bytes is not built.
+"""
+
+# imports
+import os
+import json
+import math
+import numpy as np
+from sprtKernel import critical_limits
+
+
+def _meta_path(path: str) -> str:
+    """
+    A function to return the path of the metadata file of a table
+    """
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _bands(n_max: int, rates: tuple) -> tuple:
+    """
+    The first and last stored r of every row, and the offset of every row
+    """
+    low, high = rates
+    n = np.arange(n_max + 1)
+    first = np.floor(2 * n * low).astype(np.int64)
+    last = np.minimum(2 * n, np.ceil(2 * n * high)).astype(np.int64)
+    offsets = np.zeros(n_max + 2, dtype=np.int64)
+    np.cumsum(last - first + 1, out=offsets[1:])
+    return first, last, offsets
+
+
+def next_boundary_row(row: np.ndarray, n: int, t1: float,
+                      size: int = None) -> np.ndarray:
+    """
+    A function to advance a row of log normalizers from n to n + 1 pairs
+
+    Since z(n + 1, r) only depends on z(n, r - 2), ..., z(n, r), a row cut at
+    some r stays exact below the cut.
+
+    Parameters
+    =--------=
+    row: numpy array
+        z(n, r) for r = 0, ..., len(row) - 1
+    n: integer
+        The number of pairs of `row`
+    t1: float
+        The odds ratio
+    size: integer
+        The number of entries of the new row, at most 2n + 3 (the default)
+        and at most len(row) + 2 for the result to be exact
+
+    Returns
+    =-----=
+    row: numpy array
+        z(n + 1, r) for r = 0, ..., size - 1
+    """
+    m = 2 * n + 2
+    size = m + 1 if size is None else min(size, m + 1)
+    r = np.arange(size, dtype=np.float64)
+    padded = np.full(size + 2, -np.inf)
+    known = min(len(row), size)
+    padded[2:known + 2] = row[:known]
+
+    # C(2n, r - d) / C(2n + 2, r) are ratios of small integer products
+    with np.errstate(divide='ignore'):
+        log_rest = np.log(m - r)
+        log_r = np.log(r)
+        base = math.log(m) + math.log(m - 1)
+        parts = np.vstack([
+            log_rest + np.log(np.maximum(m - 1 - r, 0)) + padded[2:],
+            math.log(1 + t1) + log_r + log_rest + padded[1:-1],
+            math.log(t1) + log_r + np.log(np.maximum(r - 1, 0)) + padded[:-2]
+        ])
+    top = parts.max(axis=0)
+    return np.log(np.exp(parts - top).sum(axis=0)) + top - base
+
+
+def build_boundary_table(path: str, t1: float, n_max: int,
+                         rates: tuple = (0.0, 1.0),
+                         max_bytes: int = 1 << 32) -> None:
+    """
+    A function to precompute the log normalizers of a design
+
+    Parameters
+    =--------=
+    path: string
+        The .npy file the table is written to
+    t1: float
+        The odds ratio of the alternative hypothesis
+    n_max: integer
+        The largest number of (treatment, control) pairs covered
+    rates: tuple
+        The lowest and highest share of positives r / 2n stored, e.g.
+        (0.05, 0.3) around a 15% success rate; (0, 1) stores every r
+    max_bytes: integer
+        The largest table built, 4 GiB by default
+
+    Returns
+    =-----=
+    None: nothing
+        The table and its metadata are written to disk
+    """
+    low, high = rates
+    if not 0 <= low <= high <= 1:
+        raise ValueError(f'the rates must satisfy 0 <= low <= high <= 1, '
+                         f'not {rates}')
+    first, last, offsets = _bands(n_max, rates)
+    if offsets[-1] * 8 > max_bytes:
+        raise ValueError(f'the table would take {offsets[-1] * 8} bytes, '
+                         f'more than max_bytes={max_bytes}; narrow the rates '
+                         f'or lower n_max')
+    table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                      shape=(int(offsets[-1]),))
+
+    # z(0, 0) = log(1) - log(1)
+    row = np.zeros(1)
+    table[0] = 0.0
+    for n in range(n_max):
+        # a row cut at the same r as the row before stays exact
+        row = next_boundary_row(row, n, t1, size=int(last[-1]) + 1)
+        table[offsets[n + 1]:offsets[n + 2]] = \
+            row[first[n + 1]:last[n + 1] + 1]
+    table.flush()
+    del table
+
+    with open(_meta_path(path), 'w') as meta:
+        json.dump({'t1': t1, 'n_max': n_max, 'rates': [low, high]}, meta)
+
+
+class BoundaryTable():
+    """
+    A memory-mapped boundary table built by build_boundary_table.
+    """
+    def __init__(self, path: str) -> None:
+        """
+        The boundary table initializer
+
+        Parameters
+        =--------=
+        path: string
+            The .npy file of the table
+
+        Returns
+        =-----=
+        None: nothing
+            The table is opened read-only and memory-mapped
+        """
+        with open(_meta_path(path)) as meta:
+            info = json.load(meta)
+        self.path = path
+        self.t1 = info['t1']
+        self.n_max = info['n_max']
+        self.rates = tuple(info.get('rates', (0.0, 1.0)))
+        self.first, self.last, self.offsets = _bands(self.n_max, self.rates)
+        self.z = np.load(path, mmap_mode='r')
+
+    def covers(self, r, n) -> np.ndarray:
+        """
+        A function to tell which observations the table holds
+
+        Parameters
+        =--------=
+        r: array like
+            The cumulative number of positives in both groups
+        n: array like
+            The number of (treatment, control) pairs
+
+        Returns
+        =-----=
+        mask: numpy array
+            True where n <= n_max and r is within the band of row n
+        """
+        r, n = np.asarray(r), np.asarray(n)
+        row = np.minimum(n, self.n_max)
+        return (n <= self.n_max) & (self.first[row] <= r) & \
+            (r <= self.last[row])
+
+    def lookup(self, r, n) -> np.ndarray:
+        """
+        A function to read the log normalizers z(r, n) of the table
+
+        Parameters
+        =--------=
+        r: array like
+            The cumulative number of positives in both groups
+        n: array like
+            The number of (treatment, control) pairs, all covered
+
+        Returns
+        =-----=
+        z: numpy array
+            The stored log normalizers
+        """
+        n = np.asarray(n, dtype=np.int64)
+        r = np.asarray(r, dtype=np.int64)
+        return np.asarray(self.z[self.offsets[n] + r - self.first[n]])
+
+    def limits(self, r, n, alpha: float = 0.05,
+               beta: float = 0.10) -> np.ndarray:
+        """
+        A function to read Meeker's critical limits of a design
+
+        Parameters
+        =--------=
+        r: array like
+            The cumulative number of positives in both groups
+        n: array like
+            The number of (treatment, control) pairs, all covered
+        alpha: float
+            The type I error rate
+        beta: float
+            The type II error rate
+
+        Returns
+        =-----=
+        limits: numpy array
+            Two columns giving the lower and upper critical limits
+        """
+        return critical_limits(self.lookup(r, n), self.t1, alpha, beta)
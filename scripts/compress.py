@@ -2,9 +2,9 @@
 
 # imports
 import sys
+import bz2
 import dvc.api
 import warnings
-import pandas as pd
 warnings.filterwarnings('ignore')
 
 # setting up logger
@@ -16,6 +16,7 @@ logger.info(f'created a data compressor logger for compress.py file.')
 sys.path.append('.')
 sys.path.insert(1, '../scripts/')
 from defaults import *
+from dataLoader import iter_chunks
 
 # read data using dvc
 #version = 'v1'
@@ -24,13 +25,16 @@ from defaults import *
 data_url = dvc.api.get_url(path = 'data/ABtwoCampaignEngView.csv')
 logger.info(f'obtained the data url: {data_url}')
 
-# reading the data
+# reading the data in typed chunks and streaming them to the compressed file
 missing_values = ["n/a", "na", "undefined", '?', 'NA', 'undefined']
-df = pd.read_csv(data_url, na_values=missing_values)
-logger.info(f'obtained the data {df.shape} from the data url: {data_url}')
-
-# compress and save the original dataset
-df.to_csv('../'+data_path + second_data_file + '.bz2', index=False)
+rows = 0
+with bz2.open('../'+data_path + second_data_file + '.bz2', 'wt') as compressed:
+    for chunk in iter_chunks(data_url, na_values=missing_values):
+        chunk.to_csv(compressed, header=(rows == 0), index=False)
+        rows += len(chunk)
+logger.info(f'obtained the data ({rows} rows) from the data url: {data_url}')
+
+# the original dataset is compressed and saved
 logger.info(f'file compressed and saved successfully to {data_path + second_data_file + ".bz2"}')
 print(f'file compressed and saved successfully to {data_path + second_data_file + ".bz2"}')
 
@@ -0,0 +1,205 @@
+"""
+A columnar cache of the DVC tracked data files.
+
+The first read of a given revision of a file parses the csv with the typed
+loader (see dataLoader) and writes a Parquet copy of it in a .cache folder
+next to the data, named after the md5 DVC records for that revision (or the
+md5 of the working tree copy, which is kept with the size and modification
+time of the file it was computed from, so an unchanged file is not hashed
+again). Later reads of the same content load only the asked columns from
+that copy, and a new revision gets a new copy. Without a Parquet engine
+(pyarrow or fastparquet) the copy is a pickle of the typed frame, which still
+skips the csv parsing but reads every column.
+"""
+
+# imports
+import os
+import json
+import yaml
+import hashlib
+import importlib.util
+import subprocess
+import pandas as pd
+from dataLoader import MISSING_VALUES, read_data
+
+
+# whether pandas can write parquet files here
+_PARQUET = any(importlib.util.find_spec(engine) is not None
+               for engine in ['pyarrow', 'fastparquet'])
+
+
+def file_md5(path: str, block: int = 1 << 20) -> str:
+    """
+    A function to compute the md5 of a file, a block at a time
+
+    Parameters
+    =--------=
+    path: string
+        The path of the file
+    block: integer
+        The number of bytes read at once
+
+    Returns
+    =-----=
+    md5: string
+        The hexadecimal md5 digest of the content
+    """
+    digest = hashlib.md5()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def working_md5(path: str, cache_dir: str = None) -> str:
+    """
+    A function to return the md5 of a working tree file, only hashing it
+    again when its size or modification time changed
+
+    Parameters
+    =--------=
+    path: string
+        The path of the file
+    cache_dir: string
+        The folder of the recorded digest, a .cache folder next to the file
+        if None
+
+    Returns
+    =-----=
+    md5: string
+        The hexadecimal md5 digest of the content
+    """
+    folder, name = os.path.split(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(folder, '.cache')
+    record = os.path.join(cache_dir, f'{name}.md5.json')
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(record) as digest:
+            saved = json.load(digest)
+        if saved['key'] == key:
+            return saved['md5']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    md5 = file_md5(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    partial = f'{record}.{os.getpid()}.partial'
+    with open(partial, 'w') as digest:
+        json.dump({'key': key, 'md5': md5}, digest)
+    os.replace(partial, record)
+    return md5
+
+
+def dvc_md5(path: str, rev: str = None) -> str:
+    """
+    A function to return the md5 DVC records for a tracked file
+
+    Parameters
+    =--------=
+    path: string
+        The path of the tracked file, e.g. data/AdSmartABdata.csv
+    rev: string
+        The git revision (e.g. a tag like v1), the working tree if None
+
+    Returns
+    =-----=
+    md5: string
+        The md5 of the .dvc file of that revision, or the md5 of the
+        local file if it is not tracked by DVC in the working tree
+    """
+    meta = path + '.dvc'
+    try:
+        if rev is None:
+            with open(meta) as dvc_file:
+                info = yaml.safe_load(dvc_file)
+        else:
+            info = yaml.safe_load(subprocess.run(
+                ['git', 'show', f'{rev}:{meta}'], capture_output=True,
+                check=True, text=True).stdout)
+        return info['outs'][0]['md5']
+    except (OSError, subprocess.CalledProcessError, KeyError, TypeError):
+        if rev is not None:
+            raise ValueError(f'{path} is not tracked by DVC at {rev}')
+        return file_md5(path)
+
+
+def cache_path(path: str, md5: str, cache_dir: str = None) -> str:
+    """
+    A function to return the path of the cached copy of a file revision
+
+    Parameters
+    =--------=
+    path: string
+        The path of the data file
+    md5: string
+        The content hash of the revision
+    cache_dir: string
+        The cache folder, a .cache folder next to the data if None
+
+    Returns
+    =-----=
+    path: string
+        The path of the Parquet (or pickle) copy
+    """
+    folder, name = os.path.split(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(folder, '.cache')
+    suffix = '.parquet' if _PARQUET else '.pkl'
+    return os.path.join(cache_dir,
+                        f'{os.path.splitext(name)[0]}-{md5}{suffix}')
+
+
+def cached_read(path: str, rev: str = None, columns: list = None,
+                na_values: list = MISSING_VALUES,
+                cache_dir: str = None) -> pd.DataFrame:
+    """
+    A function to read a DVC tracked csv file through the columnar cache
+
+    Parameters
+    =--------=
+    path: string
+        The path of the tracked file, e.g. data/AdSmartABdata.csv
+    rev: string
+        The git revision of the data; None reads the working tree copy,
+        keyed on the md5 of its content (see working_md5)
+    columns: list
+        The columns to load, all of them if None
+    na_values: list
+        The strings read as missing values when the csv is parsed
+    cache_dir: string
+        The cache folder, a .cache folder next to the data if None
+
+    Returns
+    =-----=
+    df: pandas data frame
+        The typed data
+    """
+    if rev is None and os.path.exists(path):
+        # the working tree copy may differ from what DVC last recorded
+        md5, url = working_md5(path, cache_dir), path
+    else:
+        md5, url = dvc_md5(path, rev), None
+    copy = cache_path(path, md5, cache_dir)
+    if os.path.exists(copy):
+        if _PARQUET:
+            return pd.read_parquet(copy, columns=columns)
+        df = pd.read_pickle(copy)
+        return df if columns is None else df[columns]
+
+    if url is None:
+        import dvc.api
+        url = dvc.api.get_url(path=path, rev=rev)
+    df = read_data(url, na_values=na_values)
+
+    os.makedirs(os.path.dirname(copy) or '.', exist_ok=True)
+    # write then rename, so a reader never sees a partial copy; processes
+    # caching the same file at once each write their own
+    partial = f'{copy}.{os.getpid()}.partial'
+    if _PARQUET:
+        df.to_parquet(partial, index=False)
+    else:
+        df.to_pickle(partial)
+    os.replace(partial, copy)
+    return df if columns is None else df[columns]
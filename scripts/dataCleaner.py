@@ -3,11 +3,71 @@ A script to clean data.
 """
 
 # imports
+import json
+import weakref
+import warnings
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
-from scipy.spatial.distance import cdist
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from quantileSketch import build_sketches
+
+
+# the quantiles kept in a column profile, by their profile column names
+PROFILE_QUANTILES = {'q05': 0.05, 'q25': 0.25, 'median': 0.5, 'q75': 0.75,
+                     'q95': 0.95}
+
+# the number of rows whose distances to the centers are computed at once
+_DISTANCE_CHUNK = 65536
+
+# the data of the k means sweep, set once in every worker process
+_sweep_data = None
+
+
+def _nearest_distances(X: np.ndarray, centers: np.ndarray,
+                       chunk: int = _DISTANCE_CHUNK) -> np.ndarray:
+    """
+    The squared euclidean distance of every row to its nearest center,
+    computed chunk by chunk so only a chunk x k block is ever allocated
+    """
+    nearest = np.empty(X.shape[0])
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, X.shape[0], chunk):
+        rows = X[start:start + chunk]
+        block = (rows ** 2).sum(axis=1)[:, None] - 2 * rows @ centers.T + \
+            center_norms[None, :]
+        nearest[start:start + chunk] = np.maximum(block.min(axis=1), 0)
+    return nearest
+
+
+def _init_sweep(X: np.ndarray) -> None:
+    """
+    The process pool initializer handing the data to a worker once
+    """
+    global _sweep_data
+    _sweep_data = X
+
+
+def _fit_k(job: tuple) -> tuple:
+    """
+    Fit one k of the sweep and measure its distortion and inertia
+    """
+    k, init, minibatch, batch_size, chunk = job
+    X = _sweep_data
+    if minibatch:
+        model = MiniBatchKMeans(n_clusters=k, random_state=777,
+                                batch_size=batch_size,
+                                init='k-means++' if init is None else init,
+                                n_init='auto' if init is None else 1)
+    else:
+        model = KMeans(n_clusters=k, random_state=777,
+                       init='k-means++' if init is None else init,
+                       n_init='auto' if init is None else 1)
+    model.fit(X)
+    nearest = _nearest_distances(X, model.cluster_centers_, chunk)
+    return (np.sqrt(nearest).mean(), nearest.sum(), model.cluster_centers_,
+            nearest.argmax())
 
 
 class dataCleaner():
@@ -29,6 +89,10 @@ class dataCleaner():
             This will return nothing, it just sets up the data cleaner
             script.
         """
+        # the cached profiles and the versions of the frames modified by the
+        # cleaner, by frame id
+        self._profiles = {}
+        self._versions = {}
         try:
             # setting up logger
             self.logger = self.setup_logger('logs/cleaner_root.log')
@@ -108,6 +172,106 @@ class dataCleaner():
         finally:
             return df
 
+    def _forget(self, frame_id: int):
+        """
+        The callback dropping the cache entries of a collected frame
+        """
+        def forget(reference):
+            self._profiles.pop(frame_id, None)
+            self._versions.pop(frame_id, None)
+        return forget
+
+    def _touch(self, df: pd.DataFrame) -> None:
+        """
+        Mark a frame as modified, so its cached profile is recomputed
+        """
+        self._versions[id(df)] = self._versions.get(id(df), 0) + 1
+
+    def profile(self, df: pd.DataFrame, refresh: bool = False) -> pd.DataFrame:
+        """
+        A function to compute the column statistics the fill and outlier
+        methods use, once per version of a frame
+
+        The profile is cached for the frame object, its shape, columns and
+        dtypes and the cleaner's own modifications of it; a frame modified
+        in place by other code needs refresh=True.
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The data frame to profile
+        refresh: boolean
+            Whether to recompute a cached profile
+
+        Returns
+        =-----=
+        profile: pandas data frame
+            One row per column with the count of non missing and missing
+            values and, for the numeric columns, the mean, the median and the
+            5%, 25%, 75% and 95% quantiles
+        """
+        key = (df.shape, tuple(df.columns), tuple(map(str, df.dtypes)),
+               self._versions.get(id(df), 0))
+        cached = self._profiles.get(id(df))
+        if (not refresh) and (cached is not None) and \
+                (cached[0]() is df) and (cached[1] == key):
+            return cached[2]
+
+        missing = df.isna().sum()
+        profile = pd.DataFrame({'count': len(df) - missing,
+                                'missing': missing})
+        numeric = df.select_dtypes('number').columns
+        if len(numeric) > 0:
+            values = df[numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+            with warnings.catch_warnings():
+                # all missing columns give nan statistics
+                warnings.simplefilter('ignore', RuntimeWarning)
+                means = np.nanmean(values, axis=0)
+                # all the quantiles of every column from one sort
+                quantiles = np.nanquantile(
+                    values, list(PROFILE_QUANTILES.values()), axis=0)
+            profile.loc[numeric, 'mean'] = means
+            for name, row in zip(PROFILE_QUANTILES, quantiles):
+                profile.loc[numeric, name] = row
+        else:
+            for name in ['mean'] + list(PROFILE_QUANTILES):
+                profile[name] = np.nan
+
+        # forget the frame once it is garbage collected
+        self._profiles[id(df)] = (weakref.ref(df, self._forget(id(df))), key,
+                                  profile)
+        self.logger.info(f'profile of {df.shape} data frame computed')
+        return profile
+
+    def export_profile(self, profile: pd.DataFrame, path: str) -> None:
+        """
+        A function to save a profile as json, e.g. to compare the data of
+        two DVC versions
+
+        Parameters
+        =--------=
+        profile: pandas data frame
+            The profile returned by the profile function
+        path: string
+            The json file to write
+
+        Returns
+        =-----=
+        None: nothing
+            The profile is written, one object per column
+        """
+        try:
+            columns = {str(column): {stat: (None if pd.isna(value) else
+                                            float(value))
+                                     for stat, value in row.items()}
+                       for column, row in profile.iterrows()}
+            with open(path, 'w') as out:
+                json.dump(columns, out, indent=2)
+            self.logger.info(f'profile exported to {path} successfully')
+        except Exception as e:
+            self.logger.error(e)
+            print(e)
+
     def percent_missing(self, df: pd.DataFrame) -> None:
         """
         A function telling how many missing values exist or better still
@@ -125,10 +289,10 @@ class dataCleaner():
         """
         try:
             # Calculate total number of cells in dataframe
-            totalCells = np.product(df.shape)
+            totalCells = df.shape[0] * df.shape[1]
 
             # Count number of missing values per column
-            missingCount = df.isnull().sum()
+            missingCount = self.profile(df)['missing']
 
             # Calculate total number of missing values
             totalMissing = missingCount.sum()
@@ -137,9 +301,9 @@ class dataCleaner():
             print("The dataset contains", round(((totalMissing/totalCells) *
                                                 100), 10), "%",
                   "missing values.")
-            self.logger.info("The dataset contains", round((
+            self.logger.info("The dataset contains " + str(round((
                                                 (totalMissing/totalCells)*100
-                                                ), 10), "%", "missing values")
+                                                ), 10)) + " % missing values")
         except Exception as e:
             self.logger.error(e)
             print(e)
@@ -191,7 +355,8 @@ class dataCleaner():
         """
         try:
             print(f'columns to be filled with median values: {cols}')
-            df[cols] = df[cols].fillna(df[cols].median())
+            df[cols] = df[cols].fillna(self.profile(df).loc[cols, 'median'])
+            self._touch(df)
             self.logger.info(f'cols: {cols} filled with median successfully')
         except Exception as e:
             self.logger.error(e)
@@ -219,7 +384,8 @@ class dataCleaner():
         """
         try:
             print(f'columns to be filled with mean values: {cols}')
-            df[cols] = df[cols].fillna(df[cols].mean())
+            df[cols] = df[cols].fillna(self.profile(df).loc[cols, 'mean'])
+            self._touch(df)
             self.logger.info(f'cols: {cols} filled with mean successfully')
         except Exception as e:
             self.logger.error(e)
@@ -245,8 +411,10 @@ class dataCleaner():
         """
         try:
             print(f'column to be filled with median values: {column}')
-            df[column] = np.where(df[column] > df[column].quantile(0.95),
-                                  df[column].median(), df[column])
+            stats = self.profile(df).loc[column]
+            df[column] = np.where(df[column] > stats['q95'],
+                                  stats['median'], df[column])
+            self._touch(df)
             self.logger.info(f'column: {column} outlier fixed successfully')
         except Exception as e:
             self.logger.error(e)
@@ -274,12 +442,15 @@ class dataCleaner():
             # TODO : either pass the outlier columns or checkout the columns
             # list
             column_name = list(df.columns[2:])
+            profile = self.profile(df)
+            self._touch(df)
             for i in column_name:
-                upper_quartile = df[i].quantile(0.75)
-                lower_quartile = df[i].quantile(0.25)
-                df[i] = np.where(df[i] > upper_quartile, df[i].median(),
+                upper_quartile = profile.loc[i, 'q75']
+                lower_quartile = profile.loc[i, 'q25']
+                median = profile.loc[i, 'median']
+                df[i] = np.where(df[i] > upper_quartile, median,
                                  np.where(df[i] < lower_quartile,
-                                 df[i].median(), df[i]))
+                                 median, df[i]))
             self.logger.info('outliers fixed successfully')
         except Exception as e:
             self.logger.error(e)
@@ -287,7 +458,90 @@ class dataCleaner():
         finally:
             return df
 
-    def choose_k_means(self, df: pd.DataFrame, num: int):
+    def outlier_sketches(self, data, columns: list = None, k: int = 200,
+                         seed=None) -> dict:
+        """
+        A function to sketch the quantiles of the numeric columns in one
+        streaming pass, for fix_outlier_sketched
+
+        Parameters
+        =--------=
+        data: pandas data frame or iterable of pandas data frames
+            The data, e.g. dataLoader.iter_chunks of a file
+        columns: list
+            The columns to sketch, all the numeric columns if None
+        k: integer
+            The accuracy of the sketches, a rank error of about 1.7 / k
+        seed: integer
+            The seed of the sketches
+
+        Returns
+        =-----=
+        sketches: dictionary
+            A quantileSketch.KLLSketch per column
+        """
+        sketches = {}
+        try:
+            self.logger.info('sketching the quantiles of the columns')
+            sketches = build_sketches(data, columns, k, seed)
+            self.logger.info(f'cols: {list(sketches)} sketched successfully')
+        except Exception as e:
+            self.logger.error(e)
+            print(e)
+        finally:
+            return sketches
+
+    def fix_outlier_sketched(self, df: pd.DataFrame, sketches: dict,
+                             lower: float = 0.25, upper: float = 0.75,
+                             replace: str = 'median') -> pd.DataFrame:
+        """
+        A function to fix outliers with the quantiles of sketches, so a
+        data set can be fixed chunk by chunk
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The data frame (or chunk) containing the outlier columns
+        sketches: dictionary
+            The sketches of the columns to fix, from outlier_sketches
+        lower: float
+            The quantile below which a value is an outlier, None for no
+            lower bound
+        upper: float
+            The quantile above which a value is an outlier, None for no
+            upper bound
+        replace: string
+            'median' to replace the outliers with the median (as
+            fix_outlier_ does), 'clip' to clip them to the bounds
+
+        Returns
+        =-----=
+        df: pandas data frame
+            The data frame with the outlier columns fixed
+        """
+        try:
+            for column, sketch in sketches.items():
+                low, high, median = sketch.quantile(
+                    [0 if lower is None else lower,
+                     1 if upper is None else upper, 0.5])
+                if replace == 'clip':
+                    df[column] = df[column].clip(low, high)
+                else:
+                    df[column] = np.where(
+                        (df[column] > high) | (df[column] < low), median,
+                        df[column])
+            self.logger.info(f'cols: {list(sketches)} outliers fixed ' +
+                             'successfully')
+        except Exception as e:
+            self.logger.error(e)
+            print(e)
+        finally:
+            return df
+
+    def choose_k_means(self, df: pd.DataFrame, num: int, workers: int = 1,
+                       minibatch: bool = False, warm_start: bool = False,
+                       batch_size: int = 1024,
+                       chunk: int = _DISTANCE_CHUNK):
         """
         A function to choose the optimal k means cluster
 
@@ -297,21 +551,47 @@ class dataCleaner():
             The data frame that holds all the values
         num: integer
             The x scale
+        workers: integer
+            The number of processes fitting the k values in parallel, None
+            for one per CPU
+        minibatch: boolean
+            Whether to fit MiniBatchKMeans instead of KMeans
+        warm_start: boolean
+            Whether to start every k from the k - 1 centers plus the
+            farthest row; the k values are then fitted one after another
+        batch_size: integer
+            The mini batch size of MiniBatchKMeans
+        chunk: integer
+            The number of rows whose distances are computed at once
 
         Returns
         =-----=
         distortions and inertias
         """
+        distortions = []
+        inertias = []
         try:
-            distortions = []
-            inertias = []
+            X = np.ascontiguousarray(df, dtype=np.float64)
             K = range(1, num)
-            for k in K:
-                k_means = KMeans(n_clusters=k, random_state=777).fit(df)
-                distortions.append(sum(
-                    np.min(cdist(df, k_means.cluster_centers_, 'euclidean'),
-                           axis=1)) / df.shape[0])
-                inertias.append(k_means.inertia_)
+            if warm_start or workers == 1:
+                _init_sweep(X)
+                init = None
+                for k in K:
+                    distortion, inertia, centers, farthest = _fit_k(
+                        (k, init, minibatch, batch_size, chunk))
+                    distortions.append(distortion)
+                    inertias.append(inertia)
+                    if warm_start:
+                        init = np.vstack([centers, X[farthest]])
+                _init_sweep(None)
+            else:
+                jobs = [(k, None, minibatch, batch_size, chunk) for k in K]
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_init_sweep,
+                                         initargs=(X,)) as pool:
+                    for distortion, inertia, _, _ in pool.map(_fit_k, jobs):
+                        distortions.append(distortion)
+                        inertias.append(inertia)
             self.logger.info(f'distortion: {distortions} and inertia:' +
                              f'{inertias} calculated for {num} number of'
                              'clusters successfully')
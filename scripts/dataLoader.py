@@ -0,0 +1,152 @@
+"""
+A typed, chunked loader of the SmartAd impression logs.
+
+The logs are read a chunk of rows at a time with declared dtypes, so the
+text columns become categoricals and the small counters int8 instead of
+object and int64 columns. `iter_chunks` lets a stage aggregate a file of
+any size chunk by chunk, and `read_data` assembles the chunks into one
+frame when the whole file fits in memory.
+"""
+
+# imports
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# the dtypes of the columns of AdSmartABdata.csv (and ABtwoCampaignEngView.csv)
+AD_SMART_DTYPES = {
+    'auction_id': 'string',
+    'experiment': 'category',
+    'device_make': 'category',
+    'platform_os': 'category',
+    'browser': 'category',
+    'hour': 'int8',
+    'yes': 'int8',
+    'no': 'int8',
+}
+
+# the columns parsed as dates
+AD_SMART_DATES = ['date']
+
+# the default missing value markers of the pipeline
+MISSING_VALUES = ["n/a", "na", "undefined", '?', 'NA', 'undefined']
+
+# the number of rows read at once
+_CHUNK_ROWS = 500000
+
+
+def iter_chunks(path: str, chunksize: int = _CHUNK_ROWS,
+                na_values: list = MISSING_VALUES, usecols: list = None,
+                dtypes: dict = AD_SMART_DTYPES,
+                dates: list = AD_SMART_DATES):
+    """
+    A function to iterate over a csv file in typed chunks
+
+    Parameters
+    =--------=
+    path: string
+        The path or url of the csv file
+    chunksize: integer
+        The number of rows of every chunk
+    na_values: list
+        The strings read as missing values
+    usecols: list
+        The columns to read, all of them if None
+    dtypes: dictionary
+        The dtype of every known column; unknown columns are inferred
+    dates: list
+        The columns parsed as dates
+
+    Returns
+    =-----=
+    chunks: iterator
+        Pandas data frames of at most chunksize rows
+    """
+    columns = pd.read_csv(path, nrows=0).columns
+    if usecols is not None:
+        columns = [c for c in columns if c in usecols]
+    dtype = {c: t for c, t in dtypes.items() if c in columns}
+    parse_dates = [c for c in dates if c in columns]
+
+    with pd.read_csv(path, usecols=usecols, dtype=dtype,
+                     parse_dates=parse_dates, date_format='%Y-%m-%d',
+                     na_values=na_values, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def read_data(path: str, chunksize: int = _CHUNK_ROWS,
+              na_values: list = MISSING_VALUES, usecols: list = None,
+              dtypes: dict = AD_SMART_DTYPES,
+              dates: list = AD_SMART_DATES) -> pd.DataFrame:
+    """
+    A function to read a whole csv file with typed columns
+
+    Parameters
+    =--------=
+    path: string
+        The path or url of the csv file
+    chunksize: integer
+        The number of rows read at once
+    na_values: list
+        The strings read as missing values
+    usecols: list
+        The columns to read, all of them if None
+    dtypes: dictionary
+        The dtype of every known column; unknown columns are inferred
+    dates: list
+        The columns parsed as dates
+
+    Returns
+    =-----=
+    df: pandas data frame
+        The typed data, its categorical columns sharing the categories of
+        every chunk
+    """
+    chunks = list(iter_chunks(path, chunksize, na_values, usecols, dtypes,
+                              dates))
+    if len(chunks) == 1:
+        return chunks[0]
+
+    # chunks see different categories; unify them before concatenating
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            union = union_categoricals([c[column] for c in chunks],
+                                       sort_categories=True)
+            for c in chunks:
+                c[column] = pd.Categorical(c[column],
+                                           categories=union.categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def epoch_hours(date, hour) -> np.ndarray:
+    """
+    A function to build the hour key of every row from its date and hour
+
+    Parameters
+    =--------=
+    date: array like
+        The dates, as datetimes or '%Y-%m-%d' strings (or categoricals),
+        none of them missing
+    hour: array like
+        The hours of the day
+
+    Returns
+    =-----=
+    hours: numpy array
+        The int64 number of hours since the epoch; sorting it sorts the rows
+        chronologically
+    """
+    date = pd.Series(date)
+    if pd.api.types.is_datetime64_any_dtype(date):
+        days = date.to_numpy().astype('datetime64[h]').astype(np.int64)
+    else:
+        # parse every distinct date once
+        codes, labels = pd.factorize(date)
+        if np.any(codes < 0):
+            raise ValueError('dates must not be missing')
+        parsed = pd.to_datetime(pd.Series(labels), format='%Y-%m-%d')
+        days = parsed.to_numpy().astype('datetime64[h]').astype(
+            np.int64)[codes]
+    return days + np.asarray(hour, dtype=np.int64)
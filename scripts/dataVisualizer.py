@@ -7,6 +7,73 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from edaHelper import count_frequencies
+
+
+def _long_counts(counts, column: str, hue: str = '') -> pd.DataFrame:
+    """
+    The long form (value, group, count) rows seaborn draws a bar plot of,
+    from the counts of edaHelper.count_frequencies
+    """
+    if hue == '':
+        return pd.DataFrame({column: counts.index, 'count': counts.values})
+    return counts.rename_axis(index=column, columns=hue).stack().rename(
+        'count').reset_index()
+
+
+def _aggregate(df: pd.DataFrame, spec: dict, counts: dict):
+    """
+    The pre-aggregated data a plot spec is drawn from: the counts of a
+    count plot, the largest counts of a pie plot or the correlations of a
+    heat map
+    """
+    kind = spec.get('kind', 'count')
+    if kind == 'count':
+        hue = spec.get('hue', '')
+        return _long_counts(counts[spec['column'] if hue == '' else
+                                   (spec['column'], hue)],
+                            spec['column'], hue)
+    if kind == 'pie':
+        return counts[spec['column']].nlargest(n=spec.get('largest', 10))
+    if kind == 'heatmap':
+        return df.corr(numeric_only=True)
+    raise ValueError(f'unknown plot kind {kind}')
+
+
+def _render_plot(job: tuple) -> str:
+    """
+    Draw one pre-aggregated plot on an off-screen Agg canvas and save it
+    """
+    spec, data = job
+    kind = spec.get('kind', 'count')
+    column = spec.get('column', '')
+    title = spec.get('title', '')
+    fig = Figure(figsize=(12, 7))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    if kind == 'count':
+        hue = spec.get('hue', '')
+        sns.barplot(data=data, x=column, y='count',
+                    hue=None if hue == '' else hue, ax=ax)
+        ax.set_title(f'Distribution of {title if title else column}',
+                     size=20, fontweight='bold')
+        ax.set_xlabel(f'{column}', fontsize=16)
+        ax.set_ylabel("Count", fontsize=16)
+        ax.tick_params(axis='x', labelrotation=45)
+    elif kind == 'pie':
+        colors = sns.color_palette('muted')[0:len(data)]
+        ax.pie(data.values, labels=data.keys(), colors=colors,
+               autopct='%.000f%%')
+        ax.set_title(title if title else f'{column} pie plot')
+    else:
+        sns.heatmap(data, annot=True, fmt='.5f', linewidths=1, cbar=True,
+                    ax=ax)
+        ax.set_title(title, size=20, fontweight='bold')
+    fig.savefig(spec['save_as'])
+    return spec['save_as']
 
 
 class dataVisualizer():
@@ -90,12 +157,16 @@ class dataVisualizer():
 
     # TODO : add the name and things from last weeks pie plot function
     def plot_pie(self, df: pd.DataFrame, column: str, title: str = '',
-                 largest: int = 10, save_as: str = '') -> None:
+                 largest: int = 10, save_as: str = '',
+                 counts: pd.Series = None) -> None:
         """
         A function to plot pie charts
 
         Parameters
         =--------=
+        counts: pandas series
+            The precomputed counts of the column (see
+            edaHelper.count_frequencies), counted from df if None
 
         Returns
         =-----=
@@ -104,7 +175,9 @@ class dataVisualizer():
         """
         # TODO : resolve this fig variable it is not being used
         # fig = plt.figure(figsize=(10, 10))
-        col = df[column].value_counts().nlargest(n=largest)
+        if counts is None:
+            counts = count_frequencies(df, [column], by=None)[column]
+        col = counts.nlargest(n=largest)
 
         data = col.values
         labels = col.keys()
@@ -125,6 +198,53 @@ class dataVisualizer():
         else:
             plt.savefig(save_as)
 
+    def plot_batch(self, df: pd.DataFrame, specs: list,
+                   workers: int = None, counts: dict = None) -> list:
+        """
+        A function to render and save several plots concurrently
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The data every plot is drawn from
+        specs: list
+            One dictionary per plot with its kind ('count', 'pie' or
+            'heatmap') and save_as path, plus the column, hue, title and
+            largest arguments of plot_count / plot_pie / plot_heatmap
+        workers: integer
+            The size of the process pool, 1 to render in this process
+        counts: dictionary
+            Precomputed edaHelper.count_frequencies of the columns; the
+            missing ones are counted here, in one pass per hue
+
+        Returns
+        =-----=
+        paths: list
+            The saved plot files, in the order of the specs
+        """
+        # workers only receive the small aggregated tables
+        self.logger.info(f'aggregating the data of {len(specs)} plots')
+        counts = {} if counts is None else dict(counts)
+        needed = {}
+        for spec in specs:
+            if spec.get('kind', 'count') not in ['count', 'pie']:
+                continue
+            hue = spec.get('hue', '')
+            key = spec['column'] if hue == '' else (spec['column'], hue)
+            if key not in counts:
+                needed.setdefault(None if hue == '' else hue, set()).add(
+                    spec['column'])
+        for hue, columns in needed.items():
+            counts.update(count_frequencies(df, sorted(columns), by=hue))
+        jobs = [(spec, _aggregate(df, spec, counts)) for spec in specs]
+        if workers == 1:
+            paths = [_render_plot(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                paths = list(pool.map(_render_plot, jobs))
+        self.logger.info(f'{len(paths)} plots saved successfully')
+        return paths
+
     def plot_hist(self, df: pd.DataFrame, column: str, color: str) -> None:
         # plt.figure(figsize=(15, 10))
         # fig, ax = plt.subplots(1, figsize=(12, 7))
@@ -138,13 +258,21 @@ class dataVisualizer():
         self.logger.info(f'{column} hist plot plotted successfully')
 
     def plot_count(self, df: pd.DataFrame, column: str, hue: str = '',
-                   title: str = '', save_as:str = '') -> None:
+                   title: str = '', save_as:str = '', counts=None) -> None:
+        # counts: the precomputed edaHelper.count_frequencies entry of the
+        # column (crossed with hue), so only the bars are drawn
         self.logger.info('setting up count plot')
         plt.figure(figsize=(12, 7))
+        if counts is None:
+            counts = count_frequencies(df, [column],
+                                       by=None if hue == '' else hue)
+            counts = counts[column if hue == '' else (column, hue)]
         if hue == '':
-            sns.countplot(data=df, x=column)
+            sns.barplot(data=_long_counts(counts, column), x=column,
+                        y='count')
         else:
-            sns.countplot(data=df, x=column, hue=hue)
+            sns.barplot(data=_long_counts(counts, column, hue), x=column,
+                        y='count', hue=hue)
         if title == '':
             plt.title(f'Distribution of {column}', size=20, fontweight='bold')
             self.logger.info(f'{column} count plot plotted successfully')
@@ -0,0 +1,134 @@
+"""
+Summaries of the experiment logs for the eda stage.
+
+The summaries are computed with one pass over the rows and accept a data
+frame or any iterable of data frames (e.g. dataLoader.iter_chunks), in which
+case the partial counts of the chunks are added up, so a log of any size is
+summarized without holding it in memory.
+"""
+
+# imports
+import numpy as np
+import pandas as pd
+
+
+def _chunks(data):
+    """
+    The chunks of a data frame or of an iterable of data frames
+    """
+    if isinstance(data, pd.DataFrame):
+        return [data]
+    return data
+
+
+def summarize_participation(data, group: str = 'experiment') -> pd.DataFrame:
+    """
+    A function to summarize the BIO participation of every experiment group
+
+    A user participated if they answered yes or no to the BIO questionnaire.
+
+    Parameters
+    =--------=
+    data: pandas data frame or iterable of pandas data frames
+        The logs, with the group, yes and no columns
+    group: string
+        The column of the experiment groups
+
+    Returns
+    =-----=
+    summary: pandas data frame
+        One row per group (sorted by name) with the yes and no totals, the
+        total participants and non participants, the total number of users
+        and the participants and non participants percentages
+    """
+    counts = None
+    for chunk in _chunks(data):
+        yes = chunk['yes'].to_numpy(dtype=np.int64)
+        no = chunk['no'].to_numpy(dtype=np.int64)
+        partial = pd.DataFrame({
+            'yes': yes,
+            'no': no,
+            'total non participants': ((yes == 0) & (no == 0)).astype(np.int64),
+            'total number': np.ones(len(yes), dtype=np.int64),
+        }).groupby(chunk[group].to_numpy()).sum()
+        counts = partial if counts is None else counts.add(partial,
+                                                           fill_value=0)
+
+    summary = counts.sort_index().astype(np.int64)
+    summary.index.name = group
+    summary.insert(2, 'total participants', summary['yes'] + summary['no'])
+    summary['participants percentage'] = \
+        summary['total participants'] / summary['total number'] * 100
+    summary['non participants percentage'] = \
+        summary['total non participants'] / summary['total number'] * 100
+    return summary
+
+
+def _codes(values: pd.Series) -> tuple:
+    """
+    The integer codes (-1 for missing values) and labels of a column, read
+    straight from a categorical or factorized otherwise
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+
+def count_frequencies(data, columns: list, by: str = 'experiment') -> dict:
+    """
+    A function to count the values of several columns, alone and crossed
+    with a group column, in one pass
+
+    Parameters
+    =--------=
+    data: pandas data frame or iterable of pandas data frames
+        The logs
+    columns: list
+        The columns to count
+    by: string
+        The group column the counts are crossed with, None for univariate
+        counts only
+
+    Returns
+    =-----=
+    counts: dictionary
+        counts[column] is a series of the counts of every value of the
+        column and counts[(column, by)] a data frame of the counts of every
+        (value, group) pair, both sorted by value; missing values are not
+        counted
+    """
+    counts = {}
+
+    def add(key, partial):
+        counts[key] = partial if key not in counts else \
+            counts[key].add(partial, fill_value=0)
+
+    for chunk in _chunks(data):
+        if by is not None:
+            by_codes, by_labels = _codes(chunk[by])
+        for column in columns:
+            codes, labels = _codes(chunk[column])
+            valid = codes >= 0
+            add(column, pd.Series(
+                np.bincount(codes[valid], minlength=len(labels)),
+                index=labels))
+            if by is None:
+                continue
+            # one bincount over the (value, group) pairs
+            valid &= by_codes >= 0
+            pairs = codes[valid].astype(np.int64) * len(by_labels) + \
+                by_codes[valid]
+            crossed = np.bincount(pairs, minlength=len(labels) *
+                                  len(by_labels))
+            add((column, by), pd.DataFrame(
+                crossed.reshape(len(labels), len(by_labels)), index=labels,
+                columns=by_labels))
+
+    for key in counts:
+        counts[key] = counts[key].sort_index().astype(np.int64)
+        counts[key].index.name = key if isinstance(key, str) else key[0]
+        if not isinstance(key, str):
+            counts[key].columns.name = by
+        else:
+            counts[key].name = 'count'
+    return counts
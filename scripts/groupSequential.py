@@ -0,0 +1,287 @@
+"""
+A group-sequential test that works on the hourly aggregates of an
+experiment.
+
+SmartAd reports the experiment hour by hour, so instead of expanding the
+counts into one Bernoulli observation per user, every hour is treated as an
+interim analysis (a "look") of a two-proportion z test on the cumulative
+counts. The overall type I error is controlled with Lan-DeMets alpha
+spending: at information fraction t (the share of the planned sample seen so
+far) the test may have spent at most alpha(t), with
+
+    O'Brien-Fleming type:  alpha(t) = 2 - 2 Phi(Phi^-1(1 - alpha / 2) / sqrt(t))
+    Pocock type:           alpha(t) = alpha log(1 + (e - 1) t)
+
+The critical value of every look is solved so that the probability of first
+crossing there equals the newly spent alpha, with the joint distribution of
+the looks computed by recursive numerical integration of the score process
+(Armitage, McPherson and Rowe; Jennison and Turnbull, chapter 19). The cost
+grows with the number of hours, not with the number of users.
+"""
+
+# imports
+import math
+import numpy as np
+import pandas as pd
+from scipy.optimize import brentq
+from scipy.stats import norm
+
+
+# the score process is followed up to this many standard deviations
+_SPAN = 8.0
+# the largest number of grid points of the score density at a look
+_MAX_GRID = 1500
+
+
+def spending_function(t, alpha: float = 0.05,
+                      kind: str = 'obrien-fleming') -> np.ndarray:
+    """
+    A function to return the type I error spent up to information fraction t
+
+    Parameters
+    =--------=
+    t: array like
+        Information fractions in [0, 1]
+    alpha: float
+        The overall type I error rate
+    kind: string
+        'obrien-fleming' or 'pocock'
+
+    Returns
+    =-----=
+    spent: numpy array
+        The cumulative alpha spent at every fraction
+    """
+    t = np.clip(np.asarray(t, dtype=np.float64), 0, 1)
+    if kind == 'obrien-fleming':
+        with np.errstate(divide='ignore'):
+            return 2 - 2 * norm.cdf(norm.ppf(1 - alpha / 2) / np.sqrt(t))
+    if kind == 'pocock':
+        return alpha * np.log(1 + (math.e - 1) * t)
+    raise ValueError(f'unknown spending function {kind}')
+
+
+def check_design(max_sample: int, alpha: float = 0.05,
+                 kind: str = 'obrien-fleming', sides: int = 1) -> None:
+    """
+    A function to check the planned design of a group-sequential test
+
+    Parameters
+    =--------=
+    max_sample: integer
+        The planned number of users of both groups
+    alpha: float
+        The overall type I error rate, in (0, 1)
+    kind: string
+        'obrien-fleming' or 'pocock'
+    sides: integer
+        1 or 2
+
+    Returns
+    =-----=
+    None: nothing
+        A ValueError is raised for an invalid design
+    """
+    if max_sample is None or max_sample <= 0:
+        raise ValueError('the planned sample size max_sample must be set ' +
+                         'before the first look')
+    if not 0 < alpha < 1:
+        raise ValueError(f'alpha must be in (0, 1), not {alpha}')
+    if kind not in ('obrien-fleming', 'pocock'):
+        raise ValueError(f'unknown spending function {kind}')
+    if sides not in (1, 2):
+        raise ValueError(f'sides must be 1 or 2, not {sides}')
+
+
+def _exit_probability(points, mass, sd, bound, sides):
+    """
+    The probability that the score steps from the sub-density (points, mass)
+    beyond +-bound after an independent normal increment of deviation sd
+    """
+    upper = mass @ norm.sf((bound - points) / sd)
+    if sides == 2:
+        upper += mass @ norm.cdf((-bound - points) / sd)
+    return upper
+
+
+def group_sequential_bounds(fractions, alpha: float = 0.05,
+                            kind: str = 'obrien-fleming',
+                            sides: int = 1) -> np.ndarray:
+    """
+    A function to compute the critical z values of a sequence of looks
+
+    Parameters
+    =--------=
+    fractions: array like
+        The increasing information fractions of the looks, at most 1
+    alpha: float
+        The overall type I error rate
+    kind: string
+        The spending function, 'obrien-fleming' or 'pocock'
+    sides: integer
+        1 to reject on large z only, 2 for symmetric two-sided bounds
+
+    Returns
+    =-----=
+    bounds: numpy array
+        The critical value of the z statistic at every look; inf where no
+        alpha is spent
+    """
+    fractions = np.asarray(fractions, dtype=np.float64)
+    if np.any(np.diff(fractions) <= 0) or fractions[0] <= 0 or \
+            fractions[-1] > 1:
+        raise ValueError('fractions must increase within (0, 1]')
+    spent = np.diff(spending_function(fractions, alpha, kind), prepend=0)
+
+    bounds = np.full(len(fractions), np.inf)
+    # sub-density of the score S(t) = Z sqrt(t) among the continuing paths,
+    # as quadrature points and masses; all the mass at 0 before the first look
+    points = np.zeros(1)
+    mass = np.ones(1)
+    previous = 0.0
+    for k, t in enumerate(fractions):
+        sd = math.sqrt(t - previous)
+        previous = t
+        if spent[k] > 1e-15:
+            def excess(b):
+                return _exit_probability(points, mass, sd, b, sides) - spent[k]
+            top = _SPAN * math.sqrt(t) + abs(points).max()
+            if excess(0.0 if sides == 2 else -top) > 0:
+                b = brentq(excess, 0.0 if sides == 2 else -top, top,
+                           xtol=1e-10)
+                bounds[k] = b / math.sqrt(t)
+        if k == len(fractions) - 1:
+            break
+
+        # the density of the continuing paths on a grid fine enough for the
+        # next increment, integrated with Simpson's rule
+        edge = _SPAN * math.sqrt(t)
+        upper = min(bounds[k] * math.sqrt(t), edge)
+        lower = -upper if sides == 2 else -edge
+        step = math.sqrt(fractions[k + 1] - t) / 2
+        size = int(min(max(math.ceil((upper - lower) / step), 16), _MAX_GRID))
+        size += size % 2
+        grid = np.linspace(lower, upper, size + 1)
+        weights = np.full(size + 1, 2.0)
+        weights[1::2] = 4.0
+        weights[[0, -1]] = 1.0
+        weights *= (upper - lower) / (3 * size)
+        kernel = np.exp(-0.5 * ((grid[:, None] - points[None, :]) / sd) ** 2)
+        density = kernel @ mass / (sd * math.sqrt(2 * math.pi))
+        points, mass = grid, weights * density
+    return bounds
+
+
+def hourly_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    A function to aggregate the responses of the two groups per hour
+
+    Parameters
+    =--------=
+    df: pandas data frame
+        The experiment with date, hour, experiment, yes and no columns
+
+    Returns
+    =-----=
+    hours: pandas data frame
+        One chronological row per (date, hour) with the engagement (yes or
+        no answers) and success (yes answers) of the exposed and control
+        groups
+    """
+    clean_df = df.query("not (yes == 0 & no == 0)")
+    agg = clean_df.groupby(['date', 'hour', 'experiment']).agg(
+        engagement=('yes', 'size'), success=('yes', 'sum'))
+    hours = agg.unstack('experiment', fill_value=0).sort_index()
+    hours.columns = [f'{group}_{count}' for count, group in hours.columns]
+    for group in ['exposed', 'control']:
+        for count in ['engagement', 'success']:
+            if f'{group}_{count}' not in hours:
+                hours[f'{group}_{count}'] = 0
+    return hours[['exposed_engagement', 'exposed_success',
+                  'control_engagement', 'control_success']].astype(np.int64)
+
+
+def group_sequential_test(exposed_engagement, exposed_success,
+                          control_engagement, control_success,
+                          max_sample: int, alpha: float = 0.05,
+                          kind: str = 'obrien-fleming',
+                          sides: int = 1) -> tuple:
+    """
+    A function to run the alpha-spending group-sequential test with one look
+    per hour
+
+    The information fractions are measured against the planned sample, so
+    the bounds of the hours already seen do not move when the test is rerun
+    with more hours, and only the alpha spent up to the current fraction is
+    used; the test is final once the planned sample is reached.
+
+    Parameters
+    =--------=
+    exposed_engagement, exposed_success: array like
+        The hourly number of users and of yes answers of the exposed group
+    control_engagement, control_success: array like
+        The hourly number of users and of yes answers of the control group
+    max_sample: integer
+        The planned number of users of both groups, fixed before the first
+        look
+    alpha: float
+        The overall type I error rate
+    kind: string
+        The spending function, 'obrien-fleming' or 'pocock'
+    sides: integer
+        1 to only detect an increase of the exposed group, 2 for both ways
+
+    Returns
+    =-----=
+    (outcome, k, fractions, stats, bounds): tuple
+        * outcome:   The decision of the test
+        * k:         Index of the hour the decision was made at (or NA)
+        * fractions: Information fraction of every hour
+        * stats:     Pooled two-proportion z statistic of every hour
+        * bounds:    Critical value of every hour
+        Hours before both groups have a user, or while the pooled rate is 0
+        or 1, are not looks and have NA statistics and bounds.
+    """
+    counts = [np.cumsum(np.asarray(c, dtype=np.int64))
+              for c in [exposed_engagement, exposed_success,
+                        control_engagement, control_success]]
+    check_design(max_sample, alpha, kind, sides)
+    n_e, x_e, n_c, x_c = counts
+    total = n_e + n_c
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (x_e + x_c) / total
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n_e + 1 / n_c))
+        stats = (x_e / n_e - x_c / n_c) / se
+    fractions = total / max_sample
+
+    # the looks: defined statistic, new information, and up to the end
+    look = np.isfinite(stats) & (np.diff(total, prepend=0) > 0)
+    look &= np.concatenate([[True], fractions[:-1] < 1])
+    stats = np.where(look, stats, np.nan)
+    bounds = np.full(len(stats), np.nan)
+    index = np.flatnonzero(look)
+    if len(index) > 0:
+        bounds[index] = group_sequential_bounds(
+            np.minimum(fractions[index], 1), alpha, kind, sides)
+
+    with np.errstate(invalid='ignore'):
+        upper = stats >= bounds
+        lower = (stats <= -bounds) if sides == 2 else np.zeros_like(upper)
+    crossed = np.flatnonzero(upper | lower)
+    if len(crossed) > 0:
+        k = int(crossed[0])
+        if upper[k]:
+            outcome = 'Exposed group produced a statistically significant ' + \
+                'increase.'
+        else:
+            outcome = 'Exposed group produced a statistically significant ' + \
+                'decrease.'
+    else:
+        k = np.nan
+        if fractions[-1] >= 1:
+            outcome = 'Their is no statistically significant difference ' + \
+                'between two test groups'
+        else:
+            outcome = 'Unable to conclude.Needs more sample.'
+    return (outcome, k, fractions, stats, bounds)
@@ -3,9 +3,10 @@ A script for machine learning preprocessing.
 """
 
 # imports
+import numpy as np
 import pandas as pd
-from sklearn import preprocessing
 import logging
+from vocabularyEncoder import VocabularyEncoder
 
 class machineLearningHelper():
     """
@@ -126,11 +127,11 @@ class machineLearningHelper():
                 print(f"{test_key}: {round(model_result[test_key].std(), 4)}")
                 self.logger.info(f"{test_key}: {round(model_result[test_key].std(), 4)}")
 
-    def encode_to_numeric(self, data : pd.DataFrame,
-                          columns : list)-> pd.DataFrame:
+    def encode_to_numeric(self, data : pd.DataFrame, columns : list,
+                          encoder : VocabularyEncoder = None)-> pd.DataFrame:
         """
         A function to change categorical variables to numerical value
-        Using label encoder
+        Using a vocabulary encoder
 
         Parameters
         =--------=
@@ -138,23 +139,68 @@ class machineLearningHelper():
             The data frame containing all the values
         columns: list
             The list of column names to be label encoded
+        encoder: VocabularyEncoder
+            A fitted (e.g. loaded) encoder to reuse; a new one is fitted on
+            the data if None
 
         Returns
         =-----=
         data: pandas data frame
-            The data frame with the columns label encoded
+            The data frame with the columns label encoded; the encoder is
+            kept in self.encoder so it can be saved for scoring
         """
-        lb = preprocessing.LabelEncoder()
-        self.logger.info(f'columns: {columns} ready to be label encoded')
-        for cols in columns:
-            data[cols] = lb.fit_transform(data[cols])
-            self.logger.info(f'column: {cols} label encoded')
+        self.logger.info(f'columns: {list(columns)} ready to be label encoded')
+        if encoder is None:
+            encoder = VocabularyEncoder(columns).fit(data)
+            self.logger.info('vocabulary encoder fitted')
+        self.encoder = encoder
+        data = encoder.transform(data)
         self.logger.info(f'label encoding completed and ready to be returned')
         return data
 
+    def awareness_target(self, data : pd.DataFrame) -> tuple:
+        """
+        A function for creating the awareness label of every row at once
+
+        Parameters
+        =--------=
+        data: data frame
+            The data frame with the yes and no columns
+
+        Returns
+        =-----=
+        label: numpy array
+            The int8 awareness, 1 if the user answered yes and 0 otherwise
+        valid: numpy array
+            The boolean mask of the rows that answered yes or no; the label
+            of the other rows is meaningless
+        """
+        yes = data['yes'].to_numpy() == 1
+        valid = yes | (data['no'].to_numpy() == 1)
+        return yes.astype(np.int8), valid
+
+    def iter_awareness_target(self, chunks):
+        """
+        A function for creating the awareness label of a stream of chunks
+
+        Parameters
+        =--------=
+        chunks: iterable of data frames
+            The chunks of the data, e.g. dataLoader.iter_chunks of a file
+
+        Returns
+        =-----=
+        targets: iterator
+            A (chunk, label, valid) tuple per chunk, see awareness_target
+        """
+        for chunk in chunks:
+            label, valid = self.awareness_target(chunk)
+            yield chunk, label, valid
+
     def label_awareness(self, row) -> int:
         """
-        A function for creating an awareness column
+        A function for creating an awareness column, one row at a time;
+        awareness_target labels a whole data frame at once
 
         Parameters
         =--------=
@@ -0,0 +1,199 @@
+"""
+A lazy, memory-mapped registry of the trained models.
+
+Every model is stored as an uncompressed joblib file, which keeps its numpy
+arrays as raw buffers, and listed with its md5, size and type in a json
+manifest (models/registry.json by default). A model is only loaded the first
+time it is asked for, with its arrays memory-mapped read-only instead of
+unpickled into private copies, so loading is quick and the processes
+forked after a load, or loading the same file, share the pages of the
+arrays. The loaded models sit in a least recently used cache whose size, by
+the bytes of their files, is kept within a memory budget.
+"""
+
+# imports
+import os
+import json
+import time
+import pickle
+import joblib
+from collections import OrderedDict
+from dataCache import file_md5
+
+
+class ModelRegistry():
+    """
+    A manifest of stored models with a lazy, bounded cache of loaded ones.
+    """
+    def __init__(self, folder: str = 'models', budget: int = 1 << 30,
+                 manifest: str = None) -> None:
+        """
+        The model registry initializer
+
+        Parameters
+        =--------=
+        folder: string
+            The folder of the stored models
+        budget: integer
+            The most bytes of model files kept loaded at once; the least
+            recently used models are dropped beyond it
+        manifest: string
+            The path of the json manifest, folder/registry.json if None
+
+        Returns
+        =-----=
+        None: nothing
+            The manifest is read; no model is loaded
+        """
+        self.folder = folder
+        self.budget = budget
+        self.path = os.path.join(folder, 'registry.json') if manifest is None \
+            else manifest
+        self.models = {}
+        if os.path.exists(self.path):
+            with open(self.path) as manifest_file:
+                self.models = json.load(manifest_file).get('models', {})
+        self.cache = OrderedDict()
+        self.loaded_bytes = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    def names(self) -> list:
+        """
+        A function to list the registered models
+
+        Returns
+        =-----=
+        names: list
+            The sorted names of the models in the manifest
+        """
+        return sorted(self.models)
+
+    def register(self, name: str, model) -> str:
+        """
+        A function to store a model in the registry
+
+        Parameters
+        =--------=
+        name: string
+            The name of the model, e.g. browser_random_forest
+        model: object
+            The fitted model
+
+        Returns
+        =-----=
+        path: string
+            The path of the stored joblib file
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'{name}.joblib')
+        # write then rename, so a reader never sees a partial model
+        partial = f'{path}.{os.getpid()}.partial'
+        joblib.dump(model, partial)
+        os.replace(partial, path)
+        self._drop(name)
+        self.models[name] = {'path': path, 'md5': file_md5(path),
+                             'size': os.path.getsize(path),
+                             'type': f'{type(model).__module__}.'
+                                     f'{type(model).__qualname__}',
+                             'registered': time.strftime(
+                                 '%Y-%m-%d %H:%M:%S')}
+        self.save()
+        return path
+
+    def import_pickle(self, path: str, name: str = None) -> str:
+        """
+        A function to store a pickled (or joblib dumped) model, e.g.
+        models/random_forest.pkl, in the registry format
+
+        Parameters
+        =--------=
+        path: string
+            The path of the pickle
+        name: string
+            The name of the model, the file name without extension if None
+
+        Returns
+        =-----=
+        path: string
+            The path of the stored joblib file
+        """
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            model = joblib.load(path)
+        except (KeyError, ValueError, pickle.UnpicklingError):
+            with open(path, 'rb') as pickled:
+                model = pickle.load(pickled)
+        return self.register(name, model)
+
+    def get(self, name: str):
+        """
+        A function to return a model, loading it on first use
+
+        Parameters
+        =--------=
+        name: string
+            The name of the model
+
+        Returns
+        =-----=
+        model: object
+            The model, its arrays memory-mapped read-only
+        """
+        if name in self.cache:
+            self.cache.move_to_end(name)
+            return self.cache[name]
+        if name not in self.models:
+            raise KeyError(f'{name} is not in the registry')
+        entry = self.models[name]
+        model = joblib.load(entry['path'], mmap_mode='r')
+        self.cache[name] = model
+        self.loaded_bytes += entry['size']
+        # keep the most recent model even if it alone is over the budget
+        while self.loaded_bytes > self.budget and len(self.cache) > 1:
+            self._drop(next(iter(self.cache)))
+        return model
+
+    def verify(self, name: str) -> bool:
+        """
+        A function to check a stored model against the manifest
+
+        Parameters
+        =--------=
+        name: string
+            The name of the model
+
+        Returns
+        =-----=
+        valid: boolean
+            True if the file exists with the recorded size and md5
+        """
+        entry = self.models[name]
+        if not os.path.exists(entry['path']) or \
+                os.path.getsize(entry['path']) != entry['size']:
+            return False
+        return file_md5(entry['path']) == entry['md5']
+
+    def _drop(self, name: str) -> None:
+        """
+        Unload a model from the cache
+        """
+        if name in self.cache:
+            del self.cache[name]
+            self.loaded_bytes -= self.models[name]['size']
+
+    def save(self) -> None:
+        """
+        A function to write the manifest
+
+        Returns
+        =-----=
+        None: nothing
+            The manifest is written to its json file
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as manifest_file:
+            json.dump({'models': self.models}, manifest_file, indent=2,
+                      sort_keys=True)
@@ -0,0 +1,284 @@
+"""
+A successive halving search over the classifiers of TrainingClassifier.
+
+Candidate configurations of every model family are drawn from a parameter
+space and raced together: every rung cross validates the surviving
+candidates on a subsample of the training rows, keeps the best 1 / eta of
+them and gives the next rung eta times more rows, until one candidate is
+left or the full data is used. The subsamples are nested prefixes of one
+seeded permutation of the rows, so a cheap rung is a fair preview of the
+next. The trials of a rung run on a process pool, and every finished trial
+is appended to a json lines log; a trial already in the log (same data,
+family, parameters, rows, folds, scoring and seed) is read back instead of
+run, so an interrupted search resumes where it stopped, and a search with
+more candidates or another family only runs what is new. The winner, a
+family and its params, can be handed to TrainingClassifier as its
+classifier.
+"""
+
+# imports
+import os
+import json
+import math
+import time
+import zlib
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import cross_val_score
+from train_classifiers import make_classifier
+
+
+# the parameter spaces of the model families, a list of values per parameter
+DEFAULT_SPACES = {
+    'decision_tree': {
+        'max_depth': [2, 3, 4, 6, 8, 12, None],
+        'min_samples_leaf': [1, 5, 20, 50],
+        'criterion': ['gini', 'entropy'],
+    },
+    'logistic_regression': {
+        'C': [0.01, 0.1, 1.0, 10.0, 100.0],
+        'max_iter': [1000],
+    },
+    'random_forest': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [4, 8, 16, None],
+        'min_samples_leaf': [1, 5, 20],
+        'max_features': ['sqrt', 0.5, 1.0],
+    },
+    'xgboost': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [3, 5, 7],
+        'learning_rate': [0.03, 0.1, 0.3],
+        'colsample_bytree': [0.3, 0.7, 1.0],
+    },
+}
+
+# the rows and labels of the search, set once per worker
+_SEARCH_DATA = {}
+
+
+def _init_search(X: np.ndarray, y: np.ndarray, order: np.ndarray) -> None:
+    """
+    The process pool initializer handing the data to a worker once
+    """
+    _SEARCH_DATA.update(X=X, y=y, order=order)
+
+
+def _run_trial(job: tuple) -> dict:
+    """
+    Cross validate one candidate on the first `rows` rows of the permutation
+    """
+    family, params, rows, folds, scoring, seed = job
+    index = _SEARCH_DATA['order'][:rows]
+    classifier = make_classifier(family, params)
+    if 'random_state' in classifier.get_params():
+        classifier.set_params(random_state=seed)
+    start = time.perf_counter()
+    scores = cross_val_score(classifier, _SEARCH_DATA['X'][index],
+                             _SEARCH_DATA['y'][index], cv=folds,
+                             scoring=scoring)
+    return {'family': family, 'params': params, 'rows': rows,
+            'folds': folds, 'scoring': scoring, 'seed': seed,
+            'score': float(np.mean(scores)), 'std': float(np.std(scores)),
+            'seconds': time.perf_counter() - start}
+
+
+class SuccessiveHalvingSearch():
+    """
+    A resumable successive halving race of the model families.
+    """
+    def __init__(self, spaces: dict = None, candidates: int = 8,
+                 min_rows: int = 1000, eta: int = 3, folds: int = 3,
+                 scoring: str = 'accuracy', workers: int = None,
+                 log_path: str = 'models/search_trials.jsonl',
+                 seed: int = 77) -> None:
+        """
+        The search initializer
+
+        Parameters
+        =--------=
+        spaces: dictionary
+            The parameter space of every raced family, a list of values per
+            parameter; DEFAULT_SPACES if None
+        candidates: integer
+            The number of configurations drawn per family
+        min_rows: integer
+            The number of rows of the first rung
+        eta: integer
+            The halving rate: 1 / eta of the candidates survive a rung and
+            the next rung has eta times more rows
+        folds: integer
+            The number of cross validation folds of every trial
+        scoring: string
+            The scikit-learn scoring of the trials, higher is better
+        workers: integer
+            The size of the process pool, None for one per CPU and 1 to run
+            the trials in this process
+        log_path: string
+            The json lines log of the trials
+        seed: integer
+            The seed of the candidates, the row permutation and the models
+
+        Returns
+        =-----=
+        None: nothing
+            The search is set up and the trial log, if any, is loaded
+        """
+        self.spaces = DEFAULT_SPACES if spaces is None else spaces
+        self.candidates = candidates
+        self.min_rows = min_rows
+        self.eta = eta
+        self.folds = folds
+        self.scoring = scoring
+        self.workers = workers
+        self.log_path = log_path
+        self.seed = seed
+        self.trials = []
+        if os.path.exists(log_path):
+            with open(log_path) as log:
+                self.trials = [json.loads(line) for line in log
+                               if line.strip()]
+
+    def draw_candidates(self) -> list:
+        """
+        A function to draw the configurations of every family
+
+        Every family has its own stream, keyed on its name, and draws its
+        candidates in order, so asking for more candidates or adding a
+        family keeps the candidates drawn before.
+
+        Returns
+        =-----=
+        candidates: list
+            The distinct (family, params) pairs
+        """
+        drawn = []
+        for family, space in self.spaces.items():
+            rng = np.random.default_rng(
+                [self.seed, zlib.crc32(family.encode())])
+            seen = set()
+            for _ in range(self.candidates):
+                params = {name: values[rng.integers(len(values))]
+                          for name, values in space.items()}
+                # numpy scalars are not json serializable
+                params = {name: value.item() if isinstance(value, np.generic)
+                          else value for name, value in params.items()}
+                key = json.dumps(params, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    drawn.append((family, params))
+        return drawn
+
+    def _key(self, data: str, family: str, params: dict, rows: int) -> str:
+        """
+        The log key of a trial
+        """
+        return json.dumps([data, family, params, rows, self.folds,
+                           self.scoring, self.seed], sort_keys=True)
+
+    def run(self, X: pd.DataFrame, y: pd.Series) -> dict:
+        """
+        A function to race the candidates on the training data
+
+        Parameters
+        =--------=
+        X: pandas data frame
+            The encoded training features
+        y: pandas series
+            The training labels
+
+        Returns
+        =-----=
+        best: dictionary
+            The family, params and cross validated score of the winner, with
+            the rows it was last scored on; TrainingClassifier takes it as
+            its classifier
+        """
+        # the trials of other data are not reused
+        digest = hashlib.md5()
+        for values in (X, y):
+            digest.update(pd.util.hash_pandas_object(
+                values, index=False).to_numpy().tobytes())
+        data = digest.hexdigest()
+        # nor those of other folds, scoring or seed
+        logged = {self._key(t['data'], t['family'], t['params'], t['rows']): t
+                  for t in self.trials
+                  if (t['folds'], t['scoring'], t.get('seed')) ==
+                  (self.folds, self.scoring, self.seed)}
+
+        X_values = np.ascontiguousarray(X.to_numpy())
+        y_values = np.ascontiguousarray(y.to_numpy())
+        order = np.random.default_rng(self.seed).permutation(len(X_values))
+        workers = self.workers if self.workers is not None else \
+            (os.cpu_count() or 1)
+
+        alive = self.draw_candidates()
+        rows = min(self.min_rows, len(X_values))
+        pool = None
+        try:
+            while True:
+                jobs = [(family, params, rows, self.folds, self.scoring,
+                         self.seed) for family, params in alive
+                        if self._key(data, family, params, rows) not in logged]
+                if jobs and workers == 1:
+                    _init_search(X_values, y_values, order)
+                    results = map(_run_trial, jobs)
+                elif jobs:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(
+                            max_workers=workers, initializer=_init_search,
+                            initargs=(X_values, y_values, order))
+                    results = pool.map(_run_trial, jobs)
+                else:
+                    results = []
+                for trial in results:
+                    trial['data'] = data
+                    self._log(trial)
+                    logged[self._key(data, trial['family'], trial['params'],
+                                     rows)] = trial
+
+                scored = sorted(
+                    (logged[self._key(data, family, params, rows)]
+                     for family, params in alive),
+                    key=lambda t: t['score'], reverse=True)
+                if len(scored) == 1 or rows == len(X_values):
+                    break
+                keep = max(1, math.ceil(len(scored) / self.eta))
+                alive = [(t['family'], t['params']) for t in scored[:keep]]
+                rows = min(rows * self.eta, len(X_values))
+        finally:
+            _SEARCH_DATA.clear()
+            if pool is not None:
+                pool.shutdown()
+
+        best = scored[0]
+        return {'family': best['family'], 'params': best['params'],
+                'score': best['score'], 'rows': best['rows']}
+
+    def _log(self, trial: dict) -> None:
+        """
+        Append a finished trial to the log
+        """
+        self.trials.append(trial)
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'a') as log:
+            log.write(json.dumps(trial, sort_keys=True) + '\n')
+
+    def results(self) -> pd.DataFrame:
+        """
+        A function to tabulate the logged trials
+
+        Returns
+        =-----=
+        trials: pandas data frame
+            One row per trial, the best scores of the largest rungs first
+        """
+        trials = pd.DataFrame(self.trials)
+        if trials.empty:
+            return trials
+        trials['params'] = trials['params'].map(
+            lambda params: json.dumps(params, sort_keys=True))
+        return trials.sort_values(['rows', 'score'], ascending=False,
+                                  ignore_index=True)
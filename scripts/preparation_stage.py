@@ -6,7 +6,6 @@ A script for the preparation stage of the DVC pipeline.
 import os
 import sys
 import yaml
-import dvc.api
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -23,7 +22,11 @@ sys.path.insert(1, '../scripts/')
 import defaults as defs
 import dataCleaner as dc
 import dataVisualizer as dv
+from dataCache import cached_read
+from stageManifest import StageManifest
 params = yaml.safe_load(open('params.yaml'))['preparation']
+# the files this stage produced on its last run
+manifest = StageManifest('preparation', params)
 # setup helper scripts
 cleaner = dc.dataCleaner(params['fromThe'])
 visualizer = dv.dataVisualizer(params['fromThe'])
@@ -32,13 +35,11 @@ visualizer = dv.dataVisualizer(params['fromThe'])
 print('\nloading data . . .\n')
 # read data using dvc
 version = params['version']
-# data path using dvc api
-data_url = dvc.api.get_url(path = defs.data_path + params['dataFileName'], 
-                           #repo = defs.repo,
-                           rev = version)
-# reading the csv file using the dvc api
+# reading the typed columns of this stage through the columnar cache of
+# this dvc revision
 missing_values = params['missing_values']
-df = pd.read_csv(data_url, na_values=missing_values)
+df = cached_read(defs.data_path + params['dataFileName'], rev=version,
+                 columns=params['columns'], na_values=missing_values)
 print(df)
 
 
@@ -64,7 +65,9 @@ df['date'] = pd.to_datetime(df['date'], errors='raise')
 df.info()
 
 print('\nsaving prepared data . . .')
-# save the data to file
-df.to_csv(defs.data_path + params['dataFileName'], index=False)
-print('prepared data file saved successfully')
+# save the data to file, unless it already holds the prepared data
+if manifest.write_csv(df, defs.data_path + params['dataFileName'], index=False):
+    print('prepared data file saved successfully')
+else:
+    print('prepared data unchanged, file kept')
 print('over and out')
@@ -0,0 +1,192 @@
+"""
+Mergeable streaming quantile sketches.
+
+A KLL sketch (Karnin, Lang and Liberty, 2016) keeps a few hundred of the
+values of a column in levels; an item at level h stands for 2^h values. When
+a level outgrows its capacity it is sorted and every other item (starting at
+a random offset) is promoted to the next level, so the sketch of n values
+holds O(k log(n / k)) items and answers any quantile with a rank error of
+about 1.7 / k. Sketches of separate chunks merge into the sketch of their
+union, so the quartiles and the median of every numeric column of a file
+are estimated in one streaming pass over its chunks.
+"""
+
+# imports
+import math
+import numpy as np
+import pandas as pd
+
+
+class KLLSketch():
+    """
+    A KLL quantile sketch of a stream of numbers.
+    """
+    def __init__(self, k: int = 200, seed=None) -> None:
+        """
+        The sketch initializer
+
+        Parameters
+        =--------=
+        k: integer
+            The capacity of the top level, which sets the accuracy
+        seed: integer, SeedSequence or Generator
+            The seed of the compaction offsets
+
+        Returns
+        =-----=
+        None: nothing
+            An empty sketch is set up
+        """
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _capacity(self, level: int) -> int:
+        """
+        The number of items a level holds before it is compacted
+        """
+        depth = len(self.levels) - 1 - level
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self) -> None:
+        """
+        Compact every level over its capacity into the next one
+        """
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays, so the total weight is unchanged
+                keep = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[self.rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def update(self, values) -> 'KLLSketch':
+        """
+        A function to add values to the sketch
+
+        Parameters
+        =--------=
+        values: array like
+            The new values; missing values are ignored
+
+        Returns
+        =-----=
+        sketch: KLLSketch
+            The sketch itself
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """
+        A function to add the values summarized by another sketch
+
+        Parameters
+        =--------=
+        other: KLLSketch
+            A sketch of other values, e.g. of another chunk
+
+        Returns
+        =-----=
+        sketch: KLLSketch
+            The sketch itself, now summarizing both streams
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        A function to estimate quantiles of the values
+
+        Parameters
+        =--------=
+        q: float or array like
+            The quantiles, between 0 and 1
+
+        Returns
+        =-----=
+        values: float or numpy array
+            The estimated quantiles; nan for an empty sketch
+        """
+        scalar = np.ndim(q) == 0
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.n == 0:
+            result = np.full(len(q), np.nan)
+        else:
+            items = np.concatenate(self.levels)
+            weights = np.concatenate([np.full(len(items), 2 ** level)
+                                      for level, items in
+                                      enumerate(self.levels)])
+            order = np.argsort(items, kind='stable')
+            ranks = np.cumsum(weights[order])
+            index = np.searchsorted(ranks, q * ranks[-1], side='left')
+            result = items[order][np.minimum(index, len(items) - 1)]
+            # the extremes are known exactly
+            result = np.where(q <= 0, self.min,
+                              np.where(q >= 1, self.max, result))
+        return float(result[0]) if scalar else result
+
+
+def build_sketches(data, columns: list = None, k: int = 200,
+                   seed=None) -> dict:
+    """
+    A function to sketch the numeric columns of a frame or of a stream of
+    chunks in one pass
+
+    Parameters
+    =--------=
+    data: pandas data frame or iterable of pandas data frames
+        The data, e.g. dataLoader.iter_chunks of a file
+    columns: list
+        The columns to sketch, the numeric columns of the first chunk if
+        None
+    k: integer
+        The accuracy parameter of every sketch
+    seed: integer
+        The seed the sketches' own seeds are spawned from
+
+    Returns
+    =-----=
+    sketches: dictionary
+        A KLLSketch per column
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    sketches = None
+    for chunk in data:
+        if sketches is None:
+            if columns is None:
+                columns = list(chunk.select_dtypes('number').columns)
+            seeds = np.random.SeedSequence(seed).spawn(len(columns))
+            sketches = {column: KLLSketch(k, s)
+                        for column, s in zip(columns, seeds)}
+        for column in columns:
+            sketches[column].update(chunk[column].to_numpy(dtype=np.float64,
+                                                           na_value=np.nan))
+    return {} if sketches is None else sketches
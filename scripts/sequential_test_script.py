@@ -3,16 +3,21 @@ import matplotlib.ticker as ticker
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-import random
-import math
+from concurrent.futures import ProcessPoolExecutor
+from bernoulliSeries import bernoulli_series
+from dataLoader import epoch_hours
+from sprtKernel import conditional_sprt
  
  
-def conditionalSPRT( x,y,t1,alpha=0.05,beta=0.10,stop=None):
+def conditionalSPRT( x,y,t1,alpha=0.05,beta=0.10,stop=None,table=None,early_exit=False):
     """
     #
     # Meeker's SPRT for matched `x` (treatment) and `y` (control), 
     # both indicator responses, likelihood ratio t1, error rates alpha and beta,
-    # and (optionally) truncation after trial stop.
+    # and (optionally) truncation after trial stop. The limits are looked up
+    # in `table`, a boundaryTable.BoundaryTable of the same t1, if given.
+    # With early_exit=True the statistic is evaluated in blocks and the
+    # arrays of the result stop at the first crossing `k`.
     #
     # The return variable contains these elements:
     #(outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits)
@@ -35,173 +40,146 @@ def conditionalSPRT( x,y,t1,alpha=0.05,beta=0.10,stop=None):
     if (alpha >0.5) | (beta >0.5):
         print('warning',"Unrealistic values of alpha or beta were passed."
                 +" You should have good reason to use large alpha & beta values")
-    if stop!=None:
-        stop=math.floor(n0)
-
-    def comb(n, k):
-        return math.factorial(n) // math.factorial(k) // math.factorial(n - k)
-
-    def lchoose(b, j):
-        a=[]
-        if (type(j) is list) | (isinstance(j,np.ndarray)==True):
-            if len(j)<2:
-                j=j[0]
-        if (type(j) is list) | (isinstance(j,np.ndarray)==True):
-            for k in j:
-                n=b
-                if (0 <= k) & (k<= n):
-                    a.append(math.log(comb(n,k)))
-                else:
-                    a.append(0)
-        else:
-            n=b
-            k=j
-            if (0 <= k) & (k<= n):
-                a.append(math.log(comb(n,k)))
-            else:
-                a.append(0)
-
-        return np.array(a)
-
-    def g(x,r,n,t1,t0=1):
-        return -math.log(h(x,r,n,t1))+math.log(h(x,r,n,t0))
-
-    def h(x,r,n,t=1):
+    return conditional_sprt(x, y, t1, alpha, beta, stop, table, early_exit)
+
     
-        return f(r,n,t,offset=ftermlog(x,r,n,t))
+def get_bernouli_series( engagment_list, success_list, seed=None, packed=False):
+    """
+    The 0/1 series of hourly engagement and success counts, as an int8 (or
+    bit-packed) array whose ones are placed by a Generator seeded with `seed`.
+    """
+    return bernoulli_series(engagment_list, success_list, seed, packed)
 
-    def f(r,n,t,offset=0):
-        upper=max(0,r-n)
-        lower=min(n,r)
-        rng=list(range(upper,lower+1))
-        return np.sum(fterm(rng,r,n,t,offset))
 
-    def fterm(j,r,n,t,offset=0):
-        ftlog=ftermlog(j,r,n,t,offset)
-        return np.array([math.exp(ex) for ex in ftlog])
+def transform_data( df, seed=None, packed=False):
+            
+        # per-hour engagement and success counts of both groups
+        counts = hourly_counts(df)
+        return _group_series(counts, seed, packed)
 
-    def ftermlog(j,r,n,t,offset=0):
-    
-        xx=r-j
-        lch=lchoose(n,j)
-        lchdiff=lchoose(n,xx)
-        lg=np.array(j)*math.log(t)
-        lgsum=lch+lchdiff
-        lgsum2=lgsum+lg
-        lgdiff=lgsum2-offset
 
-        return lgdiff
+def _group_series(counts, seed=None, packed=False):
+    """
+    The (control, exposed) Bernoulli series of the hourly counts of both
+    groups, drawn from two streams spawned from `seed` (an integer or a
+    SeedSequence) in that order.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # independent streams for the two groups
+    control_seed, exposed_seed = seed.spawn(2)
 
-    def logf(r,n,t,offset=0):
-    
-        z=f(r,n,t,offset)
-        if z>0:
-            return math.log(z)
-        else:
-            return np.nan
+    # create two dataframes with bernouli series 1 for posetive(yes) and 0 for negative(no)
+    control_bernouli = get_bernouli_series(*counts['control'],
+                                           control_seed, packed)
+    exposed_bernouli = get_bernouli_series(*counts['exposed'],
+                                           exposed_seed, packed)
 
-    def clowerUpper(r,n,t1c,t0=1,alpha=0.05,beta=0.10):
-    
-        offset=ftermlog(math.ceil(r/2),r,n,t1c)
-        z=logf(r,n,t1c,logf(r,n,t0,offset)+offset)
-        a=-math.log(alpha/(1-beta))
-        b=math.log(beta/(1-alpha))
-        lower=b
-        upper=1+a
-        return (np.array([lower,upper])+z)/math.log(t1c/t0)
-
-    l=math.log(beta/(1-alpha))
-    u=-math.log(alpha/(1-beta))
-    sample_size=min(len(x),len(y))
-    n=np.array(range(1,sample_size+1))
-
-    if stop!=None:
-        n=np.array([z for z in n if z<=stop])
-    x1=np.cumsum(x[n-1])
-    r=x1+np.cumsum(y[n-1])
-    stats=np.array(list(map(g,x1, r, n, [t1]*len(x1)))) #recurcively calls g
-    #
-    # Perform the test by finding the first index, if any, at which `stats`
-    # falls outside the open interval (l, u).
-    #
-    clu=list(map(clowerUpper,r,n,[t1]*len(r),[1]*len(r),[alpha]*len(r), [beta]*len(r)))
-    limits=[]
-    for v in clu:
-        inArray=[]
-        for vin in v:
-            inArray.append(math.floor(vin))
-        limits.append(np.array(inArray))
-    limits=np.array(limits)
-
-    k=np.where((stats>=u) | (stats<=l))
-    cvalues=stats[k]
-    if cvalues.shape[0]<1:
-        k= np.nan
-        outcome='Unable to conclude.Needs more sample.'
-    else:
-        k=np.min(k)
-        if stats[k]>=u:
-            outcome=f'Exposed group produced a statistically significant increase.'
-        else:
-            outcome='Their is no statistically significant difference between two test groups'
-    if (stop!=None) & (k==np.nan):
- 
-   
-        c1=clowerUpper(r,stop,t1,alpha,beta)
-        c1=math.floor(np.mean(c1)-0.5)
-        if x1[n0]<=c1:
-            truncate_decision='h0'
-            outcome='Maximum Limit Decision. The aproximate decision point shows their is no statistically significant difference between two test groups'
-        else:
-            truncate_decision='h1'
-            outcome=f'Maximum Limit Decision. The aproximate decision point shows exposed group produced a statistically significant increase.'
-        truncated=stop
-    else:
-        truncate_decision='Non'
-        truncated=np.nan
-    return (outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits)
+    if packed:
+        # (packed, length) pairs, which conditional_sprt reads as they are
+        control_bernouli = (control_bernouli,
+                            int(counts['control'][0].sum()))
+        exposed_bernouli = (exposed_bernouli,
+                            int(counts['exposed'][0].sum()))
 
-    
-def get_bernouli_series( engagment_list, success_list):
-    bernouli_series = []
+    return control_bernouli, exposed_bernouli
 
-    for engagment, success in zip(engagment_list, success_list):
-        no_list = (engagment - success) * [0]
-        yes_list = (success) * [1]
-        series_item = yes_list + no_list
-        random.shuffle(series_item)
-        bernouli_series += series_item
-    return bernouli_series
 
+def _hourly_groups(df, by=None):
+    """
+    The per-hour yes sums and engagement counts of the rows with a yes or a
+    no, indexed by (`by` value,) experiment and epoch hour, in one groupby.
+    """
+    clean_df = df.query("not (yes == 0 & no == 0)")
+    keys = [clean_df['experiment'].to_numpy(),
+            epoch_hours(clean_df['date'], clean_df['hour'])]
+    if by is not None:
+        keys.insert(0, clean_df[by].to_numpy())
+    return clean_df['yes'].groupby(keys).agg(['sum', 'count'])
+
+
+def _group_counts(hourly):
+    """
+    The (engagement, success) arrays of both groups of an (experiment, epoch
+    hour) indexed frame, empty for a group without engaged users.
+    """
+    counts = {}
+    for group in ['exposed', 'control']:
+        agg = hourly.reindex([group], level=0)
+        counts[group] = (agg['count'].to_numpy(dtype=np.int32),
+                         agg['sum'].to_numpy(dtype=np.int32))
+    return counts
+
+
+def hourly_counts( df):
+    """
+    Per-hour engagement (rows with a yes or a no) and success (yes) counts of
+    the exposed and control groups, in chronological order.
+    """
+    return _group_counts(_hourly_groups(df))
+
+
+def _segment_sprt( job):
+    """
+    Run the test of one segment from its compact per-hour counts.
+    """
+    column, value, counts, t1, alpha, beta, stop, early_exit, seed = job
+    # the same series transform_data draws from the same seed
+    control, exposed = _group_series(counts, seed)
+    res = conditional_sprt(exposed, control, t1, alpha, beta, stop,
+                           early_exit=early_exit)
+    outcome, n, k, l, u, truncated, truncate_decision, x1, r, stats, limits = res
+    return {
+        "segment": column,
+        "value": value,
+        "exposed": len(exposed),
+        "control": len(control),
+        "numberOfObservation": len(n),
+        "outcome": outcome,
+        "decsionMadeIndex": k,
+        "truncated": truncated,
+        "truncateDecision": truncate_decision,
+    }
+
+
+def run_segmented_sprt( df, by=('browser', 'platform_os', 'device_make'),
+                        t1=1.01, alpha=0.05, beta=0.10, stop=None, top=None,
+                        early_exit=True, workers=None, seed=None):
+    """
+    Run the conditional SPRT on every segment of the `by` columns, e.g. each
+    browser, platform_os and device_make, fanned out over a process pool.
+
+    Only the per-hour counts of each segment are shipped to the workers.
+    `top` keeps the `top` largest values of every column (by number of rows)
+    and `workers=1` runs the segments in this process. Only the decisions are
+    reported, so by default every test stops at its first boundary crossing.
+    Every segment draws its series from its own stream spawned from `seed`.
+
+    Returns a DataFrame with one row per segment.
+    """
+    segments = []
+    for column in by:
+        values = df[column].value_counts()
+        # the unused categories of a categorical column have no segment
+        values = values[values > 0]
+        if top is not None:
+            values = values.nlargest(top)
+        # the hourly counts of every value of the column in one groupby
+        hourly = _hourly_groups(df, column)
+        for value in values.index:
+            segment = hourly.reindex([value], level=0).droplevel(0)
+            segments.append((column, value, _group_counts(segment)))
+    seeds = np.random.SeedSequence(seed).spawn(len(segments))
+    jobs = [(column, value, counts, t1, alpha, beta, stop, early_exit, s)
+            for (column, value, counts), s in zip(segments, seeds)]
+
+    if workers == 1:
+        results = [_segment_sprt(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_segment_sprt, jobs))
+    return pd.DataFrame(results)
 
-def transform_data( df):
-            
-        clean_df = df.query("not (yes == 0 & no == 0)")
-        # segment data into exposed and control groups
-        exposed = clean_df[clean_df['experiment'] == 'exposed']
-        control = clean_df[clean_df['experiment'] == 'control']
-
-        # group data into hours.
-        control['hour'] = control['hour'].astype('str')
-        control['date_hour'] = pd.to_datetime(control['date'] + " " + control['hour'] + ":00" + ":00")
-        control['date_hour'] = control['date_hour'].map(lambda x:  pd.Timestamp(x, tz=None).strftime('%Y-%m-%d:%H'))
-
-        exposed['hour'] = exposed['hour'].astype('str')
-        exposed['date_hour'] = pd.to_datetime( exposed['date'] + " " + exposed['hour'] + ":00" + ":00")
-        exposed['date_hour'] = exposed['date_hour'].map( lambda x:  pd.Timestamp(x, tz=None).strftime('%Y-%m-%d:%H'))
-
-        # create two dataframes with bernouli series 1 for posetive(yes) and 0 for negative(no)
-        cont = exposed.groupby('date_hour').agg({'yes': 'sum', 'no': 'count'})
-        cont = cont.rename(columns={'no': 'engagement', 'yes': 'success'})
-        control_bernouli = get_bernouli_series(
-            cont['engagement'].to_list(), cont['success'].to_list())
-
-        exp = exposed.groupby('date_hour').agg({'yes': 'sum', 'no': 'count'})
-        exp = exp.rename(columns={'no': 'engagement', 'yes': 'success'})
-        exposed_bernouli = get_bernouli_series(
-            exp['engagement'].to_list(), exp['success'].to_list())
-
-        return np.array(control_bernouli), np.array(exposed_bernouli)
 
 def resJson( res):
     outcome,n, k,l,u,truncated,truncate_decision,x1,r,stats,limits = res
@@ -0,0 +1,435 @@
+"""
+A vectorized log-space kernel for Meeker's conditional SPRT.
+
+REFERENCE
+A Conditional Sequential Test for the Equality of Two Binomial Proportions
+William Q. Meeker, Jr
+Journal of the Royal Statistical Society. Series C (Applied Statistics)
+Vol. 30, No. 2 (1981), pp. 109-115
+
+Every quantity of the test is a function of the log normalizer
+
+    z(r, n) = log sum_j C(n, j) C(n, r - j) t1^j  -  log C(2n, r)
+
+where the sum runs over max(0, r - n) <= j <= min(n, r). The log probability
+ratio of the test is then `x1 * log(t1) - z` and the critical limits are
+`(c + z) / log(t1)`, so the whole `stats` and `limits` series only need one
+log-sum-exp per observation. The terms of the sum are log-concave in `j`, so
+it is evaluated on a window of a few standard deviations around the mode
+with the log binomials looked up in a cached table of log factorials.
+"""
+
+# imports
+import math
+import numpy as np
+from scipy.special import gammaln
+from bernoulliSeries import cumulative_successes, series_length
+
+
+# the number of (hypergeometric) standard deviations summed on each side of
+# the mode, the extra number of terms added to every window and the smallest
+# gap (in log units) allowed between the largest term and a truncated edge
+_WINDOW_SD = 10
+_WINDOW_PAD = 8
+_TAIL_GAP = 40.0
+
+# the maximum number of window elements evaluated at once
+_CHUNK_ELEMENTS = 1 << 21
+
+# the number of observations evaluated at a time in early exit mode
+_SCAN_BLOCK = 4096
+
+# cached table of log(k!) for k = 0, 1, 2, ...
+_log_factorials = gammaln(np.arange(1.0, 1025.0))
+
+
+def log_factorials(m: int) -> np.ndarray:
+    """
+    A function to return a table of log factorials
+
+    Parameters
+    =--------=
+    m: integer
+        The largest argument the table has to cover
+
+    Returns
+    =-----=
+    table: numpy array
+        An array whose k-th element is log(k!), for at least k = 0, ..., m
+    """
+    global _log_factorials
+    if m >= _log_factorials.shape[0]:
+        size = max(m + 1, 2 * _log_factorials.shape[0])
+        _log_factorials = gammaln(np.arange(1.0, size + 1.0))
+    return _log_factorials
+
+
+def _window(r: np.ndarray, n: np.ndarray, t1: float) -> tuple:
+    """
+    A function to locate the summation window of every observation
+
+    Parameters
+    =--------=
+    r: numpy array
+        The cumulative number of positives in both groups
+    n: numpy array
+        The number of (treatment, control) pairs
+    t1: float
+        The odds ratio
+
+    Returns
+    =-----=
+    center, half: numpy arrays
+        The approximate mode of the terms and the half width of the window
+    """
+    # the mode solves t1 (n - j) (r - j) = (j + 1) (n - r + j + 1), written
+    # in the cancellation free form of the smaller root of the quadratic
+    a = t1 - 1.0
+    b = t1 * (n + r) + (n - r + 2.0)
+    c = t1 * n * r - (n - r + 1.0)
+    root = 2.0 * c / (b + np.sqrt(np.maximum(b * b - 4.0 * a * c, 0.0)))
+    lower = np.maximum(0, r - n)
+    upper = np.minimum(n, r)
+    center = np.clip(np.floor(root).astype(np.int64) + 1, lower, upper)
+
+    # spread of the central hypergeometric distribution of x1 given r
+    var = r * (2.0 * n - r) / (4.0 * np.maximum(2.0 * n - 1.0, 1.0))
+    half = np.ceil(_WINDOW_SD * np.sqrt(var)).astype(np.int64) + _WINDOW_PAD
+    return center, half
+
+
+def _log_sum(r: np.ndarray, n: np.ndarray, log_t: float, center: np.ndarray,
+             half: int, table: np.ndarray) -> np.ndarray:
+    """
+    A function to log-sum-exp the terms of a chunk of observations
+
+    Parameters
+    =--------=
+    r, n: numpy arrays
+        The cumulative number of positives and pairs of the chunk
+    log_t: float
+        The log of the odds ratio
+    center: numpy array
+        The center of the summation window of every observation
+    half: integer
+        The half width of the summation window of the chunk
+    table: numpy array
+        The log factorial table
+
+    Returns
+    =-----=
+    total: numpy array
+        log sum_j C(n, j) C(n, r - j) t^j for every observation
+    """
+    lower = np.maximum(0, r - n)[:, None]
+    upper = np.minimum(n, r)[:, None]
+    j = center[:, None] + np.arange(-half, half + 1)
+    valid = (j >= lower) & (j <= upper)
+    j = np.clip(j, lower, upper)
+
+    nc = n[:, None]
+    rc = r[:, None]
+    terms = j * log_t - (table[j] + table[nc - j] + table[rc - j] +
+                         table[nc - rc + j])
+    terms[~valid] = -np.inf
+    top = terms.max(axis=1)
+
+    # widen the rows whose window was cut while the terms were still large
+    cut = (((j[:, 0] > lower[:, 0]) & (terms[:, 0] > top - _TAIL_GAP)) |
+           ((j[:, -1] < upper[:, 0]) & (terms[:, -1] > top - _TAIL_GAP)))
+    total = np.log(np.exp(terms - top[:, None]).sum(axis=1)) + top
+    if cut.any():
+        total[cut] = _log_sum(r[cut], n[cut], log_t, center[cut], 2 * half,
+                              table)
+    return total + 2.0 * table[n]
+
+
+def log_odds_normalizer(r, n, t1: float, table=None) -> np.ndarray:
+    """
+    A function to compute Meeker's log normalizer z(r, n) of every
+    observation
+
+    Parameters
+    =--------=
+    r: array like
+        The cumulative number of positives in both groups
+    n: array like
+        The number of (treatment, control) pairs
+    t1: float
+        The odds ratio of the alternative hypothesis
+    table: BoundaryTable
+        An optional precomputed table of the same odds ratio; observations
+        it covers are looked up instead of computed
+
+    Returns
+    =-----=
+    z: numpy array
+        log(sum_j C(n, j) C(n, r - j) t1^j) - log(C(2n, r))
+    """
+    r = np.asarray(r, dtype=np.int64)
+    n = np.asarray(n, dtype=np.int64)
+    if table is not None:
+        if table.t1 != t1:
+            raise ValueError(f'the boundary table was built for t1={table.t1}'
+                             + f', not t1={t1}')
+        covered = table.covers(r, n)
+        z = np.empty(r.shape[0])
+        z[covered] = table.lookup(r[covered], n[covered])
+        z[~covered] = log_odds_normalizer(r[~covered], n[~covered], t1)
+        return z
+
+    z = np.empty(r.shape[0])
+    if r.shape[0] == 0:
+        return z
+    table = log_factorials(2 * int(n.max()))
+    log_t = math.log(t1)
+    center, half = _window(r, n, t1)
+
+    start = 0
+    while start < r.shape[0]:
+        # size the chunk on the widest window it would contain
+        rows = max(1, _CHUNK_ELEMENTS // (2 * int(half[start]) + 1))
+        widest = int(half[start:start + rows].max())
+        rows = max(1, _CHUNK_ELEMENTS // (2 * widest + 1))
+        end = min(start + rows, r.shape[0])
+        z[start:end] = _log_sum(r[start:end], n[start:end], log_t,
+                                center[start:end],
+                                int(half[start:end].max()), table)
+        start = end
+
+    # Vandermonde: sum_j C(n, j) C(n, r - j) = C(2n, r)
+    return z - (table[2 * n] - table[r] - table[2 * n - r])
+
+
+def sprt_statistics(x1, r, n, t1: float, table=None) -> tuple:
+    """
+    A function to compute the log probability ratio series of the test
+
+    Parameters
+    =--------=
+    x1: array like
+        The cumulative number of positives in the treatment group
+    r: array like
+        The cumulative number of positives in both groups
+    n: array like
+        The number of (treatment, control) pairs
+    t1: float
+        The odds ratio of the alternative hypothesis
+    table: BoundaryTable
+        An optional precomputed table of the same odds ratio
+
+    Returns
+    =-----=
+    stats, z: numpy arrays
+        The log probability ratios and the log normalizers they came from
+    """
+    z = log_odds_normalizer(r, n, t1, table)
+    stats = np.asarray(x1) * math.log(t1) - z
+    return stats, z
+
+
+def scan_statistics(x1, r, n, t1: float, l: float, u: float, table=None,
+                    block: int = _SCAN_BLOCK) -> tuple:
+    """
+    A function to compute the log probability ratios block by block and stop
+    at the first one outside the open interval (l, u)
+
+    Parameters
+    =--------=
+    x1, r, n: numpy arrays
+        The cumulative treatment positives, total positives and pairs
+    t1: float
+        The odds ratio of the alternative hypothesis
+    l, u: floats
+        The lower and upper critical points of the statistic
+    table: BoundaryTable
+        An optional precomputed table of the same odds ratio
+    block: integer
+        The number of observations evaluated at a time
+
+    Returns
+    =-----=
+    stats, z: numpy arrays
+        The statistics and log normalizers up to and including the first
+        crossing, or of every observation if there is none
+    """
+    stats = [np.zeros(0)]
+    zs = [np.zeros(0)]
+    for start in range(0, len(n), block):
+        end = start + block
+        part, z = sprt_statistics(x1[start:end], r[start:end], n[start:end],
+                                  t1, table)
+        crossed = np.flatnonzero((part >= u) | (part <= l))
+        if crossed.shape[0] > 0:
+            stats.append(part[:crossed[0] + 1])
+            zs.append(z[:crossed[0] + 1])
+            break
+        stats.append(part)
+        zs.append(z)
+    return np.concatenate(stats), np.concatenate(zs)
+
+
+def critical_limits(z: np.ndarray, t1: float, alpha: float = 0.05,
+                    beta: float = 0.10, t0: float = 1) -> np.ndarray:
+    """
+    A function to compute Meeker's critical values c_L(r, n) and c_U(r, n)
+    for x1 from the log normalizers
+
+    Parameters
+    =--------=
+    z: numpy array
+        The log normalizers of the observations
+    t1: float
+        The odds ratio of the alternative hypothesis
+    alpha: float
+        The type I error rate
+    beta: float
+        The type II error rate
+    t0: float
+        The odds ratio of the null hypothesis
+
+    Returns
+    =-----=
+    limits: numpy array
+        Two columns giving the lower and upper critical limits, respectively
+    """
+    a = -math.log(alpha / (1 - beta))
+    b = math.log(beta / (1 - alpha))
+    bounds = (np.array([b, 1 + a]) + np.asarray(z)[:, None]) / \
+        math.log(t1 / t0)
+    return np.floor(bounds).astype(np.int64)
+
+
+def truncate(x1_last: int, z_last: float, t1: float, alpha: float = 0.05,
+             beta: float = 0.10) -> tuple:
+    """
+    A function to make Meeker's H0-conservative decision (his formula 2.2)
+    for a test that reached its truncation point undecided
+
+    Parameters
+    =--------=
+    x1_last: integer
+        The cumulative number of treatment positives at the truncation point
+    z_last: float
+        The log normalizer at the truncation point
+    t1: float
+        The odds ratio of the alternative hypothesis
+    alpha: float
+        The type I error rate
+    beta: float
+        The type II error rate
+
+    Returns
+    =-----=
+    truncate_decision, outcome: strings
+        'h0' or 'h1' and the matching outcome message
+    """
+    # floor of the mid point of the two critical values, minus a half
+    a = -math.log(alpha / (1 - beta))
+    b = math.log(beta / (1 - alpha))
+    c1 = math.floor(((b + 1 + a) / 2 + z_last) / math.log(t1) - 0.5)
+    if x1_last <= c1:
+        return ('h0', 'Maximum Limit Decision. The approximate decision ' +
+                'point shows their is no statistically significant ' +
+                'difference between two test groups')
+    return ('h1', 'Maximum Limit Decision. The approximate decision point ' +
+            'shows exposed group produced a statistically significant ' +
+            'increase.')
+
+
+def _running_sum(series, size: int) -> np.ndarray:
+    """
+    The cumulative sums of the first `size` observations of an int8 series
+    or of a (packed, length) pair
+    """
+    if isinstance(series, tuple):
+        return cumulative_successes(series, size)
+    return np.cumsum(np.asarray(series)[:size], dtype=np.int64)
+
+
+def conditional_sprt(x, y, t1: float, alpha: float = 0.05,
+                     beta: float = 0.10, stop=None, table=None,
+                     early_exit: bool = False) -> tuple:
+    """
+    Meeker's SPRT for matched `x` (treatment) and `y` (control), both
+    indicator responses, likelihood ratio t1, error rates alpha and beta,
+    and (optionally) truncation after trial stop.
+
+    Parameters
+    =--------=
+    x: array like or tuple
+        The 0/1 responses of the treatment group, or a (packed, length)
+        pair of their bit-packed form (see bernoulliSeries)
+    y: array like or tuple
+        The 0/1 responses of the control group, int8 or (packed, length)
+    t1: float
+        The odds ratio of the alternative hypothesis
+    alpha: float
+        The type I error rate
+    beta: float
+        The type II error rate
+    stop: integer
+        The trial after which the test is truncated; only the first `stop`
+        pairs are read and, if the test is still undecided there, Meeker's
+        H0-conservative rule makes the decision
+    table: BoundaryTable
+        An optional precomputed table the limits are looked up in
+    early_exit: boolean
+        Whether to evaluate the statistic in blocks and stop at the first
+        boundary crossing, in which case `n`, `x1`, `r`, `stats` and `limits`
+        only hold the trace up to and including index `k`
+
+    Returns
+    =-----=
+    (outcome, n, k, l, u, truncated, truncate_decision, x1, r, stats, limits)
+        The same 11-tuple `abTestHelper.conditionalSPRT` has always returned
+    """
+    if t1 <= 1:
+        raise ValueError('Odd ratio should exceed 1.')
+    l = math.log(beta / (1 - alpha))
+    u = -math.log(alpha / (1 - beta))
+    sample_size = min(series_length(x), series_length(y))
+    if stop is not None:
+        sample_size = min(sample_size, math.floor(stop))
+    n = np.arange(1, sample_size + 1)
+
+    x1 = _running_sum(x, sample_size)
+    r = x1 + _running_sum(y, sample_size)
+    if early_exit:
+        stats, z = scan_statistics(x1, r, n, t1, l, u, table)
+        n = n[:len(stats)]
+        x1 = x1[:len(stats)]
+        r = r[:len(stats)]
+    else:
+        stats, z = sprt_statistics(x1, r, n, t1, table)
+    limits = critical_limits(z, t1, alpha, beta)
+
+    #
+    # Perform the test by finding the first index, if any, at which `stats`
+    # falls outside the open interval (l, u).
+    #
+    crossed = np.flatnonzero((stats >= u) | (stats <= l))
+    if crossed.shape[0] < 1:
+        k = np.nan
+        outcome = 'Unable to conclude.Needs more sample.'
+    else:
+        k = crossed[0]
+        if stats[k] >= u:
+            outcome = 'Exposed group produced a statistically significant ' + \
+                'increase.'
+        else:
+            outcome = 'Their is no statistically significant difference ' + \
+                'between two test groups'
+    truncate_decision = 'Non'
+    truncated = np.nan
+    if (stop is not None) and np.isnan(k) and (sample_size > 0) and \
+            (sample_size == math.floor(stop)):
+        #
+        # Truncate at trial stop, using Meeker's H0-conservative formula
+        # (2.2). Leave k=NA to indicate the decision was made due to
+        # truncation.
+        #
+        truncated = sample_size
+        truncate_decision, outcome = truncate(x1[-1], z[-1], t1, alpha, beta)
+    return (outcome, n, k, l, u, truncated, truncate_decision, x1, r, stats,
+            limits)
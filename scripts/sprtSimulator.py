@@ -0,0 +1,174 @@
+"""
+A Monte Carlo simulator of the operating characteristics of the conditional
+SPRT.
+
+For every (control conversion rate, true odds ratio) point it draws paired
+Bernoulli streams for many replicates at once with a numpy Generator and
+runs the test on all of them in lock step: at n pairs the log normalizer of
+every replicate is read from the current row of the boundary recurrence
+(see `boundaryTable.next_boundary_row`), so one sweep over n serves all the
+replicates of a point. The points are spread over a process pool, each with
+its own independent seed.
+"""
+
+# imports
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from boundaryTable import next_boundary_row
+
+
+# the number of pairs drawn at once for all the replicates of a point
+_DRAW_BLOCK = 1024
+
+
+def _row_cap(p_control: float, p_exposed: float, n_max: int) -> int:
+    """
+    A function to bound the total number of positives any replicate can
+    reach, so the rows of the recurrence can be cut above it
+
+    Parameters
+    =--------=
+    p_control, p_exposed: floats
+        The conversion rates of the two groups
+    n_max: integer
+        The largest number of pairs simulated
+
+    Returns
+    =-----=
+    cap: integer
+        An upper bound of r that is only exceeded with a negligible
+        probability (about 20 standard deviations above the mean)
+    """
+    mean = n_max * (p_control + p_exposed)
+    var = n_max * (p_control * (1 - p_control) + p_exposed * (1 - p_exposed))
+    return int(min(2 * n_max, math.ceil(mean + 20 * math.sqrt(var) + 20)))
+
+
+def _simulate_point(job: tuple) -> dict:
+    """
+    A function to simulate the replicates of one (p_control, odds_ratio)
+    point
+
+    Parameters
+    =--------=
+    job: tuple
+        (p_control, odds_ratio, t1, alpha, beta, n_max, replicates, seed)
+
+    Returns
+    =-----=
+    result: dict
+        The decision rates and the average sample number of the point
+    """
+    p_control, odds_ratio, t1, alpha, beta, n_max, replicates, seed = job
+    odds = odds_ratio * p_control / (1 - p_control)
+    p_exposed = odds / (1 + odds)
+    rng = np.random.default_rng(seed)
+
+    l = math.log(beta / (1 - alpha))
+    u = -math.log(alpha / (1 - beta))
+    log_t = math.log(t1)
+    cap = _row_cap(p_control, p_exposed, n_max)
+
+    # 1 for "reject null", -1 for "accept null", 0 while undecided
+    decision = np.zeros(replicates, dtype=np.int8)
+    sample = np.full(replicates, n_max, dtype=np.int64)
+    active = np.arange(replicates)
+    x1 = np.zeros(replicates, dtype=np.int64)
+    r = np.zeros(replicates, dtype=np.int64)
+
+    row = np.zeros(1)
+    n = 0
+    while n < n_max and active.shape[0] > 0:
+        steps = min(_DRAW_BLOCK, n_max - n)
+        size = (steps, active.shape[0])
+        xs = rng.random(size) < p_exposed
+        ys = rng.random(size) < p_control
+        block_x1 = x1[active] + np.cumsum(xs, axis=0, dtype=np.int64)
+        block_r = r[active] + (block_x1 - x1[active]) + \
+            np.cumsum(ys, axis=0, dtype=np.int64)
+        if block_r[-1].max() > cap:
+            raise RuntimeError('a replicate exceeded the recurrence cap')
+
+        alive = np.ones(active.shape[0], dtype=bool)
+        for i in range(steps):
+            row = next_boundary_row(row, n, t1, size=min(len(row) + 2,
+                                                         cap + 1))
+            n += 1
+            stats = block_x1[i] * log_t - row[block_r[i]]
+            hit = alive & ((stats >= u) | (stats <= l))
+            if hit.any():
+                decision[active[hit]] = np.where(stats[hit] >= u, 1, -1)
+                sample[active[hit]] = n
+                alive &= ~hit
+                if not alive.any():
+                    break
+
+        x1[active] = block_x1[i]
+        r[active] = block_r[i]
+        active = active[alive]
+
+    return {
+        "p_control": p_control,
+        "odds_ratio": odds_ratio,
+        "p_exposed": p_exposed,
+        "replicates": replicates,
+        "reject_null": float(np.mean(decision == 1)),
+        "accept_null": float(np.mean(decision == -1)),
+        "undecided": float(np.mean(decision == 0)),
+        "asn": float(sample.mean()),
+    }
+
+
+def simulate_operating_characteristics(t1: float, p_control: list,
+                                       odds_ratios: list,
+                                       alpha: float = 0.05,
+                                       beta: float = 0.10,
+                                       n_max: int = 50000,
+                                       replicates: int = 10000,
+                                       seed: int = None,
+                                       workers: int = None) -> pd.DataFrame:
+    """
+    A function to estimate the operating characteristic (OC) and average
+    sample number (ASN) curves of Meeker's test
+
+    Parameters
+    =--------=
+    t1: float
+        The odds ratio the test is designed for
+    p_control: list
+        The baseline (control) conversion rates to simulate
+    odds_ratios: list
+        The true odds ratios of exposed vs control to simulate; 1 gives the
+        type I error and t1 the power of the design
+    alpha: float
+        The type I error rate of the design
+    beta: float
+        The type II error rate of the design
+    n_max: integer
+        The number of pairs after which a replicate counts as undecided
+    replicates: integer
+        The number of replicates of every point
+    seed: integer
+        The seed the independent seeds of the points are spawned from
+    workers: integer
+        The size of the process pool, 1 to run in this process
+
+    Returns
+    =-----=
+    oc: pandas data frame
+        One row per point with the rates of "reject null", "accept null" and
+        undecided replicates, and the average number of pairs used
+    """
+    points = [(p, theta) for p in p_control for theta in odds_ratios]
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    jobs = [(p, theta, t1, alpha, beta, n_max, replicates, s)
+            for (p, theta), s in zip(points, seeds)]
+
+    if workers == 1:
+        results = [_simulate_point(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_simulate_point, jobs))
+    return pd.DataFrame(results)
@@ -0,0 +1,163 @@
+"""
+A manifest of the files a DVC pipeline stage produced.
+
+Every output a stage writes through its manifest is recorded with the
+fingerprint of the frame it holds (a hash of the content, the columns and
+the stage parameters) and the md5 and size of the written file. When a
+stage runs again on unchanged data with unchanged parameters, the
+fingerprint and the file on disk both still match the manifest, so the write
+is skipped: the file keeps its timestamp and DVC sees no change downstream.
+The manifest itself is a small json file, data/.manifests/<stage>.json by
+default.
+"""
+
+# imports
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from dataCache import file_md5
+
+
+class StageManifest():
+    """
+    The produced-files manifest of a pipeline stage.
+    """
+    def __init__(self, stage: str, params: dict = None,
+                 folder: str = 'data/.manifests') -> None:
+        """
+        The stage manifest initializer
+
+        Parameters
+        =--------=
+        stage: string
+            The name of the DVC stage, e.g. eda
+        params: dictionary
+            The parameters of the stage, part of every fingerprint
+        folder: string
+            The folder of the manifest files
+
+        Returns
+        =-----=
+        None: nothing
+            The manifest of the last run is loaded, if any
+        """
+        self.stage = stage
+        self.params = {} if params is None else params
+        self.path = os.path.join(folder, f'{stage}.json')
+        self.produced = {}
+        if os.path.exists(self.path):
+            with open(self.path) as manifest:
+                self.produced = json.load(manifest).get('produced', {})
+
+    def fingerprint(self, df: pd.DataFrame) -> str:
+        """
+        A function to hash the content of a frame with the stage parameters
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The frame to fingerprint
+
+        Returns
+        =-----=
+        fingerprint: string
+            The hexadecimal md5 of the rows, index, columns, dtypes and
+            parameters
+        """
+        digest = hashlib.md5()
+        digest.update(json.dumps(self.params, sort_keys=True,
+                                 default=str).encode())
+        digest.update(json.dumps([[str(c), str(t)] for c, t in
+                                  df.dtypes.items()]).encode())
+        rows = pd.util.hash_pandas_object(df, index=True).to_numpy()
+        digest.update(np.ascontiguousarray(rows).tobytes())
+        return digest.hexdigest()
+
+    def is_current(self, path: str, fingerprint: str) -> bool:
+        """
+        A function to tell whether a file still holds the recorded content
+
+        Parameters
+        =--------=
+        path: string
+            The path of the output
+        fingerprint: string
+            The fingerprint of the content about to be written
+
+        Returns
+        =-----=
+        current: boolean
+            True if the manifest has that fingerprint for the file and the
+            file on disk is the one that was written
+        """
+        entry = self.produced.get(path)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        return file_md5(path) == entry['md5']
+
+    def record(self, path: str, fingerprint: str) -> None:
+        """
+        A function to record an output written by the stage
+
+        Parameters
+        =--------=
+        path: string
+            The path of the output
+        fingerprint: string
+            The fingerprint of its content
+
+        Returns
+        =-----=
+        None: nothing
+            The manifest is updated and saved
+        """
+        self.produced[path] = {'fingerprint': fingerprint,
+                               'md5': file_md5(path),
+                               'size': os.path.getsize(path)}
+        self.save()
+
+    def write_csv(self, df: pd.DataFrame, path: str, **kwargs) -> bool:
+        """
+        A function to write a frame as csv unless the file already holds it
+
+        Parameters
+        =--------=
+        df: pandas data frame
+            The frame to write
+        path: string
+            The path of the csv file
+        kwargs: keyword arguments
+            Passed on to DataFrame.to_csv, and part of the fingerprint
+
+        Returns
+        =-----=
+        written: boolean
+            False if the write was skipped
+        """
+        fingerprint = self.fingerprint(df)
+        if kwargs:
+            fingerprint = hashlib.md5((fingerprint + json.dumps(
+                kwargs, sort_keys=True, default=str)).encode()).hexdigest()
+        if self.is_current(path, fingerprint):
+            return False
+        df.to_csv(path, **kwargs)
+        self.record(path, fingerprint)
+        return True
+
+    def save(self) -> None:
+        """
+        A function to write the manifest
+
+        Returns
+        =-----=
+        None: nothing
+            The manifest is written to its json file
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as manifest:
+            json.dump({'stage': self.stage, 'produced': self.produced},
+                      manifest, indent=2, sort_keys=True)
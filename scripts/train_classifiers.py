@@ -1,77 +1,230 @@
+import os
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import scipy.stats as stat
 import matplotlib.pyplot as plt
-from xgboost import XGBClassifier
 from sklearn import metrics
+from sklearn.base import clone
 from sklearn.decomposition import PCA
 from sklearn.model_selection import KFold 
 from sklearn.tree import DecisionTreeClassifier 
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression 
 from sklearn.metrics import mean_squared_error, confusion_matrix
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# the titles of the model families
+TITLES = {
+    'decision_tree': "Decision Tree Classifier",
+    'logistic_regression': "Logistic Regression Classifier",
+    'random_forest': "Random Forest Classifier",
+    'xgboost': "XGBoost Classifier",
+}
+
+# the parameters of a model family when none are given
+DEFAULT_PARAMS = {
+    'decision_tree': {'max_depth': 4},
+}
+
+# the features and labels of the folds, set once per worker
+_FOLD_DATA = {}
+
+
+def make_classifier(family: str, params: dict = None):
+    """
+    A function to build an unfitted classifier of a model family
+
+    Parameters
+    =--------=
+    family: string
+        decision_tree, logistic_regression, random_forest or xgboost
+    params: dictionary
+        The parameters of the classifier, those of DEFAULT_PARAMS if None
+
+    Returns
+    =-----=
+    classifier: estimator
+        The scikit-learn compatible classifier
+    """
+    if params is None:
+        params = DEFAULT_PARAMS.get(family, {})
+    if family == 'decision_tree':
+        return DecisionTreeClassifier(**params)
+    if family == 'logistic_regression':
+        return LogisticRegression(**params)
+    if family == 'random_forest':
+        return RandomForestClassifier(**params)
+    if family == 'xgboost':
+        from xgboost import XGBClassifier
+        return XGBClassifier(**params)
+    raise ValueError(f'unknown model family: {family}')
+
+
+def _share(array):
+    """
+    Copy an array into a new shared memory block
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(shared):
+    """
+    Map an array of a shared memory block given as (name, shape, dtype)
+    """
+    name, shape, dtype = shared
+    block = shared_memory.SharedMemory(name=name)
+    # keep the block open while the worker uses the array
+    _FOLD_DATA.setdefault('blocks', []).append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _init_folds(X, y, folds):
+    """
+    The pool initializer handing a worker the features and labels, given as
+    pandas objects or as the shared memory blocks of their columns
+    """
+    if isinstance(X, list):
+        # one block per column, so every column keeps its dtype
+        X = pd.DataFrame({column: _attach(shared) for column, shared in X},
+                         copy=False)
+        name, shared = y
+        y = pd.Series(_attach(shared), name=name, copy=False)
+    _FOLD_DATA.update(X=X, y=y,
+                      splits=list(KFold(n_splits=folds).split(X)))
+
+
+def _fit_fold(job):
+    """
+    Fit a clone of the estimator on one fold and score it on the held out
+    rows
+    """
+    estimator, fold = job
+    train_index, valid_index = _FOLD_DATA['splits'][fold]
+    X, y = _FOLD_DATA['X'], _FOLD_DATA['y']
+    model = estimator.fit(X.iloc[train_index], y.iloc[train_index])
+    pred = model.predict(X.iloc[valid_index])
+    accuracy = metrics.accuracy_score(y.iloc[valid_index], pred)
+    loss = np.sqrt(mean_squared_error(y.iloc[valid_index], pred))
+    return model, accuracy, loss
 
 
 class TrainingClassifier:
     
-    def __init__(self, X_train, X_test, y_train, y_test, classifier):
+    def __init__(self, X_train, X_test, y_train, y_test, classifier,
+                 encoder=None):
         
-        self.X_train = X_train
-        self.X_test = X_test
+        # the fitted vocabulary encoder of the categorical features, if the
+        # features are not encoded yet
+        self.encoder = encoder
+        self.X_train = self.encode(X_train)
+        self.X_test = self.encode(X_test)
         self.y_train = y_train
         self.y_test = y_test
         self.clf = classifier 
         self.title = ""
 
-        if self.clf == 'decision_tree': 
-            self.clf = DecisionTreeClassifier(max_depth=4)
-            self.title = "Decision Tree Classifier"
-        
-        if self.clf == 'logistic_regression':
-            self.clf = LogisticRegression()
-            self.title = "Logistic Regression Classifier"
+        # a model family, or the family and params of the best candidate of
+        # a modelSearch.SuccessiveHalvingSearch
+        params = None
+        if isinstance(classifier, dict):
+            classifier, params = classifier['family'], classifier['params']
+        if isinstance(classifier, str):
+            self.clf = make_classifier(classifier, params)
+            self.title = TITLES[classifier]
 
-        if self.clf == 'random_forest':
-            self.clf = RandomForestClassifier()
-            self.title = "Random Forest Classifier"
+    def encode(self, X):
+        if self.encoder is None:
+            return X
+        return self.encoder.transform(X)
 
-        if self.clf == 'xgboost':
-            self.clf = XGBClassifier()
-            self.title = "XGBoost Classifier" 
+    def predict(self, X):
+        """
+        Predicting raw features with the fitted classifier, encoding them
+        with the same vocabulary as the training features.
+        """
+        return self.clf.predict(self.encode(X))
 
     def loss_function(self, actual, pred):
         rmse = np.sqrt(mean_squared_error(actual, pred))
         return rmse
 
-    def train(self, folds=1):
-        
-        kf = KFold(n_splits = folds)
-        
-        iterator = kf.split(self.X_train)
-        
+    def train(self, folds=1, workers=1, backend='process'):
+        """
+        Cross validating the classifier on `folds` folds of the training
+        data, fitting an independent clone of it on every fold.
+
+        The folds run on a pool of `workers` processes (or threads with
+        backend='thread'), None for one per CPU, and 1 runs them one after
+        the other in this process. The serial and thread runs slice the
+        training frame itself; for a process pool every numeric column and
+        the labels are put in shared memory once, with their own dtypes, and
+        every worker slices its folds out of them, so only the estimator and
+        a fold number are sent per fold (frames with other columns are sent
+        to every worker once). The fitted models of the folds are kept in
+        self.fold_models and self.clf is the model of the last fold.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, folds))
+
+        X = self.X_train.reset_index(drop=True)
+        y = self.y_train.reset_index(drop=True)
+        jobs = [(clone(self.clf), i) for i in range(folds)]
+
+        blocks = []
+        try:
+            if workers == 1 or backend == 'thread':
+                _init_folds(X, y, folds)
+                if workers == 1:
+                    results = [_fit_fold(job) for job in jobs]
+                else:
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        results = list(pool.map(_fit_fold, jobs))
+            else:
+                X_shared, y_shared = X, y
+                plain = all(isinstance(dtype, np.dtype) and
+                            dtype.kind in 'biuf'
+                            for dtype in list(X.dtypes) + [y.dtype])
+                if plain:
+                    X_shared = []
+                    for column in X.columns:
+                        block, shared = _share(
+                            np.ascontiguousarray(X[column].to_numpy()))
+                        blocks.append(block)
+                        X_shared.append((column, shared))
+                    block, shared = _share(np.ascontiguousarray(y.to_numpy()))
+                    blocks.append(block)
+                    y_shared = (y.name, shared)
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_init_folds,
+                                         initargs=(X_shared, y_shared,
+                                                   folds)) as pool:
+                    results = list(pool.map(_fit_fold, jobs))
+        finally:
+            _FOLD_DATA.clear()
+            for block in blocks:
+                block.close()
+                block.unlink()
+
         loss_arr = []
         acc_arr = []
-        for i in range(folds):
-            train_index, valid_index = next(iterator)
-            
-            X_train, y_train = self.X_train.iloc[train_index], self.y_train.iloc[train_index]
-            X_valid, y_valid = self.X_train.iloc[valid_index], self.y_train.iloc[valid_index]
-                        
-            self.clf = self.clf.fit(X_train, y_train)
-            
-            vali_pred = self.clf.predict(X_valid)
-            
-            accuracy = self.calculate_score(y_valid, vali_pred)
-            loss = self.loss_function(y_valid, vali_pred)
-            
+        self.fold_models = []
+        for i, (model, accuracy, loss) in enumerate(results):
             self.__printAccuracy(accuracy, i, label="Validation")
             self.__printLoss(loss, i, label="Validation")
             print()
             
+            self.fold_models.append(model)
             acc_arr.append(accuracy)
             loss_arr.append(loss)
 
+        self.clf = self.fold_models[-1]
             
         return self.clf, acc_arr, loss_arr
     
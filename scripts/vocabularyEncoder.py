@@ -0,0 +1,173 @@
+"""
+A persistent vocabulary encoder of the categorical features.
+
+The encoder learns the sorted vocabulary of every categorical column once
+and encodes a column with one hash lookup into its vocabulary (the codes of
+a pandas categorical with those categories) instead of a sort, so a value
+gets the same code at training and at scoring time, and the codes match
+those of a LabelEncoder fitted on the same values. Values outside the
+vocabulary (and missing values) get a reserved code, -1 by default. The
+vocabularies are saved with their dtypes as a small json file and loaded
+back for any later encoding.
+"""
+
+# imports
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+# the code of the values outside the vocabulary
+UNSEEN = -1
+
+
+class VocabularyEncoder():
+    """
+    A fitted, serializable encoder of categorical columns to integer codes.
+    """
+    def __init__(self, columns: list = None, unseen: int = UNSEEN) -> None:
+        """
+        The vocabulary encoder initializer
+
+        Parameters
+        =--------=
+        columns: list
+            The columns to encode, the object and categorical columns of the
+            fitted data if None
+        unseen: integer
+            The code of the values outside the vocabulary and of missing
+            values
+
+        Returns
+        =-----=
+        None: nothing
+            An unfitted encoder is set up
+        """
+        self.columns = None if columns is None else list(columns)
+        self.unseen = unseen
+        self.vocabulary = {}
+
+    def fit(self, data) -> 'VocabularyEncoder':
+        """
+        A function to learn the vocabulary of every column
+
+        Parameters
+        =--------=
+        data: pandas data frame or iterable of pandas data frames
+            The training data, e.g. dataLoader.iter_chunks of a file
+
+        Returns
+        =-----=
+        encoder: VocabularyEncoder
+            The encoder itself
+        """
+        if isinstance(data, pd.DataFrame):
+            data = [data]
+        values = {}
+        for chunk in data:
+            if self.columns is None:
+                self.columns = list(chunk.select_dtypes(
+                    ['object', 'string', 'category']).columns)
+            for column in self.columns:
+                seen = chunk[column].dropna().unique()
+                values[column] = seen if column not in values else \
+                    np.union1d(values[column], seen)
+        self.vocabulary = {column: pd.Index(np.unique(values[column]))
+                           for column in values}
+        return self
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        A function to encode the columns with their vocabulary codes
+
+        Parameters
+        =--------=
+        data: pandas data frame
+            The data, with every encoded column
+
+        Returns
+        =-----=
+        data: pandas data frame
+            A copy of the data with the encoded columns replaced by their
+            codes
+        """
+        if not self.vocabulary:
+            raise ValueError('the encoder is not fitted')
+        codes = {}
+        for column, vocabulary in self.vocabulary.items():
+            # one hash lookup per value; -1 outside the vocabulary
+            encoded = vocabulary.get_indexer(data[column])
+            if self.unseen != -1:
+                encoded = np.where(encoded < 0, self.unseen, encoded)
+            codes[column] = encoded
+        return data.assign(**codes)
+
+    def fit_transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        A function to learn the vocabulary of the data and encode it
+
+        Parameters
+        =--------=
+        data: pandas data frame
+            The training data
+
+        Returns
+        =-----=
+        data: pandas data frame
+            A copy of the data with the encoded columns replaced by their
+            codes
+        """
+        return self.fit(data).transform(data)
+
+    def save(self, path: str) -> None:
+        """
+        A function to write the vocabularies to a json file
+
+        Parameters
+        =--------=
+        path: string
+            The path of the json file
+
+        Returns
+        =-----=
+        None: nothing
+            The encoder is written
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as vocabulary:
+            # values json does not hold (e.g. dates) are written as strings
+            # and parsed back with the dtype of their vocabulary
+            json.dump({'unseen': self.unseen,
+                       'vocabulary': {column: values.tolist() for
+                                      column, values in
+                                      self.vocabulary.items()},
+                       'dtypes': {column: str(values.dtype) for
+                                  column, values in
+                                  self.vocabulary.items()}},
+                      vocabulary, indent=2, default=str)
+
+    @classmethod
+    def load(cls, path: str) -> 'VocabularyEncoder':
+        """
+        A function to read an encoder written by save
+
+        Parameters
+        =--------=
+        path: string
+            The path of the json file
+
+        Returns
+        =-----=
+        encoder: VocabularyEncoder
+            The fitted encoder
+        """
+        with open(path) as vocabulary:
+            saved = json.load(vocabulary)
+        encoder = cls(list(saved['vocabulary']), saved['unseen'])
+        dtypes = saved.get('dtypes', {})
+        encoder.vocabulary = {column: pd.Index(values,
+                                               dtype=dtypes.get(column))
+                              for column, values in
+                              saved['vocabulary'].items()}
+        return encoder
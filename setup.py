@@ -7,7 +7,7 @@ from setuptools import setup, find_packages
 with open('README.md') as readme_file:
     readme = readme_file.read()
 
-requirements = ['pandas>=1.1.0', 'numpy>=1.19.0', ]
+requirements = ['pandas>=2.0.0', 'numpy>=1.19.0', ]
 
 test_requirements = ['pytest>=3', ]
 
@@ -15,14 +15,12 @@ setup(
     authors=['Birtuhan Kuma', 'Fisseha Estifanos', 'Hanna Desta', 'Yohanes Gutema'],
     emails=['birtukankuma1113@gmail.com', 'fisseha.137@gmail.com', 'hnnadesta@gmail.com', 'yohgut@gmail.com'],
     githubprofiles = ['https://github.com/BirtukanK', 'https://github.com/fisseha-estifanos', '', 'https://github.com/Yohanes-GR'],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
     ],
     description="A repository to collaborate, code and track the week 2 group work assignment (Ab hypothesis testing) of 10 academy batch VI intensive training.",
@@ -0,0 +1,337 @@
+import unittest
+import sys, os
+sys.path.append(os.path.abspath(os.path.join('..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '..', 'scripts')))
+
+import json
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from dataLoader import epoch_hours, iter_chunks, read_data
+from dataCache import cached_read
+from stageManifest import StageManifest
+from edaHelper import count_frequencies, summarize_participation
+from dataVisualizer import dataVisualizer
+from dataCleaner import dataCleaner
+from quantileSketch import KLLSketch
+
+
+def sample_data(rows=1000, seed=0):
+    """
+    A small frame with the columns of AdSmartABdata.csv
+    """
+    rng = np.random.default_rng(seed)
+    yes = rng.integers(0, 2, rows)
+    answered = rng.random(rows) < 0.2
+    return pd.DataFrame({
+        'auction_id': [f'id-{i}' for i in range(rows)],
+        'experiment': rng.choice(['exposed', 'control'], rows),
+        'date': rng.choice(['2020-07-03', '2020-07-04', '2020-07-05'], rows),
+        'hour': rng.integers(0, 24, rows),
+        'device_make': rng.choice(['Samsung', 'Generic Smartphone'], rows),
+        'platform_os': rng.choice([5, 6, 7], rows),
+        'browser': rng.choice(['Chrome Mobile', 'Facebook'], rows),
+        'yes': np.where(answered, yes, 0),
+        'no': np.where(answered, 1 - yes, 0),
+    })
+
+
+class TestDataLoader(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'AdSmartABdata.csv')
+        self.df = sample_data()
+        self.df.to_csv(self.path, index=False)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_typed_chunks(self):
+        """
+        Test that every chunk has the declared dtypes and only the asked
+        columns
+        """
+        chunks = list(iter_chunks(self.path, chunksize=300,
+                                  usecols=['experiment', 'hour', 'yes']))
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        for chunk in chunks:
+            self.assertEqual(list(chunk.columns), ['experiment', 'hour', 'yes'])
+            self.assertEqual(chunk['experiment'].dtype, 'category')
+            self.assertEqual(chunk['hour'].dtype, np.int8)
+
+    def test_read_data_matches_csv(self):
+        """
+        Test that the assembled chunks hold the data of the file
+        """
+        df = read_data(self.path, chunksize=128)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['date']))
+        self.assertEqual(df['browser'].dtype, 'category')
+        pd.testing.assert_series_equal(
+            df['experiment'].astype(str), self.df['experiment'],
+            check_dtype=False)
+        np.testing.assert_array_equal(df['yes'], self.df['yes'])
+        np.testing.assert_array_equal(df['platform_os'].astype(int),
+                                      self.df['platform_os'])
+
+    def test_epoch_hours(self):
+        """
+        Test that the hour keys of string and parsed dates count the hours
+        since the epoch
+        """
+        expected = (pd.to_datetime(self.df['date']) +
+                    pd.to_timedelta(self.df['hour'], unit='h')).to_numpy()
+        expected = expected.astype('datetime64[h]').astype(np.int64)
+        np.testing.assert_array_equal(
+            epoch_hours(self.df['date'], self.df['hour']), expected)
+        df = read_data(self.path)
+        np.testing.assert_array_equal(epoch_hours(df['date'], df['hour']),
+                                      expected)
+
+
+class TestDataCache(unittest.TestCase):
+    def test_cache_follows_content(self):
+        """
+        Test that a revision is parsed once, read back by column, and that
+        new content gets a new copy
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'AdSmartABdata.csv')
+            sample_data(50).to_csv(path, index=False)
+            first = cached_read(path)
+            cache = os.path.join(folder, '.cache')
+
+            def copies():
+                return [name for name in os.listdir(cache)
+                        if not name.endswith('.md5.json')]
+            self.assertEqual(len(copies()), 1)
+
+            # an unchanged file is not hashed again
+            with mock.patch('dataCache.file_md5',
+                            side_effect=AssertionError('hashed again')):
+                again = cached_read(path, columns=['experiment', 'yes'])
+            self.assertEqual(list(again.columns), ['experiment', 'yes'])
+            np.testing.assert_array_equal(again['yes'], first['yes'])
+            self.assertEqual(again['experiment'].dtype, 'category')
+
+            sample_data(60, seed=1).to_csv(path, index=False)
+            self.assertEqual(len(cached_read(path)), 60)
+            self.assertEqual(len(copies()), 2)
+
+
+class TestStageManifest(unittest.TestCase):
+    def test_unchanged_write_is_skipped(self):
+        """
+        Test that a stage only rewrites an output when its content, its
+        parameters or the file on disk changed
+        """
+        df = sample_data(40)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'out.csv')
+            manifests = os.path.join(folder, '.manifests')
+            manifest = StageManifest('eda', {'version': 'v1'}, manifests)
+            self.assertTrue(manifest.write_csv(df, path, index=False))
+
+            rerun = StageManifest('eda', {'version': 'v1'}, manifests)
+            self.assertIn(path, rerun.produced)
+            self.assertFalse(rerun.write_csv(df.copy(), path, index=False))
+            self.assertTrue(rerun.write_csv(df.iloc[1:], path, index=False))
+
+            changed = StageManifest('eda', {'version': 'v2'}, manifests)
+            self.assertTrue(changed.write_csv(df.iloc[1:], path, index=False))
+            with open(path, 'a') as out:
+                out.write('edited by hand\n')
+            self.assertTrue(changed.write_csv(df.iloc[1:], path, index=False))
+
+
+class TestEdaSummaries(unittest.TestCase):
+    def test_participation_from_chunks(self):
+        """
+        Test that the summary of the chunks equals the one of the whole
+        frame and the direct counts
+        """
+        df = sample_data(1000)
+        summary = summarize_participation(df)
+        chunked = summarize_participation(
+            df.iloc[i:i + 128] for i in range(0, 1000, 128))
+        pd.testing.assert_frame_equal(chunked, summary)
+
+        control = df[df['experiment'] == 'control']
+        row = summary.loc['control']
+        self.assertEqual(row['yes'], control['yes'].sum())
+        self.assertEqual(row['total number'], len(control))
+        self.assertEqual(row['total non participants'],
+                         ((control['yes'] == 0) & (control['no'] == 0)).sum())
+        self.assertAlmostEqual(
+            row['participants percentage'],
+            (control['yes'].sum() + control['no'].sum()) / len(control) * 100)
+
+    def test_frequencies_match_crosstab(self):
+        """
+        Test the one pass counts against value_counts and crosstab, for
+        categorical and plain columns and for chunked input
+        """
+        df = sample_data(1000)
+        df['browser'] = df['browser'].astype('category')
+        df.loc[[3, 7], 'device_make'] = None
+        columns = ['browser', 'hour', 'device_make']
+        counts = count_frequencies(df, columns)
+        for column in columns:
+            pd.testing.assert_series_equal(
+                counts[column], df[column].value_counts().sort_index(),
+                check_names=False, check_index_type=False,
+                check_categorical=False)
+            pd.testing.assert_frame_equal(
+                counts[(column, 'experiment')],
+                pd.crosstab(df[column], df['experiment']),
+                check_names=False, check_index_type=False,
+                check_categorical=False)
+        chunked = count_frequencies(
+            (df.iloc[i:i + 300] for i in range(0, 1000, 300)), columns)
+        for key in counts:
+            np.testing.assert_array_equal(chunked[key], counts[key])
+
+
+class TestPlotBatch(unittest.TestCase):
+    def setUp(self):
+        # the visualizer logs to logs/ under the working directory
+        self.cwd = os.getcwd()
+        self.folder = tempfile.TemporaryDirectory()
+        os.chdir(self.folder.name)
+        os.makedirs('logs')
+        self.visualizer = dataVisualizer('plot batch tests')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.folder.cleanup()
+
+    def test_batch_saves_every_plot(self):
+        """
+        Test that the pool renders every spec and returns the saved paths
+        in order
+        """
+        df = sample_data(300)
+        specs = [
+            {'kind': 'count', 'column': 'hour', 'save_as': 'hour.png'},
+            {'kind': 'count', 'column': 'browser', 'hue': 'experiment',
+             'title': 'experiment vs browser', 'save_as': 'browser.png'},
+            {'kind': 'pie', 'column': 'device_make', 'save_as': 'pie.png'},
+            {'kind': 'heatmap', 'title': 'correlation', 'save_as': 'hm.png'},
+        ]
+        paths = self.visualizer.plot_batch(df, specs, workers=2)
+        self.assertEqual(paths, ['hour.png', 'browser.png', 'pie.png',
+                                 'hm.png'])
+        for path in paths:
+            self.assertGreater(os.path.getsize(path), 0)
+        self.assertRaises(ValueError, self.visualizer.plot_batch, df,
+                          [{'kind': 'violin', 'save_as': 'v.png'}], 1)
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def test_merged_chunks_rank_error(self):
+        """
+        Test that merged chunk sketches estimate quantiles within the
+        expected rank error
+        """
+        values = np.random.default_rng(2).lognormal(size=200000)
+        chunks = np.array_split(values, 7)
+        sketch = KLLSketch(200, seed=0).update(chunks[0])
+        for i, chunk in enumerate(chunks[1:]):
+            sketch.merge(KLLSketch(200, seed=i + 1).update(chunk))
+        self.assertEqual(sketch.n, len(values))
+        self.assertLess(sum(len(level) for level in sketch.levels), 2000)
+        q = np.array([0.05, 0.25, 0.5, 0.75, 0.95])
+        ranks = np.searchsorted(np.sort(values), sketch.quantile(q)) / \
+            len(values)
+        np.testing.assert_allclose(ranks, q, atol=0.02)
+        self.assertEqual(sketch.quantile(1), values.max())
+
+
+class TestDataCleaner(unittest.TestCase):
+    def setUp(self):
+        # the cleaner logs to logs/ under the working directory
+        self.cwd = os.getcwd()
+        self.folder = tempfile.TemporaryDirectory()
+        os.chdir(self.folder.name)
+        os.makedirs('logs')
+        self.cleaner = dataCleaner('cleaner tests')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.folder.cleanup()
+
+    def test_fix_chunks_like_whole_frame(self):
+        """
+        Test the two pass chunked fix: exact quantiles while the sketch is
+        small, and every chunk fixed with the same bounds
+        """
+        df = pd.DataFrame({'a': np.arange(100.0), 'b': np.arange(100) % 7})
+        chunks = [df.iloc[i:i + 30].copy() for i in range(0, 100, 30)]
+        sketches = self.cleaner.outlier_sketches(iter(chunks), k=200)
+        self.assertEqual(sorted(sketches), ['a', 'b'])
+        fixed = pd.concat([self.cleaner.fix_outlier_sketched(c, sketches)
+                           for c in chunks])
+        low, high, median = np.quantile(df['a'], [0.25, 0.75, 0.5],
+                                        method='inverted_cdf')
+        expected = np.where((df['a'] > high) | (df['a'] < low), median,
+                            df['a'])
+        np.testing.assert_array_equal(fixed['a'], expected)
+
+        clipped = self.cleaner.fix_outlier_sketched(
+            df.copy(), sketches, lower=None, upper=0.9, replace='clip')
+        self.assertEqual(clipped['a'].min(), 0)
+        self.assertEqual(clipped['a'].max(), sketches['a'].quantile(0.9))
+
+    def test_profile_cache(self):
+        """
+        Test that the profile matches pandas, is reused until the cleaner
+        modifies the frame and is exported as json
+        """
+        df = pd.DataFrame({'a': [1.0, np.nan, 3.0, 10.0, 4.0],
+                           'b': [5, 1, 2, 2, 9], 'c': list('vwxyz')})
+        profile = self.cleaner.profile(df)
+        self.assertIs(self.cleaner.profile(df), profile)
+        self.assertEqual(profile.loc['a', 'missing'], 1)
+        self.assertEqual(profile.loc['c', 'count'], 5)
+        self.assertAlmostEqual(profile.loc['a', 'median'], df['a'].median())
+        self.assertAlmostEqual(profile.loc['b', 'q95'], df['b'].quantile(0.95))
+        self.assertAlmostEqual(profile.loc['a', 'mean'], df['a'].mean())
+
+        df = self.cleaner.fillWithMedian(df, ['a'])
+        self.assertEqual(df['a'][1], 3.5)
+        refreshed = self.cleaner.profile(df)
+        self.assertIsNot(refreshed, profile)
+        self.assertEqual(refreshed.loc['a', 'missing'], 0)
+
+        self.cleaner.export_profile(refreshed, 'profile.json')
+        with open('profile.json') as saved:
+            columns = json.load(saved)
+        self.assertEqual(columns['a']['median'], 3.5)
+        self.assertIsNone(columns['c']['mean'])
+
+    def test_k_sweep_modes(self):
+        """
+        Test that the pool and the chunked distortion reproduce the serial
+        sweep, and that warm started mini batches find the three clusters
+        """
+        rng = np.random.default_rng(4)
+        X = pd.DataFrame(np.vstack([rng.normal(m, 1, (200, 2))
+                                    for m in (0, 6, 12)]))
+        distortions, inertias = self.cleaner.choose_k_means(X, 5, chunk=64)
+        parallel = self.cleaner.choose_k_means(X, 5, workers=2)
+        np.testing.assert_allclose(parallel[0], distortions)
+        for k in [1, 3]:
+            k_means = KMeans(n_clusters=k, random_state=777).fit(X)
+            self.assertAlmostEqual(inertias[k - 1], k_means.inertia_,
+                                   places=6)
+
+        warm = self.cleaner.choose_k_means(X, 5, minibatch=True,
+                                           warm_start=True)
+        self.assertLess(warm[1][2], warm[1][1] / 3)
+        self.assertLess(warm[1][2], 1.2 * inertias[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import unittest
+import sys, os
+sys.path.append(os.path.abspath(os.path.join('..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '..', 'scripts')))
+
+import tempfile
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+from sklearn.linear_model import LogisticRegression
+from mlHelper import machineLearningHelper
+from batchTrainer import pool_size, train_batch
+from modelRegistry import ModelRegistry
+from modelSearch import SuccessiveHalvingSearch
+from train_classifiers import TrainingClassifier
+from vocabularyEncoder import VocabularyEncoder
+
+
+def sample_features(rows=500, seed=0):
+    """
+    A small frame with the features of the browser split
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'experiment': rng.choice(['exposed', 'control'], rows),
+        'hour': rng.integers(0, 24, rows),
+        'device_make': rng.choice(['Samsung', 'Generic Smartphone',
+                                   'iPhone'], rows),
+        'browser': rng.choice(['Chrome Mobile', 'Facebook'], rows),
+    })
+
+
+class TestVocabularyEncoder(unittest.TestCase):
+    def test_codes_survive_a_reload(self):
+        """
+        Test that the codes match a label encoder, unseen values get the
+        reserved code and a saved encoder encodes the same way
+        """
+        df = sample_features()
+        encoder = VocabularyEncoder()
+        encoded = encoder.fit_transform(df)
+        self.assertEqual(encoder.columns,
+                         ['experiment', 'device_make', 'browser'])
+        # typed columns, as read by dataLoader, keep their codes too
+        df['date'] = pd.to_datetime(np.where(df['hour'] % 2, '2020-07-03',
+                                             '2020-07-04'))
+        df['platform_os'] = df['hour'] % 3 + 5
+        encoder = VocabularyEncoder(['experiment', 'device_make', 'browser',
+                                     'date', 'platform_os'])
+        encoded = encoder.fit_transform(df)
+        for column in encoder.columns:
+            np.testing.assert_array_equal(
+                encoded[column], LabelEncoder().fit_transform(df[column]))
+            self.assertTrue((encoded[column] >= 0).all())
+        np.testing.assert_array_equal(encoded['hour'], df['hour'])
+
+        new = df.head(3).copy()
+        new.loc[0, 'browser'] = 'Opera Mini'
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'vocabulary.json')
+            encoder.save(path)
+            loaded = VocabularyEncoder.load(path)
+        scored = loaded.transform(new)
+        self.assertEqual(scored.loc[0, 'browser'], -1)
+        pd.testing.assert_frame_equal(scored.iloc[1:], encoded.iloc[1:3])
+
+
+class TestAwarenessTarget(unittest.TestCase):
+    def setUp(self):
+        # the helper logs to ../logs, keep it out of the repository logs
+        self.cwd = os.getcwd()
+        self.folder = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.folder.name, 'logs'))
+        os.makedirs(os.path.join(self.folder.name, 'work'))
+        os.chdir(os.path.join(self.folder.name, 'work'))
+        self.helper = machineLearningHelper('test_ml')
+
+    def tearDown(self):
+        for handler in list(self.helper.logger.handlers):
+            self.helper.logger.removeHandler(handler)
+            handler.close()
+        os.chdir(self.cwd)
+        self.folder.cleanup()
+
+    def test_target_matches_row_labels(self):
+        """
+        Test that the vectorized label and mask match the row-wise labels,
+        whole or in chunks
+        """
+        rng = np.random.default_rng(1)
+        yes = rng.integers(0, 2, 300)
+        answered = rng.random(300) < 0.3
+        df = pd.DataFrame({'yes': np.where(answered, yes, 0),
+                           'no': np.where(answered, 1 - yes, 0)})
+        rows = df.apply(self.helper.label_awareness, axis=1)
+
+        label, valid = self.helper.awareness_target(df)
+        self.assertEqual(label.dtype, np.int8)
+        np.testing.assert_array_equal(valid, rows.notna())
+        np.testing.assert_array_equal(label[valid], rows[valid].astype(int))
+
+        chunks = [df.iloc[i:i + 64] for i in range(0, len(df), 64)]
+        targets = list(self.helper.iter_awareness_target(chunks))
+        np.testing.assert_array_equal(
+            np.concatenate([t[1] for t in targets]), label)
+        np.testing.assert_array_equal(
+            np.concatenate([t[2] for t in targets]), valid)
+
+
+class TestTrainingClassifier(unittest.TestCase):
+    def test_fold_backends_agree(self):
+        """
+        Test that the serial, thread and process fold runs give the same
+        scores and models, fitted on the typed columns of the frame
+        """
+        X = VocabularyEncoder().fit_transform(sample_features(600, seed=4))
+        X = X.astype({'hour': np.int8, 'browser': np.float32})
+        y = pd.Series((X['hour'] > 11).astype(int) ^
+                      (np.arange(600) % 7 == 0), name='awareness')
+        runs = []
+        for workers, backend in [(1, 'process'), (2, 'thread'),
+                                 (2, 'process')]:
+            trainer = TrainingClassifier(X[:500], X[500:], y[:500], y[500:],
+                                         'decision_tree')
+            trainer.clf.set_params(random_state=0)
+            _, accuracy, loss = trainer.train(4, workers, backend)
+            runs.append((accuracy, loss, trainer.fold_models))
+        for accuracy, loss, models in runs[1:]:
+            self.assertEqual(accuracy, runs[0][0])
+            self.assertEqual(loss, runs[0][1])
+            for model, first in zip(models, runs[0][2]):
+                self.assertEqual(list(model.feature_names_in_),
+                                 list(X.columns))
+                np.testing.assert_array_equal(model.predict(X),
+                                              first.predict(X))
+
+
+class TestBatchTrainer(unittest.TestCase):
+    def test_pool_matches_sequential_training(self):
+        """
+        Test the pool size limits and that a batch on a pool gives the
+        metrics and models of the same jobs trained one by one
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            for split in ['browser', 'platform_os']:
+                df = sample_features(400, seed=5)
+                if split == 'platform_os':
+                    df = df.drop(columns=['browser']).assign(
+                        platform_os=np.arange(400) % 3 + 5)
+                df['awareness'] = (df['hour'] > 11).astype(int) ^ \
+                    (np.arange(400) % 5 == 0)
+                df.to_csv(os.path.join(folder, f'{split}.csv'))
+            jobs = [(os.path.join(folder, f'{split}.csv'), classifier)
+                    for split in ['browser', 'platform_os']
+                    for classifier in ['decision_tree', 'random_forest']]
+
+            self.assertEqual(pool_size(jobs, workers=8), 4)
+            self.assertEqual(pool_size(jobs, workers=1), 1)
+            self.assertEqual(pool_size(jobs, 8, memory_per_job=1 << 60), 1)
+
+            serial = train_batch(jobs, os.path.join(folder, 'serial'),
+                                 folds=3, workers=1)
+            pooled = train_batch(jobs, os.path.join(folder, 'pooled'),
+                                 folds=3, workers=2)
+            columns = ['validation_accuracy', 'validation_loss',
+                       'test_accuracy', 'test_loss']
+            pd.testing.assert_frame_equal(
+                serial.set_index('name')[columns].sort_index(),
+                pooled.set_index('name')[columns].sort_index())
+            X = VocabularyEncoder.load(os.path.join(
+                folder, 'pooled', 'browser_random_forest_vocabulary.json')
+            ).transform(pd.read_csv(jobs[0][0], index_col=0).drop(
+                columns=['awareness']))
+            for name in ['serial', 'pooled']:
+                self.assertTrue(os.path.exists(os.path.join(
+                    folder, name, 'browser_random_forest_metrics.json')))
+            np.testing.assert_array_equal(
+                joblib.load(os.path.join(
+                    folder, 'serial', 'browser_random_forest.pkl')).predict(X),
+                joblib.load(os.path.join(
+                    folder, 'pooled', 'browser_random_forest.pkl')).predict(X))
+
+
+class TestModelSearch(unittest.TestCase):
+    def test_search_resumes_from_log(self):
+        """
+        Test that a search halves its candidates and that a rerun or an
+        extended search only runs the trials missing from the log
+        """
+        X = sample_features(900, seed=2).drop(columns=['experiment'])
+        X = VocabularyEncoder().fit_transform(X)
+        y = pd.Series((X['hour'] > 11).astype(int))
+        spaces = {'decision_tree': {'max_depth': [1, 2, 4, 8]},
+                  'logistic_regression': {'C': [0.1, 1.0]}}
+        with tempfile.TemporaryDirectory() as folder:
+            log = os.path.join(folder, 'trials.jsonl')
+            search = SuccessiveHalvingSearch(spaces, candidates=4,
+                                             min_rows=100, workers=1,
+                                             log_path=log)
+            best = search.run(X, y)
+            self.assertEqual(best['family'], 'decision_tree')
+            self.assertEqual(best['rows'], 900)
+            trials = search.results()
+            self.assertEqual(sorted(trials['rows'].unique()), [100, 300, 900])
+            self.assertTrue(trials.groupby('rows').size().is_monotonic_decreasing)
+
+            again = SuccessiveHalvingSearch(spaces, candidates=4,
+                                            min_rows=100, workers=1,
+                                            log_path=log)
+            self.assertEqual(again.run(X, y), best)
+            self.assertEqual(len(again.trials), len(trials))
+
+            spaces['decision_tree']['min_samples_leaf'] = [1, 50]
+            wider = SuccessiveHalvingSearch(spaces, candidates=4,
+                                            min_rows=100, workers=1,
+                                            log_path=log)
+            wider.run(X, y)
+            self.assertGreater(len(wider.trials), len(trials))
+
+            # the trials of another seed are not reused
+            reseeded = SuccessiveHalvingSearch(spaces, candidates=4,
+                                               min_rows=100, workers=1,
+                                               log_path=log, seed=78)
+            reseeded.run(X, y)
+            self.assertGreater(len(reseeded.trials), len(wider.trials))
+
+            # the winner is handed back to the trainer as is
+            trainer = TrainingClassifier(X, X, y, y, best)
+            self.assertEqual(trainer.title, 'Decision Tree Classifier')
+            self.assertEqual(
+                {name: trainer.clf.get_params()[name]
+                 for name in best['params']}, best['params'])
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_lazy_mapped_models_within_budget(self):
+        """
+        Test that models load on first use with mapped arrays, predict like
+        the originals and are evicted beyond the budget
+        """
+        X = VocabularyEncoder().fit_transform(sample_features(300, seed=3))
+        y = (X['hour'] > 11).astype(int)
+        models = {f'log_reg_{c}': LogisticRegression(C=c).fit(X, y)
+                  for c in [0.1, 1.0]}
+        with tempfile.TemporaryDirectory() as folder:
+            registry = ModelRegistry(folder)
+            for name, model in models.items():
+                registry.register(name, model)
+
+            budget = max(entry['size'] for entry in
+                         registry.models.values())
+            reloaded = ModelRegistry(folder, budget=budget)
+            self.assertEqual(reloaded.names(), sorted(models))
+            self.assertEqual(len(reloaded.cache), 0)
+            for name, model in models.items():
+                self.assertTrue(reloaded.verify(name))
+                loaded = reloaded.get(name)
+                self.assertIsInstance(loaded.coef_, np.memmap)
+                np.testing.assert_array_equal(loaded.predict(X),
+                                              model.predict(X))
+            self.assertEqual(list(reloaded.cache), ['log_reg_1.0'])
+            self.assertIs(reloaded.get('log_reg_1.0'),
+                          reloaded.get('log_reg_1.0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,481 @@
+import unittest
+import math
+import sys, os
+sys.path.append(os.path.abspath(os.path.join('..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '..', 'scripts')))
+
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sprtKernel import conditional_sprt, log_odds_normalizer
+from abTestHelper import ConditionalSPRT, abTestHelper
+from boundaryTable import BoundaryTable, build_boundary_table
+from sprtSimulator import _simulate_point
+from groupSequential import (group_sequential_bounds,
+                             group_sequential_test)
+from sequential_test_script import (hourly_counts, run_segmented_sprt,
+                                     transform_data)
+from bernoulliSeries import (bernoulli_series, cumulative_successes,
+                             unpack_series)
+
+
+def reference_stat(x, r, n, t1):
+    """
+    Meeker's log probability ratio log P_t1(x | r, n) - log P_1(x | r, n)
+    written directly from its definition
+    """
+    def prob(t):
+        terms = [math.comb(n, j) * math.comb(n, r - j) * t ** j
+                 for j in range(max(0, r - n), min(n, r) + 1)]
+        return math.comb(n, x) * math.comb(n, r - x) * t ** x / sum(terms)
+    return math.log(prob(t1)) - math.log(prob(1))
+
+
+class TestConditionalSPRT(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.x = (rng.random(400) < 0.6).astype(int)
+        self.y = (rng.random(400) < 0.4).astype(int)
+
+    def test_stats_match_definition(self):
+        """
+        Test that the vectorized statistics match Meeker's definition
+        """
+        res = conditional_sprt(self.x, self.y, 1.5)
+        n, x1, r, stats = res[1], res[7], res[8], res[9]
+        for i in range(0, 400, 37):
+            expected = reference_stat(int(x1[i]), int(r[i]), int(n[i]), 1.5)
+            self.assertAlmostEqual(stats[i], expected, places=9)
+
+    def test_odds_ratio_must_exceed_one(self):
+        """
+        Test that an odds ratio of at most 1 is rejected
+        """
+        for t1 in [1, 0.8, 0]:
+            self.assertRaises(ValueError, conditional_sprt, self.x, self.y,
+                              t1)
+
+    def test_normalizer_far_from_mode(self):
+        """
+        Test the windowed log-sum-exp when most terms are negligible
+        """
+        n = np.array([2000, 2000, 2000])
+        r = np.array([5, 2000, 3990])
+        z = log_odds_normalizer(r, n, 1.2)
+        for i in range(3):
+            # exact integer sum of C(n, j) C(n, r - j) 6^j 5^(top - j)
+            top = min(2000, int(r[i]))
+            total = sum(math.comb(2000, j) * math.comb(2000, int(r[i]) - j) *
+                        6 ** j * 5 ** (top - j)
+                        for j in range(max(0, int(r[i]) - 2000), top + 1))
+            expected = math.log(total) - top * math.log(5) - \
+                math.log(math.comb(4000, int(r[i])))
+            self.assertAlmostEqual(z[i], expected, places=9)
+
+    def test_result_tuple(self):
+        """
+        Test the shape of the returned 11-tuple and the decision index
+        """
+        res = conditional_sprt(self.x, self.y, 1.5)
+        self.assertEqual(len(res), 11)
+        outcome, n, k, l, u = res[:5]
+        stats, limits = res[9], res[10]
+        self.assertEqual(limits.shape, (400, 2))
+        self.assertTrue(stats[k] >= u or stats[k] <= l)
+        self.assertTrue(np.all((stats[:k] < u) & (stats[:k] > l)))
+        self.assertEqual(outcome, 'Exposed group produced a statistically ' +
+                         'significant increase.')
+
+    def test_early_exit(self):
+        """
+        Test that early exit stops the trace at the first crossing
+        """
+        full = conditional_sprt(self.x, self.y, 1.5)
+        res = conditional_sprt(self.x, self.y, 1.5, early_exit=True)
+        k = full[2]
+        self.assertEqual(res[0], full[0])
+        self.assertEqual(res[2], k)
+        self.assertEqual(len(res[1]), k + 1)
+        np.testing.assert_allclose(res[9], full[9][:k + 1])
+        np.testing.assert_array_equal(res[10], full[10][:k + 1])
+
+    def test_truncation(self):
+        """
+        Test that an undecided test is decided by the H0-conservative rule
+        at its truncation point and reads nothing past it
+        """
+        x = np.tile([1, 0], 300)
+        y = np.tile([0, 1], 300)
+        res = conditional_sprt(x, y, 1.1, stop=250.7)
+        self.assertEqual(len(res[1]), 250)
+        self.assertTrue(np.isnan(res[2]))
+        self.assertEqual(res[5], 250)
+        self.assertEqual(res[6], 'h0')
+        self.assertTrue(res[0].startswith('Maximum Limit Decision'))
+
+        # a clear increase that is still undecided at the cap
+        x = np.ones(20, dtype=int)
+        y = np.zeros(20, dtype=int)
+        res = conditional_sprt(x, y, 1.5, alpha=0.001, beta=0.001, stop=3)
+        self.assertEqual((res[5], res[6]), (3, 'h1'))
+
+        # fewer pairs than the cap: no truncation yet
+        res = conditional_sprt(x[:2], y[:2], 1.5, stop=3)
+        self.assertEqual(res[6], 'Non')
+        self.assertTrue(np.isnan(res[5]))
+
+
+class TestIncrementalSPRT(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.x = (rng.random(600) < 0.55).astype(int)
+        self.y = (rng.random(640) < 0.45).astype(int)
+        self.full = conditional_sprt(self.x, self.y, 1.3)
+
+    def test_batches_match_full_run(self):
+        """
+        Test that uneven hourly batches reproduce the full recomputation
+        """
+        sprt = ConditionalSPRT(self.x[:0], self.y[:0], 1.3)
+        cuts_x = [0, 50, 51, 300, 600]
+        cuts_y = [0, 80, 80, 310, 640]
+        stats = []
+        for i in range(4):
+            res = sprt.update(self.x[cuts_x[i]:cuts_x[i + 1]],
+                              self.y[cuts_y[i]:cuts_y[i + 1]])
+            stats.append(res[9])
+        np.testing.assert_allclose(np.concatenate(stats), self.full[9])
+        self.assertEqual(sprt.k, self.full[2])
+        self.assertEqual(sprt.outcome, self.full[0])
+        self.assertEqual(sprt.n, 600)
+        self.assertEqual(len(sprt.pending_control), 40)
+
+    def test_packed_series(self):
+        """
+        Test that (packed, length) pairs give the results of the 0/1 series,
+        in a full run and in a run followed by packed batches
+        """
+        x = self.x.astype(np.int8)
+        y = self.y.astype(np.int8)
+        packed_x = (np.packbits(x), len(x))
+        packed_y = (np.packbits(y), len(y))
+        res = conditional_sprt(packed_x, packed_y, 1.3)
+        for i in [0, 2, 5, 6]:
+            np.testing.assert_equal(res[i], self.full[i])
+        np.testing.assert_allclose(res[9], self.full[9])
+
+        sprt = ConditionalSPRT((np.packbits(x[:203]), 203),
+                               (np.packbits(y[:250]), 250), 1.3)
+        sprt.run()
+        self.assertEqual((sprt.n, sprt.x1, sprt.r),
+                         (203, x[:203].sum(), x[:203].sum() + y[:203].sum()))
+        res = sprt.update((np.packbits(x[203:]), len(x) - 203),
+                          (np.packbits(y[250:]), len(y) - 250))
+        np.testing.assert_allclose(res[9], self.full[9][203:])
+        np.testing.assert_equal(sprt.k, self.full[2])
+
+    def test_state_round_trip(self):
+        """
+        Test that a saved state resumes where it stopped
+        """
+        sprt = ConditionalSPRT(self.x[:0], self.y[:0], 1.3)
+        sprt.update(self.x[:200], self.y[:230])
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'state.npz')
+            sprt.save(path)
+            resumed = ConditionalSPRT.load(path)
+        res = resumed.update(self.x[200:], self.y[230:])
+        np.testing.assert_allclose(res[9], self.full[9][200:])
+        self.assertEqual(resumed.k, self.full[2])
+
+    def test_truncated_batches(self):
+        """
+        Test that batches stop at the truncation point with the decision of
+        the full truncated run
+        """
+        x = np.tile([1, 0], 300)
+        y = np.tile([0, 1], 300)
+        full = conditional_sprt(x, y, 1.1, stop=250)
+        sprt = ConditionalSPRT(x[:0], y[:0], 1.1, stop=250)
+        sprt.update(x[:200], y[:200])
+        self.assertEqual(sprt.truncate_decision, 'Non')
+        res = sprt.update(x[200:], y[200:])
+        self.assertEqual(sprt.n, 250)
+        self.assertEqual(len(sprt.pending_exposed), 0)
+        self.assertEqual((res[0], res[5], res[6]), (full[0], 250, full[6]))
+
+
+class TestBoundaryTable(unittest.TestCase):
+    def test_table_matches_kernel(self):
+        """
+        Test that the looked up limits equal the computed ones, including
+        observations beyond the table
+        """
+        rng = np.random.default_rng(3)
+        x = (rng.random(500) < 0.5).astype(int)
+        y = (rng.random(500) < 0.4).astype(int)
+        expected = conditional_sprt(x, y, 1.4)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'table.npy')
+            build_boundary_table(path, 1.4, 300)
+            table = BoundaryTable(path)
+            res = conditional_sprt(x, y, 1.4, table=table)
+            np.testing.assert_allclose(res[9], expected[9], atol=1e-8)
+            np.testing.assert_array_equal(res[10], expected[10])
+            self.assertRaises(ValueError, conditional_sprt, x, y, 1.5,
+                              table=table)
+
+            # a band of the rates only holds part of the rows
+            banded = os.path.join(folder, 'banded.npy')
+            build_boundary_table(banded, 1.4, 300, rates=(0.3, 0.6))
+            band = BoundaryTable(banded)
+            self.assertLess(band.z.size, table.z.size / 2)
+            n = np.arange(100, 301)
+            self.assertTrue(band.covers(n * 9 // 10, n).all())
+            self.assertFalse(band.covers(n * 3 // 2, n).any())
+            res = conditional_sprt(x, y, 1.4, table=band)
+            np.testing.assert_allclose(res[9], expected[9], atol=1e-8)
+            np.testing.assert_array_equal(res[10], expected[10])
+            self.assertRaises(ValueError, build_boundary_table, banded, 1.4,
+                              100000)
+            del table, band, res
+
+
+class TestSimulator(unittest.TestCase):
+    def test_replicates_match_kernel(self):
+        """
+        Test that the lock step replicates decide like the kernel does on
+        the same streams
+        """
+        seed = np.random.SeedSequence(5)
+        res = _simulate_point((0.2, 1.5, 1.5, 0.05, 0.10, 300, 40, seed))
+
+        # a single draw block holds the whole stream of every replicate
+        rng = np.random.default_rng(seed)
+        xs = rng.random((300, 40)) < res['p_exposed']
+        ys = rng.random((300, 40)) < 0.2
+        decisions, samples = [], []
+        for j in range(40):
+            out = conditional_sprt(xs[:, j].astype(int), ys[:, j].astype(int),
+                                   1.5, early_exit=True)
+            if np.isnan(out[2]):
+                decisions.append(0)
+                samples.append(300)
+            else:
+                decisions.append(1 if out[9][-1] >= out[4] else -1)
+                samples.append(out[2] + 1)
+        decisions = np.array(decisions)
+        self.assertAlmostEqual(res['reject_null'], np.mean(decisions == 1))
+        self.assertAlmostEqual(res['accept_null'], np.mean(decisions == -1))
+        self.assertAlmostEqual(res['asn'], np.mean(samples))
+
+
+class TestBernoulliSeries(unittest.TestCase):
+    def test_series_counts_and_seed(self):
+        """
+        Test that every hour keeps its counts, that the seed fixes the
+        series and that the packed form gives the same cumulative sums
+        """
+        engagement = np.array([5, 3, 3, 0, 1000, 17])
+        success = np.array([2, 0, 3, 0, 420, 16])
+        series = bernoulli_series(engagement, success, seed=9)
+        self.assertEqual(series.dtype, np.int8)
+        edges = np.concatenate([[0], np.cumsum(engagement)])
+        for i in range(len(engagement)):
+            self.assertEqual(series[edges[i]:edges[i + 1]].sum(), success[i])
+        np.testing.assert_array_equal(
+            series, bernoulli_series(engagement, success, seed=9))
+        self.assertFalse(np.array_equal(
+            series, bernoulli_series(engagement, success, seed=10)))
+
+        packed = bernoulli_series(engagement, success, seed=9, packed=True)
+        self.assertEqual(len(packed), math.ceil(len(series) / 8))
+        np.testing.assert_array_equal(unpack_series(packed, len(series)),
+                                      series)
+        np.testing.assert_array_equal(
+            cumulative_successes(packed, len(series), chunk=64),
+            np.cumsum(series))
+        with self.assertRaises(ValueError):
+            cumulative_successes(packed, len(series), chunk=60)
+
+    def test_series_memory(self):
+        """
+        Test that building a series takes about one byte per observation
+        """
+        engagement = np.full(240, 10000)
+        success = engagement // 7
+        tracemalloc.start()
+        try:
+            series = bernoulli_series(engagement, success, seed=1)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(series.nbytes, engagement.sum())
+        self.assertLess(peak, 2 * series.nbytes)
+
+
+class TestGroupSequential(unittest.TestCase):
+    def test_bounds_match_published_values(self):
+        """
+        Test the Lan-DeMets bounds of five equally spaced looks against the
+        tabulated ones
+        """
+        looks = np.arange(1, 6) / 5
+        np.testing.assert_allclose(
+            group_sequential_bounds(looks, 0.025),
+            [4.877, 3.357, 2.680, 2.290, 2.031], atol=2e-3)
+        np.testing.assert_allclose(
+            group_sequential_bounds(looks, 0.05, 'pocock', sides=2),
+            [2.438, 2.427, 2.410, 2.397, 2.386], atol=2e-3)
+
+    def test_hourly_decision(self):
+        """
+        Test that a clear increase is detected at an interim hour and that
+        hours without a look are skipped
+        """
+        engagement = np.full(24, 400)
+        control_success = np.full(24, 40)
+        exposed_success = np.full(24, 80)
+        engagement_c = engagement.copy()
+        engagement_c[0], control_success[0] = 0, 0
+        outcome, k, fractions, stats, bounds = group_sequential_test(
+            engagement, exposed_success, engagement_c, control_success,
+            engagement.sum() + engagement_c.sum())
+        self.assertTrue(np.isnan(stats[0]) and np.isnan(bounds[0]))
+        self.assertTrue(0 < k < 23)
+        self.assertTrue(stats[k] >= bounds[k])
+        self.assertEqual(fractions[-1], 1)
+        self.assertEqual(outcome, 'Exposed group produced a statistically ' +
+                         'significant increase.')
+
+        # the bounds of the hours seen so far do not move with later hours
+        partial = group_sequential_test(
+            engagement[:5], exposed_success[:5], engagement_c[:5],
+            control_success[:5], engagement.sum() + engagement_c.sum())
+        np.testing.assert_array_equal(partial[4], bounds[:5])
+        with self.assertRaises(ValueError):
+            group_sequential_test(engagement, exposed_success, engagement_c,
+                                  control_success, None)
+
+    def test_helper_rejects_bad_design(self):
+        """
+        Test that the helper method raises the error of an invalid design
+        instead of returning a partial result
+        """
+        df = pd.DataFrame({'date': pd.to_datetime(['2020-07-03'] * 4),
+                           'hour': [1, 1, 2, 2],
+                           'experiment': ['exposed', 'control'] * 2,
+                           'yes': [1, 0, 1, 1], 'no': [0, 1, 0, 0]})
+        # the helper logs to ../logs, keep it out of the repository logs
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'logs'))
+            os.makedirs(os.path.join(folder, 'work'))
+            os.chdir(os.path.join(folder, 'work'))
+            try:
+                helper = abTestHelper('test_sprt')
+                for design in [{'max_sample': None}, {'max_sample': 0},
+                               {'max_sample': 8, 'alpha': 1.5},
+                               {'max_sample': 8, 'kind': 'haybittle'},
+                               {'max_sample': 8, 'sides': 3}]:
+                    with self.assertRaises(ValueError):
+                        helper.groupSequentialTest(df, **design)
+                hours, res = helper.groupSequentialTest(df, 8)
+            finally:
+                for handler in list(helper.logger.handlers):
+                    helper.logger.removeHandler(handler)
+                    handler.close()
+                os.chdir(cwd)
+        self.assertEqual(len(hours), 2)
+        self.assertEqual(len(res[2]), 2)
+
+
+class TestSegmentedSPRT(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(12)
+        rows = 3000
+        answered = rng.random(rows) < 0.3
+        yes = rng.integers(0, 2, rows)
+        self.df = pd.DataFrame({
+            'experiment': rng.choice(['exposed', 'control'], rows),
+            'date': rng.choice(['2020-07-03', '2020-07-04'], rows),
+            'hour': rng.integers(0, 24, rows),
+            'browser': rng.choice(['Chrome Mobile', 'Facebook', 'Opera'],
+                                  rows),
+            'platform_os': rng.choice([5, 6], rows),
+            'yes': np.where(answered, yes, 0),
+            'no': np.where(answered, 1 - yes, 0),
+        })
+
+    def test_segments_match_direct_tests(self):
+        """
+        Test that every segment is tested on its own rows, the same on a
+        pool as in this process
+        """
+        res = run_segmented_sprt(self.df, by=('browser', 'platform_os'),
+                                 t1=1.5, workers=1, seed=3)
+        self.assertEqual(len(res), 5)
+        self.assertTrue(res.equals(run_segmented_sprt(
+            self.df, by=('browser', 'platform_os'), t1=1.5, workers=2,
+            seed=3)))
+
+        seeds = np.random.SeedSequence(3).spawn(len(res))
+        for i, row in res.iterrows():
+            segment = self.df[self.df[row['segment']] == row['value']]
+            engaged = segment[(segment['yes'] + segment['no']) > 0]
+            self.assertEqual(row['exposed'],
+                             (engaged['experiment'] == 'exposed').sum())
+            self.assertEqual(row['control'],
+                             (engaged['experiment'] == 'control').sum())
+            control, exposed = transform_data(segment, seed=seeds[i])
+            direct = conditional_sprt(exposed, control, 1.5,
+                                      early_exit=True)
+            self.assertEqual(row['outcome'], direct[0])
+            self.assertEqual(row['numberOfObservation'], len(direct[1]))
+
+    def test_unused_categories(self):
+        """
+        Test that the categories without rows of a categorical column get
+        no segment
+        """
+        df = self.df.astype({'browser': 'category'})
+        df = df[df['browser'] != 'Opera']
+        self.assertIn('Opera', df['browser'].cat.categories)
+        res = run_segmented_sprt(df, by=('browser',), t1=1.5, workers=1,
+                                 seed=3)
+        self.assertEqual(sorted(res['value']), ['Chrome Mobile', 'Facebook'])
+
+    def test_missing_group(self):
+        """
+        Test that a group without engaged users gives an empty series
+        """
+        control = self.df[self.df['experiment'] == 'control']
+        counts = hourly_counts(control)
+        self.assertEqual(len(counts['exposed'][0]), 0)
+        control_series, exposed_series = transform_data(control, seed=1)
+        self.assertEqual(len(exposed_series), 0)
+        self.assertEqual(len(control_series), counts['control'][0].sum())
+
+        # the helper logs to ../logs, keep it out of the repository logs
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'logs'))
+            os.makedirs(os.path.join(folder, 'work'))
+            os.chdir(os.path.join(folder, 'work'))
+            try:
+                helper = abTestHelper('test_sprt')
+                helper_control, helper_exposed = helper.transform_data(
+                    control, seed=1)
+            finally:
+                for handler in list(helper.logger.handlers):
+                    helper.logger.removeHandler(handler)
+                    handler.close()
+                os.chdir(cwd)
+        self.assertEqual(len(helper_exposed), 0)
+        np.testing.assert_array_equal(helper_control, control_series)
+
+
+if __name__ == '__main__':
+    unittest.main()